@@ -3,7 +3,7 @@
 
 import argparse
 
-from ReconstructOrder.workflow import reconstruct_batch
+from ReconstructOrder.workflow import reconstruct_batch, run_queue_worker, watch_acquisition, dry_run
 
 
 def parse_args():
@@ -17,6 +17,20 @@ def parse_args():
 
     parser.add_argument('--config', type=str,
                        help='path to yaml configuration file')
+    parser.add_argument('--queue', type=str, default=None,
+                       help='path to a SQLite work queue shared by workers on one or several machines. '
+                            'Runs this process as a worker of the queue')
+    parser.add_argument('--lease_time', type=float, default=600,
+                       help='seconds a task claimed from the work queue is reserved for this worker')
+    parser.add_argument('--watch', action='store_true',
+                       help='reconstruct the images while the acquisition is running, as soon as they are written')
+    parser.add_argument('--poll_interval', type=float, default=10,
+                       help='seconds between two checks for new images in watch mode')
+    parser.add_argument('--idle_timeout', type=float, default=3600,
+                       help='seconds without new images after which the watch mode stops')
+    parser.add_argument('--dry_run', action='store_true',
+                       help='print the channels read and the computations done for the output channels, '
+                            'without reconstructing')
 
     args = parser.parse_args()
     return args
@@ -24,4 +38,11 @@ def parse_args():
 
 def main():
     args = parse_args()
-    reconstruct_batch(args.config)
+    if args.dry_run:
+        dry_run(args.config)
+    elif args.queue:
+        run_queue_worker(args.config, args.queue, lease_time=args.lease_time)
+    elif args.watch:
+        watch_acquisition(args.config, poll_interval=args.poll_interval, idle_timeout=args.idle_timeout)
+    else:
+        reconstruct_batch(args.config)
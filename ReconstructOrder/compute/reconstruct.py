@@ -1,3 +1,4 @@
+import os
 import numpy as np
 import cv2
 from ..utils.background_estimator import BackgroundEstimator2D
@@ -9,6 +10,91 @@ from ..datastructures import IntensityData, StokesData, PhysicalData
 from typing import Union
 
 
+class ReconstructionWorkspace(object):
+    """
+    Preallocated arrays for the outputs of the ImgReconstructor methods, reused from one
+    z-block to the next instead of allocating new full-size arrays for each block
+
+    The arrays are allocated on first use and kept while the blocks have the same shape.
+    The outputs written to the workspace are overwritten by the next block: they have to
+    be used or copied before the next block is reconstructed. The arrays are not pickled,
+    each copy of a workspace allocates its own.
+
+    Parameters
+    ----------
+    dtype : numpy dtype
+        floating point type of the reconstruction, see ImgReconstructor.dtype
+
+    """
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self._arrays = {}
+
+    def __getstate__(self):
+        return {'dtype': self.dtype, '_arrays': {}}
+
+    def array(self, name, shape, dtype=None):
+        """array called name with shape, of type dtype (the workspace type if None). The array
+        of a previous call with another shape or type is released"""
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        array = self._arrays.get(name)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = self._arrays[name] = np.empty(shape, dtype=dtype)
+        return array
+
+    def stokes(self, shape) -> np.ndarray:
+        """(4,) + shape array for the output of ImgReconstructor.compute_stokes_batch"""
+        return self.array('stokes', (4,) + tuple(shape))
+
+    def normalized_stokes(self, shape) -> StokesData:
+        """StokesData with arrays for the outputs of ImgReconstructor.stokes_normalization"""
+        stokes = StokesData()
+        [stokes.s1_norm,
+         stokes.s2_norm,
+         stokes.polarization] = [self.array(name, shape) for name in ['s1_norm', 's2_norm', 'polarization']]
+        return stokes
+
+    def physical_data(self, shape) -> PhysicalData:
+        """PhysicalData with arrays for the outputs of ImgReconstructor.reconstruct_birefringence"""
+        phys_data = PhysicalData()
+        [phys_data.I_trans,
+         phys_data.retard,
+         phys_data.azimuth,
+         phys_data.polarization] = [self.array(name, shape) for name in ['I_trans', 'retard', 'azimuth',
+                                                                          'polarization_out']]
+        return phys_data
+
+
+def memmap_physical_data(output_dir, shape, dtype=np.float32) -> PhysicalData:
+    """
+    PhysicalData with I_trans, retard, azimuth and polarization arrays memory-mapped to
+    .npy files in output_dir, for the output of ImgReconstructor.reconstruct_birefringence_tiled
+
+    Parameters
+    ----------
+    output_dir : str
+        directory of the files, I_trans.npy, retard.npy, azimuth.npy and polarization.npy.
+        Existing files are overwritten
+    shape : tuple
+        shape of the images, (y, x) or (y, x, z)
+    dtype : numpy dtype
+        type of the images, see ImgReconstructor.dtype
+
+    Returns
+    -------
+    PhysicalData
+        np.memmap arrays, the files can be opened with np.load(path, mmap_mode='r')
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    phys_data = PhysicalData()
+    for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+        setattr(phys_data, name, np.lib.format.open_memmap(os.path.join(output_dir, name + '.npy'), mode='w+',
+                                                           dtype=dtype, shape=tuple(shape)))
+    return phys_data
+
+
 class ImgReconstructor:
     """
     ImgReconstructor contains methods to compute physical properties of birefringence
@@ -37,6 +123,9 @@ class ImgReconstructor:
     circularity : str
          ('lcp' or 'rcp') the circularity of the analyzer looking from the detector's point of view.
         Changing this flag will flip the slow axis horizontally.
+    precision : str
+        'float32' or 'float64', floating point type of the Stokes parameters and the physical
+        properties computed from them
 
     Attributes
     ----------
@@ -59,8 +148,10 @@ class ImgReconstructor:
     circularity : str
          ('lcp' or 'rcp') the circularity of the analyzer looking from the detector's point of view.
         Changing this flag will flip the slow axis horizontally.
+    dtype : numpy dtype
+        floating point type of the computations
     inst_mat_inv : 2d array
-        inverse of the instrument matrix
+        inverse of the instrument matrix, of type dtype
     stokes_param_bg_tm :
         transformed global background Stokes parameters
     stokes_param_bg_local_tm :
@@ -79,7 +170,8 @@ class ImgReconstructor:
                  azimuth_offset   = 0,
                  circularity      = 'rcp',
                  use_gpu          = False,
-                 gpu_id           = 0):
+                 gpu_id           = 0,
+                 precision        = 'float32'):
 
         # image params
         self._n_chann = 4
@@ -95,6 +187,9 @@ class ImgReconstructor:
         self.poly_fit_order   = poly_fit_order
         self.use_gpu          = use_gpu
         self.gpu_id           = gpu_id
+        if precision not in ['float32', 'float64']:
+            raise ValueError('precision has to be "float32" or "float64"')
+        self.dtype            = np.dtype(precision)
         
         if self.use_gpu:
             
@@ -123,7 +218,8 @@ class ImgReconstructor:
             raise Exception('Expected image shape is (channel, y, x, z)...'
                             'The number of channels is {}, but allowed values are 4 or 5'.format(self._n_chann))
 
-        self.inst_mat_inv = np.linalg.pinv(inst_mat)
+        # float32 intensities would be converted to float64 by a float64 matrix
+        self.inst_mat_inv = np.linalg.pinv(inst_mat).astype(self.dtype)
         self.azimuth_offset = azimuth_offset/180*np.pi
         # self.stokes_param_bg_tm = []
 
@@ -145,19 +241,22 @@ class ImgReconstructor:
         else:
             [self._n_chann, self._height, self._width, self._depth] = shape
 
-    def compute_stokes(self, int_obj: IntensityData) -> StokesData:
+    def raw_intensities(self, int_obj: IntensityData, out: np.ndarray=None) -> np.ndarray:
         """
-        Given raw polarization images, compute stokes images
+        Stack the polarization channels in the order of the instrument matrix
 
         Parameters
         ----------
         int_obj : IntensityData
             input image with shape (channel, y, x) or (channel, y, x, z)
+        out : nd array
+            array with shape (n_chann, y, x) or (n_chann, y, x, z) the channels are copied to,
+            e.g. the z-slice of a buffer of a z-stack. A new array if None
 
         Returns
         -------
-        stokes parameters : list of nd array.
-            [s0, s1, s2, s3]
+        nd array
+            intensities with shape (n_chann, y, x) or (n_chann, y, x, z)
 
         """
         if not isinstance(int_obj, IntensityData):
@@ -167,34 +266,84 @@ class ImgReconstructor:
         if self.img_shape[1:] != list(np.shape(int_obj.get_image('IExt'))):
             raise ValueError("Instrument matrix dimensions do not match supplied intensity dimensions")
 
+        chan_names = self._chan_names()
+        if out is None:
+            return np.stack([int_obj.get_image(chan_name) for chan_name in chan_names])
+        for img_out, chan_name in zip(out, chan_names):
+            img_out[...] = int_obj.get_image(chan_name)
+        return out
+
+    def _chan_names(self):
+        """order the channel following stokes calculus convention"""
         if self._n_chann == 4:
-            img_raw = np.stack((int_obj.get_image('IExt'),
-                                int_obj.get_image('I45'),
-                                int_obj.get_image('I90'),
-                                int_obj.get_image('I135')))  # order the channel following stokes calculus convention
+            return ['IExt', 'I45', 'I90', 'I135']
         elif self._n_chann == 5:
-            img_raw = np.stack((int_obj.get_image('IExt'),
-                                int_obj.get_image('I0'),
-                                int_obj.get_image('I45'),
-                                int_obj.get_image('I90'),
-                                int_obj.get_image('I135')))  # order the channel following stokes calculus convention
+            return ['IExt', 'I0', 'I45', 'I90', 'I135']
         else:
             raise ValueError("Intensity data first dim must be # of channels.  Only n_chann = 4 or 5 implemented")
 
+    def compute_stokes(self, int_obj: IntensityData) -> StokesData:
+        """
+        Given raw polarization images, compute stokes images
+
+        Parameters
+        ----------
+        int_obj : IntensityData
+            input image with shape (channel, y, x) or (channel, y, x, z)
+
+        Returns
+        -------
+        stokes parameters : list of nd array.
+            [s0, s1, s2, s3]
+
+        """
+        return self.compute_stokes_batch(self.raw_intensities(int_obj))
+
+    def compute_stokes_batch(self, img_raw: np.ndarray, out: np.ndarray=None) -> StokesData:
+        """
+        Compute the stokes images of a stack of raw polarization images with one matrix multiply
+
+        Parameters
+        ----------
+        img_raw : nd array
+            C-contiguous intensities from raw_intensities, with shape (n_chann, y, x) or (n_chann, y, x, z)
+        out : nd array
+            C-contiguous array of type dtype with shape (4, y, x) or (4, y, x, z) the stokes images
+            are written to. A new array if None
+
+        Returns
+        -------
+        StokesData
+            s0, s1, s2 and s3, views of out
+
+        """
+        if img_raw.shape[0] != self._n_chann or list(img_raw.shape[1:3]) != self.img_shape[1:]:
+            raise ValueError("Instrument matrix dimensions do not match supplied intensity dimensions")
+        if out is None:
+            out = np.empty((4,) + img_raw.shape[1:], dtype=self.dtype)
+        elif out.shape != (4,) + img_raw.shape[1:] or out.dtype != self.dtype or not out.flags.c_contiguous:
+            raise ValueError("out must be a C-contiguous {} array with shape {}".format(self.dtype,
+                                                                                         (4,) + img_raw.shape[1:]))
+        return self._stokes_dot(img_raw, out)
+
+    def _stokes_dot(self, img_raw, out):
+        """compute_stokes_batch without the checks of the image shape, e.g. for a tile of the image"""
+        if img_raw.dtype.kind == 'f':
+            img_raw = img_raw.astype(self.dtype, copy=False)
+
         # calculate stokes
-        img_raw_flat = np.reshape(img_raw, (self._n_chann, -1))
-        img_stokes_flat = np.dot(self.inst_mat_inv, img_raw_flat)
-        img_stokes = np.reshape(img_stokes_flat, [4,] + self.img_shape[1:])
+        # integer intensities are converted to float once, by the matrix multiply
+        np.dot(self.inst_mat_inv, np.reshape(img_raw, (self._n_chann, -1)), out=np.reshape(out, (4, -1)))
 
-        out = StokesData()
-        [out.s0,
-         out.s1,
-         out.s2,
-         out.s3] = [img_stokes[i, ...] for i in range(4)]
+        stokes = StokesData()
+        [stokes.s0,
+         stokes.s1,
+         stokes.s2,
+         stokes.s3] = [out[i, ...] for i in range(4)]
 
-        return out
+        return stokes
 
-    def stokes_normalization(self, stokes_param: StokesData) -> StokesData:
+    def stokes_normalization(self, stokes_param: StokesData, out: StokesData=None) -> StokesData:
         """
         Computes S1 and S2 norms.  Computes normalized polarization.
 
@@ -202,19 +351,23 @@ class ImgReconstructor:
         ----------
         stokes_param : Union[StokesData, StokesData]
             object of type StokesData or StokesData
+        out : StokesData
+            object with s1_norm, s2_norm and polarization arrays the normalized images are
+            written to, e.g. from ReconstructionWorkspace.normalized_stokes. A new object if None
 
         Returns
         -------
         StokesData :
-            object of type StokesData
+            object of type StokesData, out if it is not None
 
         """
         if not isinstance(stokes_param, StokesData):
             raise TypeError("stokes_param must be of type StokesData")
 
-        norm_dat = StokesData()
+        norm_dat = StokesData() if out is None else out
         
-        [s0, s1, s2, s3] = stokes_param.data
+        stokes_data = [img.astype(self.dtype, copy=False) for img in stokes_param.data]
+        [s0, s1, s2, s3] = stokes_data
         
         if self.use_gpu:
             s0 = cp.array(s0)
@@ -226,7 +379,17 @@ class ImgReconstructor:
             norm_dat.s1_norm      = cp.asnumpy(s1 / s3)
             norm_dat.s2_norm      = cp.asnumpy(s2 / s3)
             norm_dat.polarization = cp.asnumpy(cp.sqrt(s1 ** 2 + s2 ** 2 + s3 ** 2) / s0)
-            
+
+        elif out is not None:
+            # the same operations as below, in the arrays of out. s1_norm holds the squares until the end
+            np.square(s1, out=out.polarization)
+            np.add(out.polarization, np.square(s2, out=out.s1_norm), out=out.polarization)
+            np.add(out.polarization, np.square(s3, out=out.s1_norm), out=out.polarization)
+            np.sqrt(out.polarization, out=out.polarization)
+            np.divide(out.polarization, s0, out=out.polarization)
+            np.divide(s1, s3, out=out.s1_norm)
+            np.divide(s2, s3, out=out.s2_norm)
+
         else:
             
             # set norm_dat's normalized data
@@ -239,11 +402,12 @@ class ImgReconstructor:
         [norm_dat.s0,
          norm_dat.s1,
          norm_dat.s2,
-         norm_dat.s3] = stokes_param.data
+         norm_dat.s3] = stokes_data
 
         return norm_dat
 
-    def correct_background_stokes(self, sample_norm_obj: StokesData, bg_norm_obj: StokesData) -> StokesData:
+    def correct_background_stokes(self, sample_norm_obj: StokesData, bg_norm_obj: StokesData,
+                                  out: StokesData=None) -> StokesData:
         """
         correct background of transformed Stokes parameters
 
@@ -253,30 +417,47 @@ class ImgReconstructor:
             Object of type StokesData from normalized sample
         bg_norm_obj : StokesData
             Object of type StokesData from normalized background
+        out : StokesData
+            object with s0, polarization, s1_norm and s2_norm arrays the corrected images are
+            written to. It can be sample_norm_obj, to correct its arrays in place. The attributes
+            of sample_norm_obj are replaced by new arrays if None
 
         Returns
         -------
         StokesData
-            Object of type StokesData with correction
+            Object of type StokesData with correction, out if it is not None. The background
+            is not modified, it can be shared by several samples
         """
+        # e.g. the float64 local background of a polynomial fit
+        bg_s0, bg_polarization, bg_s1_norm, bg_s2_norm = \
+            [img.astype(self.dtype, copy=False) for img in
+             [bg_norm_obj.s0, bg_norm_obj.polarization, bg_norm_obj.s1_norm, bg_norm_obj.s2_norm]]
         # add a dummy z-dimension to background if sample image has xyz dimension
-        if len(bg_norm_obj.s0.shape) < len(sample_norm_obj.s0.shape):
+        if len(bg_s0.shape) < len(sample_norm_obj.s0.shape):
             # add blank axis to end of background images so it matches dim of input image
-            bg_norm_obj.s0           = bg_norm_obj.s0[..., np.newaxis]
-            bg_norm_obj.polarization = bg_norm_obj.polarization[..., np.newaxis]
-            bg_norm_obj.s1_norm      = bg_norm_obj.s1_norm[..., np.newaxis]
-            bg_norm_obj.s2_norm      = bg_norm_obj.s2_norm[..., np.newaxis]
+            bg_s0, bg_polarization, bg_s1_norm, bg_s2_norm = \
+                [img[..., np.newaxis] for img in [bg_s0, bg_polarization, bg_s1_norm, bg_s2_norm]]
+
+        if out is not None:
+            np.divide(sample_norm_obj.s0.astype(self.dtype, copy=False), bg_s0, out=out.s0)
+            np.divide(sample_norm_obj.polarization.astype(self.dtype, copy=False), bg_polarization,
+                      out=out.polarization)
+            np.subtract(sample_norm_obj.s1_norm.astype(self.dtype, copy=False), bg_s1_norm, out=out.s1_norm)
+            np.subtract(sample_norm_obj.s2_norm.astype(self.dtype, copy=False), bg_s2_norm, out=out.s2_norm)
+            [out.s1, out.s2, out.s3] = [sample_norm_obj.s1, sample_norm_obj.s2, sample_norm_obj.s3]
+            return out
 
         # perform the correction
-        sample_norm_obj.s0           = sample_norm_obj.s0 / bg_norm_obj.s0
-        sample_norm_obj.polarization = sample_norm_obj.polarization / bg_norm_obj.polarization
-        sample_norm_obj.s1_norm      = sample_norm_obj.s1_norm - bg_norm_obj.s1_norm
-        sample_norm_obj.s2_norm      = sample_norm_obj.s2_norm - bg_norm_obj.s2_norm
+        sample_norm_obj.s0           = sample_norm_obj.s0.astype(self.dtype, copy=False) / bg_s0
+        sample_norm_obj.polarization = sample_norm_obj.polarization.astype(self.dtype, copy=False) / bg_polarization
+        sample_norm_obj.s1_norm      = sample_norm_obj.s1_norm.astype(self.dtype, copy=False) - bg_s1_norm
+        sample_norm_obj.s2_norm      = sample_norm_obj.s2_norm.astype(self.dtype, copy=False) - bg_s2_norm
 
 
         return sample_norm_obj
 
-    def correct_background(self, sample_data: StokesData, background_data: StokesData) -> StokesData:
+    def correct_background(self, sample_data: StokesData, background_data: StokesData,
+                           local_background: StokesData=None, out: StokesData=None) -> StokesData:
         """
         Corrects background and (optionally) does local_fit or local_filter
 
@@ -286,11 +467,17 @@ class ImgReconstructor:
             Object of type StokesData
         background_data : StokesData
             Object of type StokesData
+        local_background : StokesData
+            local background computed beforehand by compute_local_background, e.g. from the
+            z-average of a stack whose slices are corrected one at a time. Estimated from
+            sample_data if None
+        out : StokesData
+            object the corrected images are written to, see correct_background_stokes
 
         Returns
         -------
         StokesData
-            Corrected data using local_fit, local_filter or global
+            Corrected data using local_fit, local_filter or global, out if it is not None
 
         """
 
@@ -299,30 +486,39 @@ class ImgReconstructor:
                 'Input image has to have >1 z-slice for n_slice_local_bg > 1'
 
         # sample_stokes_norm_corrected has z-appended
-        sample_stokes_norm_corrected = self.correct_background_stokes(sample_data, background_data)
+        sample_stokes_norm_corrected = self.correct_background_stokes(sample_data, background_data, out=out)
 
         # if local BG correction
-        if self.bg_method in ['Local_filter', 'Local_fit']:
-            # average only along these 'correction' attributes
-            correction = ['s0', 'polarization', 's1_norm', 's2_norm', 's3']
-
-            sample_stokes_norm_local = StokesData()
-            # if z-axis is present, average across all z for local BG correction
-            ax = 2  # if len(sample_stokes_norm_corrected.s0.shape) > 2 else None
-            [sample_stokes_norm_local.s0,
-             sample_stokes_norm_local.polarization,
-             sample_stokes_norm_local.s1_norm,
-             sample_stokes_norm_local.s2_norm,
-             sample_stokes_norm_local.s3] = [np.mean(img, axis=ax) if ax else img for img in
-                                       [sample_stokes_norm_corrected.__getattribute__(corr) for corr in correction]]
+        if self.bg_method in ['Local_filter', 'Local_fit'] and local_background is not None:
+            sample_stokes_norm_corrected = self.correct_background_stokes(sample_stokes_norm_corrected, local_background,
+                                                                          out=out)
 
-            local_background = self.compute_local_background(sample_stokes_norm_local)
+        elif self.bg_method in ['Local_filter', 'Local_fit']:
+            local_background = self.compute_local_background(self._z_average(sample_stokes_norm_corrected))
 
 
-            sample_stokes_norm_corrected = self.correct_background_stokes(sample_stokes_norm_corrected, local_background)
+            sample_stokes_norm_corrected = self.correct_background_stokes(sample_stokes_norm_corrected, local_background,
+                                                                          out=out)
 
         return sample_stokes_norm_corrected
 
+    @staticmethod
+    def _z_average(sample_stokes_norm_corrected: StokesData) -> StokesData:
+        """z-average of the Stokes parameters the local background is estimated from"""
+        # average only along these 'correction' attributes
+        correction = ['s0', 'polarization', 's1_norm', 's2_norm', 's3']
+
+        sample_stokes_norm_local = StokesData()
+        # if z-axis is present, average across all z for local BG correction
+        ax = 2  # if len(sample_stokes_norm_corrected.s0.shape) > 2 else None
+        [sample_stokes_norm_local.s0,
+         sample_stokes_norm_local.polarization,
+         sample_stokes_norm_local.s1_norm,
+         sample_stokes_norm_local.s2_norm,
+         sample_stokes_norm_local.s3] = [np.mean(img, axis=ax) if ax else img for img in
+                                   [sample_stokes_norm_corrected.__getattribute__(corr) for corr in correction]]
+        return sample_stokes_norm_local
+
     def compute_local_background(self, stokes_param_sm_local_tm: StokesData) -> StokesData:
         """
         Estimate local Stokes background using Guassian filter
@@ -336,10 +532,13 @@ class ImgReconstructor:
         StokesData
             local background Stokes parameters
         """
+        print('Estimating local background...')
+        return self._estimate_local_background(stokes_param_sm_local_tm)
 
+    def _estimate_local_background(self, stokes_param_sm_local_tm: StokesData) -> StokesData:
+        """compute_local_background without the progress message, e.g. for the tiles of an image"""
         stokes_param_bg_local_tm = StokesData()
 
-        print('Estimating local background...')
         if self.bg_method == 'Local_filter':
             estimate_bg = self._gaussian_blur
         elif self.bg_method == 'Local_fit':
@@ -370,13 +569,17 @@ class ImgReconstructor:
         return background
 
     def reconstruct_birefringence(self, stokes_param_sm_tm: StokesData,
-                                  img_crop_ref=None, extra=False) -> PhysicalData:
+                                  img_crop_ref=None, extra=False, out: PhysicalData=None) -> PhysicalData:
         """compute physical properties of birefringence
 
         Parameters
         ----------
         stokes_param_sm_tm: list of nd array.
             Transformed sample Stokes parameters
+        out : PhysicalData
+            object with I_trans, retard, azimuth and polarization arrays the physical properties
+            are written to, e.g. from ReconstructionWorkspace.physical_data. A new object whose
+            I_trans and polarization are those of stokes_param_sm_tm if None
 
         Returns
         -------
@@ -395,6 +598,9 @@ class ImgReconstructor:
         #     s1_normSmBg = np.nanmean(s1_normSmCrop)
         #     s2_normSmBg = np.nanmean(s2_normSmCrop)
 
+        if out is not None and not self.use_gpu:
+            return self._reconstruct_birefringence_out(stokes_param_sm_tm, out)
+
         phys_data = PhysicalData()
         
         if self.use_gpu:
@@ -431,6 +637,221 @@ class ImgReconstructor:
 
         phys_data.polarization = stokes_param_sm_tm.polarization
 
+        if out is not None:
+            for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+                getattr(out, name)[...] = getattr(phys_data, name)
+            return out
+        return phys_data
+
+    def _reconstruct_birefringence_out(self, stokes_param_sm_tm: StokesData, out: PhysicalData) -> PhysicalData:
+        """reconstruct_birefringence with the same operations, in the arrays of out. I_trans and
+        polarization hold s1 and s2 until the transmission and polarization are copied to them"""
+        if self.circularity not in ['lcp', 'rcp']:
+            raise AttributeError("unable to compute azimuth, circularity parameter is not defined")
+        s3 = stokes_param_sm_tm.s3
+        s1 = np.multiply(stokes_param_sm_tm.s1_norm, s3, out=out.I_trans)
+        s2 = np.multiply(stokes_param_sm_tm.s2_norm, s3, out=out.polarization)
+
+        retard = out.retard
+        np.square(s1, out=retard)
+        np.add(retard, np.square(s2, out=out.azimuth), out=retard)
+        np.sqrt(retard, out=retard)
+        np.arctan2(retard, s3, out=retard)
+        np.divide(retard, 2 * np.pi, out=retard)
+        np.multiply(retard, self.wavelength, out=retard)  # convert the unit to [nm]
+
+        azimuth = out.azimuth
+        if self.circularity == 'rcp':
+            np.negative(s1, out=s1)
+        np.negative(s2, out=s2)
+        np.arctan2(s1, s2, out=azimuth)
+        np.multiply(0.5, azimuth, out=azimuth)
+        np.add(azimuth, self.azimuth_offset, out=azimuth)
+        np.remainder(azimuth, np.pi, out=azimuth)  # make azimuth fall in [0,pi]
+
+        out.I_trans[...]      = stokes_param_sm_tm.s0
+        out.polarization[...] = stokes_param_sm_tm.polarization
+        return out
+
+    def reconstruct_birefringence_fused(self, img_raw: np.ndarray, background_data: StokesData=None,
+                                        tile_pixels=1 << 15, out: PhysicalData=None) -> PhysicalData:
+        """
+        Compute transmission, retardance, azimuth and polarization from the raw intensities in
+        one pass over tiles of rows, so that the Stokes parameters and the other intermediate
+        images of a tile stay in the CPU cache instead of being written out at full size.
+
+        Gives the same result as compute_stokes, stokes_normalization, correct_background
+        with 'Global' background correction and reconstruct_birefringence, with the operations
+        done in the same order on each pixel.
+
+        Parameters
+        ----------
+        img_raw : nd array
+            intensities from raw_intensities, with shape (n_chann, y, x) or (n_chann, y, x, z)
+        background_data : StokesData
+            normalized background Stokes parameters with shape (y, x). No background correction if None
+        tile_pixels : int
+            approximate number of pixels of a tile
+        out : PhysicalData
+            object with I_trans, retard, azimuth and polarization arrays the physical properties
+            are written to, e.g. from ReconstructionWorkspace.physical_data. A new object if None
+
+        Returns
+        -------
+        PhysicalData
+            I_trans, retard, azimuth and polarization with shape (y, x) or (y, x, z), out if it is not None
+
+        """
+        if self.circularity not in ['lcp', 'rcp']:
+            raise AttributeError("unable to compute azimuth, circularity parameter is not defined")
+        if list(img_raw.shape[:3]) != self.img_shape:
+            raise ValueError("Instrument matrix dimensions do not match supplied intensity dimensions")
+
+        img_shape = img_raw.shape[1:]
+        tile_rows = max(1, tile_pixels // int(np.prod(img_shape[1:])))
+        phys_data = out
+        if phys_data is None:
+            phys_data = PhysicalData()
+            [phys_data.I_trans,
+             phys_data.retard,
+             phys_data.azimuth,
+             phys_data.polarization] = [np.empty(img_shape, dtype=self.dtype) for _ in range(4)]
+        if img_raw.dtype.kind == 'f':
+            img_raw = img_raw.astype(self.dtype, copy=False)
+
+        for y_start in range(0, img_shape[0], tile_rows):
+            rows = slice(y_start, y_start + tile_rows)
+            tile = img_raw[:, rows]
+
+            # compute_stokes
+            img_stokes = np.dot(self.inst_mat_inv, np.reshape(tile, (self._n_chann, -1)))
+            [s0, s1, s2, s3] = np.reshape(img_stokes, (4,) + tile.shape[1:])
+
+            # stokes_normalization
+            s1_norm      = s1 / s3
+            s2_norm      = s2 / s3
+            polarization = np.sqrt(s1 ** 2 + s2 ** 2 + s3 ** 2) / s0
+
+            # correct_background_stokes
+            if background_data is not None:
+                bg_s0, bg_polarization, bg_s1_norm, bg_s2_norm = \
+                    [img[rows] for img in [background_data.s0, background_data.polarization,
+                                           background_data.s1_norm, background_data.s2_norm]]
+                if tile.ndim == 4:
+                    bg_s0, bg_polarization, bg_s1_norm, bg_s2_norm = \
+                        [img[..., np.newaxis] for img in [bg_s0, bg_polarization, bg_s1_norm, bg_s2_norm]]
+                s0           = s0 / bg_s0
+                polarization = polarization / bg_polarization
+                s1_norm      = s1_norm - bg_s1_norm
+                s2_norm      = s2_norm - bg_s2_norm
+
+            # reconstruct_birefringence
+            s1 = s1_norm * s3
+            s2 = s2_norm * s3
+            retard = np.arctan2(np.sqrt(s1 ** 2 + s2 ** 2), s3)
+            phys_data.retard[rows] = retard / (2 * np.pi) * self.wavelength  # convert the unit to [nm]
+            if self.circularity == 'lcp':
+                phys_data.azimuth[rows] = (0.5 * np.arctan2(s1, -s2) + self.azimuth_offset) % (np.pi)
+            else:
+                phys_data.azimuth[rows] = (0.5 * np.arctan2(-s1, -s2) + self.azimuth_offset) % (np.pi)
+            phys_data.I_trans[rows]      = s0
+            phys_data.polarization[rows] = polarization
+
+        return phys_data
+
+    def reconstruct_birefringence_tiled(self, int_obj, background_data: StokesData=None,
+                                        out: PhysicalData=None, tile_size=2048) -> PhysicalData:
+        """
+        Reconstruct the birefringence of an image too large to be held in memory several times
+        over, e.g. a stitched mosaic, one tile at a time. Peak memory is bounded by the tile size.
+
+        The tiles overlap by halos of kernel_size // 2 pixels with 'Local_filter' background
+        correction, so that the Gaussian filter of the local background sees the same pixels
+        as on the whole image. The halos are cropped before the tile is written to out.
+        Gives the same result as compute_stokes, stokes_normalization, correct_background
+        and reconstruct_birefringence on the whole image, up to the rounding of the Gaussian
+        filter of cv2, which differs in the last bit for some pixels of images of different widths.
+        'Local_fit' background correction fits a polynomial to the whole image and is not supported.
+
+        Parameters
+        ----------
+        int_obj : IntensityData or list of IntensityData
+            image with shape (y, x), or the z-slices of a z-block averaged for the local background.
+            The channel images can be memory maps, e.g. from the 'memmap' reader backend, only
+            the tiles are read
+        background_data : StokesData
+            normalized background Stokes parameters with shape (y, x). No background correction if None
+        out : PhysicalData
+            object with I_trans, retard, azimuth and polarization arrays with shape (y, x), or
+            (y, x, z) for a list of z-slices, e.g. from memmap_physical_data. New arrays if None
+        tile_size : int
+            size of the square tiles, without the halos
+
+        Returns
+        -------
+        PhysicalData
+            I_trans, retard, azimuth and polarization, out if it is not None
+
+        """
+        if self.bg_method == 'Local_fit':
+            raise ValueError('"Local_fit" fits the background to the whole image and cannot be tiled, '
+                             'use "Local_filter"')
+        int_objs = [int_obj] if isinstance(int_obj, IntensityData) else list(int_obj)
+        for int_obj_z in int_objs:
+            if not isinstance(int_obj_z, IntensityData):
+                raise TypeError("Incorrect Data Type: must be IntensityData")
+            if self.img_shape[1:] != list(np.shape(int_obj_z.get_image('IExt'))):
+                raise ValueError("Instrument matrix dimensions do not match supplied intensity dimensions")
+
+        [height, width] = self.img_shape[1:]
+        img_shape = (height, width) if isinstance(int_obj, IntensityData) else (height, width, len(int_objs))
+        phys_data = out
+        if phys_data is None:
+            phys_data = PhysicalData()
+            [phys_data.I_trans,
+             phys_data.retard,
+             phys_data.azimuth,
+             phys_data.polarization] = [np.empty(img_shape, dtype=self.dtype) for _ in range(4)]
+
+        halo = 0
+        if background_data is not None and self.bg_method == 'Local_filter':
+            halo = self.kernel_size // 2
+        chan_imgs = [[int_obj_z.get_image(chan_name) for chan_name in self._chan_names()] for int_obj_z in int_objs]
+        if halo:
+            print('Estimating local background...')
+        for y_start in range(0, height, tile_size):
+            for x_start in range(0, width, tile_size):
+                # tile with its halo, clipped at the borders of the image
+                rows = slice(max(0, y_start - halo), min(height, y_start + tile_size + halo))
+                cols = slice(max(0, x_start - halo), min(width, x_start + tile_size + halo))
+                crop = (slice(y_start - rows.start, y_start - rows.start + tile_size),
+                        slice(x_start - cols.start, x_start - cols.start + tile_size))
+
+                # (n_chann, y, x, z) intensities of the tile, a z-block of one slice for a 2D image
+                img_raw = np.stack([np.stack([img[rows, cols] for img in imgs]) for imgs in chan_imgs], axis=-1)
+                stokes = self._stokes_dot(img_raw, np.empty((4,) + img_raw.shape[1:], dtype=self.dtype))
+                img_raw = None
+                norm_sample = self.stokes_normalization(stokes)
+                if background_data is not None:
+                    bg_tile = StokesData()
+                    [bg_tile.s0,
+                     bg_tile.polarization,
+                     bg_tile.s1_norm,
+                     bg_tile.s2_norm] = [np.asarray(img[rows, cols]) for img in
+                                         [background_data.s0, background_data.polarization,
+                                          background_data.s1_norm, background_data.s2_norm]]
+                    # correct_background, with the local background of each tile estimated silently
+                    norm_sample = self.correct_background_stokes(norm_sample, bg_tile)
+                    if halo:
+                        local_background = self._estimate_local_background(self._z_average(norm_sample))
+                        norm_sample = self.correct_background_stokes(norm_sample, local_background)
+                tile_data = self.reconstruct_birefringence(norm_sample)
+
+                tile = (slice(y_start, y_start + tile_size), slice(x_start, x_start + tile_size))
+                for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+                    img = getattr(tile_data, name)[crop]
+                    getattr(phys_data, name)[tile] = img if len(img_shape) == 3 else img[..., 0]
+
         return phys_data
 
     def calibrate_inst_mat(self):
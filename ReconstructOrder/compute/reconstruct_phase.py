@@ -57,12 +57,17 @@ class phase_reconstructor:
         
         gpu_id          : int
                           number refering to which gpu will be used
+        
+        tf_cache        : TransferFunctionCache
+                          on-disk cache of the transfer functions. Transfer functions computed by a
+                          previous run with the same parameters are loaded instead of computed
                   
     
     '''
     
     def __init__(self, img_dim, lambda_illu, ps, psz, NA_obj, NA_illu, focus_idx=None, \
-                 n_objective_media=1, phase_deconv=['2D'], ph_deconv_layer=5, pad_z=0, use_gpu=False, gpu_id=0):
+                 n_objective_media=1, phase_deconv=['2D'], ph_deconv_layer=5, pad_z=0, use_gpu=False, gpu_id=0,
+                 tf_cache=None):
         
         # GPU/CPU
         
@@ -79,6 +84,11 @@ class phase_reconstructor:
                 self.use_gpu = False
             
         
+        # parameters the transfer functions depend on
+        self.tf_cache  = tf_cache
+        self.tf_params = dict(img_dim=list(img_dim), lambda_illu=lambda_illu, ps=ps, psz=psz, NA_obj=NA_obj,
+                              NA_illu=NA_illu, focus_idx=focus_idx, n_objective_media=n_objective_media)
+        
         # Basic parameter 
         self.N, self.M, self.N_defocus   = img_dim
         self.n_objective_media                     = n_objective_media
@@ -136,14 +146,17 @@ class phase_reconstructor:
 
         '''
         
-        if '2D' in phase_deconv:
+        if '2D' in phase_deconv and not self.load_WOTF('2D', ['Hu', 'Hp']):
             
             Hz_det = gen_Hz_stack(self.fxx, self.fyy, self.Pupil_support, self.lambda_illu, self.z_defocus, type='Prop')
             self.gen_2D_WOTF(Hz_det)
+            self.save_WOTF('2D', ['Hu', 'Hp'])
             
         if 'semi-3D' in phase_deconv:
-            
             self.ph_deconv_layer = ph_deconv_layer
+            
+        if 'semi-3D' in phase_deconv and not self.load_WOTF('semi-3D', ['Hu_semi3D', 'Hp_semi3D']):
+            
             if self.z_defocus[0] - self.z_defocus[1] >0:
                 z_deconv = -(np.r_[:self.ph_deconv_layer]-self.ph_deconv_layer//2)*self.psz
             else:
@@ -152,11 +165,13 @@ class phase_reconstructor:
             Hz_det  = gen_Hz_stack(self.fxx, self.fyy, self.Pupil_support, self.lambda_illu, z_deconv, type='Prop')
             G_fun_z = gen_Hz_stack(self.fxx, self.fyy, self.Pupil_support, self.lambda_illu, z_deconv, type='Green')
             self.gen_semi_3D_WOTF(Hz_det, G_fun_z)
+            self.save_WOTF('semi-3D', ['Hu_semi3D', 'Hp_semi3D'])
             
         if '3D' in phase_deconv:
-            
             self.N_defocus_3D = self.N_defocus + 2*self.pad_z
             
+        if '3D' in phase_deconv and not self.load_WOTF('3D', ['H_re', 'H_im']):
+            
             if self.z_defocus[0] - self.z_defocus[1] >0:
                 z = -ifftshift((np.r_[0:self.N_defocus_3D]-self.N_defocus_3D//2)*self.psz)
             else:
@@ -165,6 +180,66 @@ class phase_reconstructor:
             Hz_det = gen_Hz_stack(self.fxx, self.fyy, self.Pupil_support, self.lambda_illu, z, type='Prop')
             G_fun_z = gen_Hz_stack(self.fxx, self.fyy, self.Pupil_support, self.lambda_illu, z, type='Green')
             self.gen_3D_WOTF(Hz_det, G_fun_z)
+            self.save_WOTF('3D', ['H_re', 'H_im'])
+            
+    def _WOTF_params(self, deconv):
+        
+        params = dict(self.tf_params, deconv=deconv)
+        if deconv == 'semi-3D':
+            params['ph_deconv_layer'] = self.ph_deconv_layer
+        elif deconv == '3D':
+            params['pad_z'] = self.pad_z
+        return params
+        
+    def load_WOTF(self, deconv, names):
+        
+        '''
+    
+        load the transfer functions of a deconvolution from the transfer function cache
+
+        Parameters
+        ----------
+            deconv : str
+                     '2D', 'semi-3D' or '3D'
+                     
+            names  : list
+                     attribute names of the transfer functions
+                     
+        Returns
+        -------
+            bool
+                     True if the transfer functions were cached
+
+        '''
+        
+        if self.tf_cache is None:
+            return False
+        arrays = self.tf_cache.get(self._WOTF_params(deconv))
+        if arrays is None or any(name not in arrays for name in names):
+            return False
+        for name in names:
+            setattr(self, name, arrays[name])
+        print('Loaded the {} phase transfer function from the cache'.format(deconv))
+        return True
+        
+    def save_WOTF(self, deconv, names):
+        
+        '''
+    
+        store the transfer functions of a deconvolution in the transfer function cache
+
+        Parameters
+        ----------
+            deconv : str
+                     '2D', 'semi-3D' or '3D'
+                     
+            names  : list
+                     attribute names of the transfer functions
+
+        '''
+        
+        if self.tf_cache is not None:
+            self.tf_cache.put(self._WOTF_params(deconv), {name: getattr(self, name) for name in names})
             
     def gen_2D_WOTF(self, Hz_det):
         
@@ -20,12 +20,18 @@ class IntensityDataCreator(object):
         Channels in the output intensity data object
     binning : int
         binning (or pooling) size for the images
+    dtype : data type
+        data type of the intensity images. float32 by default. With an unsigned integer type
+        (e.g. np.uint16) the images are kept in that type through cropping, black level
+        subtraction (clipped at 0) and binning (rounded), and are converted to float when
+        the Stokes parameters are computed
     """
 
-    def __init__(self, input_chans=None, int_obj_chans=None, ROI=None, binning=1):
+    def __init__(self, input_chans=None, int_obj_chans=None, ROI=None, binning=1, dtype=np.float32):
         self.input_chans = input_chans
         self.roi = ROI
         self.binning = binning
+        self.dtype = np.dtype(dtype)
         self.int_obj_chans = ['IExt', 'I90', 'I135', 'I45', 'I0', 'BF',
                          '405', '488', '568', '640', 'ex561em700']
         if int_obj_chans is not None:
@@ -45,34 +51,88 @@ class IntensityDataCreator(object):
             images from polarization, fluorescence, bright-field channels
         """
 
+        imgs = self._init_data_object(img_io)
+        if getattr(img_io, 'prefetcher', None) is not None:
+            # queue this and the next z-slices while the current one is being processed
+            img_io.prefetch_slices([img_io.input_chans.index(chan_name) for chan_name in self.input_chans])
+        for chan_name in self.input_chans:
+            img_io.chan_idx = img_io.input_chans.index(chan_name)
+            img = img_io.read_img(dtype=self.dtype)
+            if img is None:
+                warnings.warn('image "{}" cannot be found. Skipped.'.format(chan_name))
+            else:
+                img = img[self.roi[0]:self.roi[0] + self.roi[2], self.roi[1]:self.roi[1] + self.roi[3]]
+                img = self._subtract_black_level(img, img_io.blackLevel)
+                img = mean_pooling_2d(img, self.binning)
+                imgs = IntensityDataCreator.chan_name_parser(imgs, img, chan_name)
+        return imgs
+
+    def get_data_objects(self, img_io: mManagerReader, z_list) -> list:
+        """Read the z-slices of z_list at the current (t,p) of img_io with one bulk read of
+        all their channels into a (C, Z, Y, X) buffer, see mManagerReader.read_img_stack.
+        The images are the same as those of get_data_object for each z-slice
+
+        Parameters
+        ----------
+        img_io : obj
+            mManagerReader instance
+        z_list : list
+            z indices to read
+
+        Returns
+        -------
+        list
+            IntensityData of each z-slice, whose images are views of the buffer. Raises
+            FileNotFoundError if an image is missing, which get_data_object skips with a warning
+        """
+        imgs_list = [self._init_data_object(img_io) for _ in z_list]
+        img_stack = img_io.read_img_stack(chan_names=self.input_chans, z_list=z_list, roi=self.roi,
+                                          binning=self.binning, black_level=img_io.blackLevel, dtype=self.dtype)
+        for z, imgs in enumerate(imgs_list):
+            for c, chan_name in enumerate(self.input_chans):
+                IntensityDataCreator.chan_name_parser(imgs, img_stack[c, z], chan_name)
+        return imgs_list
+
+    def _init_data_object(self, img_io):
+        """intensity data object with the placeholders of the fluorescence channels. Sets the ROI
+        and the input channels of img_io if they are None"""
         imgs = IntensityData(channel_names=self.int_obj_chans)
         
         if self.roi is None:
             self.roi = [0, 0, img_io.height, img_io.width]
         
-        for chan_name in _fluor_chan_names:
-            imgs.replace_image(np.zeros((self.roi[2], self.roi[3])), chan_name)
-        
         assert self.roi[0] + self.roi[2] <= img_io.height and self.roi[1] + self.roi[3] <= img_io.width, \
             "Region of interest is beyond the size of the actual image"
 
+        # placeholder of the fluorescence channels that are not acquired, at the binned image size.
+        # The channels share one read-only array
+        placeholder = np.zeros((self.roi[2] // self.binning, self.roi[3] // self.binning), dtype=self.dtype)
+        placeholder.flags.writeable = False
+        for chan_name in _fluor_chan_names:
+            imgs.replace_image(placeholder, chan_name)
+
         if self.input_chans is None:
             self.input_chans = img_io.input_chans
-        for chan_name in self.input_chans:
-            img_io.chan_idx = img_io.input_chans.index(chan_name)
-            img = img_io.read_img()
-            if img is None:
-                warnings.warn('image "{}" cannot be found. Skipped.'.format(chan_name))
-            else:
-                img = img[self.roi[0]:self.roi[0] + self.roi[2], self.roi[1]:self.roi[1] + self.roi[3]]
-                img -= img_io.blackLevel
-                img = mean_pooling_2d(img, self.binning)
-                imgs = IntensityDataCreator.chan_name_parser(imgs, img, chan_name)
         return imgs
-    
-    
-        
 
+    def _subtract_black_level(self, img, black_level):
+        """subtract the camera black level from an image in self.dtype.
+
+        The subtraction is done in place if the image is writable; read-only memory maps
+        and cached chunks are converted to self.dtype, only the ROI is copied.
+        Integer images are clipped at 0 instead of going negative
+        """
+        if np.issubdtype(self.dtype, np.integer):
+            black_level = self.dtype.type(round(black_level))
+            if not (img.flags.writeable and img.dtype == self.dtype):
+                img = img.astype(self.dtype)
+            np.maximum(img, black_level, out=img)
+            img -= black_level
+        elif img.flags.writeable and img.dtype == self.dtype:
+            img -= black_level
+        else:
+            img = np.subtract(img, black_level, dtype=self.dtype)
+        return img
 
     @staticmethod
     def chan_name_parser(imgs, img, chan_name):
@@ -91,31 +151,49 @@ class IntensityDataCreator(object):
         imgs : IntensityData
             images from polarization, fluorescence, bright-field channels
         """
+        int_chan_name = IntensityDataCreator.int_chan_name(chan_name)
+        if int_chan_name is not None:
+            imgs.replace_image(img, int_chan_name)
+        return imgs
+
+    @staticmethod
+    def int_chan_name(chan_name):
+        """Name of the channel of the intensity data object that an image channel is assigned to
+
+        Parameters
+        ----------
+        chan_name : str
+            image channel name
+        Returns
+        -------
+        str or None
+            'IExt', 'I90', 'I135', 'I45', 'I0', 'BF' or a fluorescence channel name.
+            None if the image channel isn't used
+        """
         if any(substring in chan_name for substring in ['State', 'state', 'Pol']):
             if '0' in chan_name:
-                imgs.replace_image(img, 'IExt')
+                return 'IExt'
             elif '1' in chan_name:
-                imgs.replace_image(img, 'I90')
+                return 'I90'
             elif '2' in chan_name:
-                imgs.replace_image(img, 'I135')
+                return 'I135'
             elif '3' in chan_name:
-                imgs.replace_image(img, 'I45')
+                return 'I45'
             elif '4' in chan_name:
-                imgs.replace_image(img, 'I0')
+                return 'I0'
         elif any(substring in chan_name for substring in
                  ['Confocal40', 'Confocal_40', 'Widefield', 'widefield', 'Fluor']):
             if any(substring in chan_name for substring in ['DAPI', '405', '405nm']):
-                imgs.replace_image(img, '405')
+                return '405'
             elif any(substring in chan_name for substring in ['GFP', '488', '488nm']):
-                imgs.replace_image(img, '488')
+                return '488'
             elif any(substring in chan_name for substring in
                      ['TxR', 'TXR', 'TX', 'RHO', '568', '561', '560']):
-                imgs.replace_image(img, '568')
+                return '568'
             elif any(substring in chan_name for substring in ['Cy5', 'IFP', '640', '637']):
-                imgs.replace_image(img, '640')
+                return '640'
             elif any(substring in chan_name for substring in ['FM464', 'fm464']):
-                imgs.replace_image(img, 'ex561em700')
+                return 'ex561em700'
         elif any(substring in chan_name for substring in ['BF', 'BrightField', 'Default']):
-            imgs.replace_image(img, 'BF')
-
-        return imgs
\ No newline at end of file
+            return 'BF'
+        return None
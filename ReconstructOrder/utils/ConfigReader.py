@@ -156,6 +156,40 @@ class ConfigReader:
                     self.processing.TV_reg_ph_3D = value
                 elif key == 'pad_z':
                     self.processing.pad_z = value
+                elif key == 'output_format':
+                    self.processing.output_format = value
+                elif key == 'zarr_chunks':
+                    self.processing.zarr_chunks = value
+                elif key == 'reader_backend':
+                    self.processing.reader_backend = value
+                elif key == 'prefetch_workers':
+                    self.processing.prefetch_workers = value
+                elif key == 'prefetch_depth':
+                    self.processing.prefetch_depth = value
+                elif key == 'writer_workers':
+                    self.processing.writer_workers = value
+                elif key == 'writer_queue_size':
+                    self.processing.writer_queue_size = value
+                elif key == 'intensity_dtype':
+                    self.processing.intensity_dtype = value
+                elif key == 'process_workers':
+                    self.processing.process_workers = value
+                elif key == 'resume':
+                    self.processing.resume = value
+                elif key == 'pipeline_queue_size':
+                    self.processing.pipeline_queue_size = value
+                elif key == 'tf_cache_dir':
+                    self.processing.tf_cache_dir = value
+                elif key == 'tf_cache_size':
+                    self.processing.tf_cache_size = value
+                elif key == 'stream_local_bg':
+                    self.processing.stream_local_bg = value
+                elif key == 'birefringence_engine':
+                    self.processing.birefringence_engine = value
+                elif key == 'precision':
+                    self.processing.precision = value
+                elif key == 'reuse_buffers':
+                    self.processing.reuse_buffers = value
                 else:
                     raise NameError('Unrecognized configfile field:{}, key:{}'.format('processing', key))
                     
@@ -398,6 +432,11 @@ class Processing:
     _allowed_circularity_values = ['rcp', 'lcp']
     _allowed_background_correction_values = ['None', 'Input', 'Local_filter', 'Local_fit', 'Local_defocus', 'Auto']
     _allowed_phase_denoiser_values = ['Tikhonov', 'TV']
+    _allowed_reader_backend_values = ['cv2', 'memmap']
+    _allowed_output_format_values = ['tif', 'zarr']
+    _allowed_intensity_dtype_values = ['float32', 'uint16']
+    _allowed_birefringence_engine_values = ['numpy', 'fused']
+    _allowed_precision_values = ['float32', 'float64']
     
     def __init__(self):
         self._output_channels       = ['Brightfield', 'Retardance', 'Orientation', 'Polarization']
@@ -438,6 +477,24 @@ class Processing:
         self._TV_reg_ph_3D  = 5e-5
         
         self._pad_z = 0
+
+        self._output_format    = 'tif'
+        self._zarr_chunks      = [1, 1, 1, -1, -1]
+        self._reader_backend   = 'cv2'
+        self._prefetch_workers = 0
+        self._prefetch_depth   = 4
+        self._writer_workers   = 0
+        self._writer_queue_size = 16
+        self._intensity_dtype   = 'float32'
+        self._process_workers   = 0
+        self._resume            = False
+        self._pipeline_queue_size = 0
+        self._tf_cache_dir      = None
+        self._tf_cache_size     = 20
+        self._stream_local_bg   = False
+        self._birefringence_engine = 'numpy'
+        self._precision         = 'float32'
+        self._reuse_buffers     = False
         
 
     @property
@@ -559,6 +616,74 @@ class Processing:
     @property
     def pad_z(self):
         return self._pad_z
+
+    @property
+    def output_format(self):
+        return self._output_format
+
+    @property
+    def zarr_chunks(self):
+        return self._zarr_chunks
+
+    @property
+    def reader_backend(self):
+        return self._reader_backend
+
+    @property
+    def prefetch_workers(self):
+        return self._prefetch_workers
+
+    @property
+    def prefetch_depth(self):
+        return self._prefetch_depth
+
+    @property
+    def writer_workers(self):
+        return self._writer_workers
+
+    @property
+    def writer_queue_size(self):
+        return self._writer_queue_size
+
+    @property
+    def intensity_dtype(self):
+        return self._intensity_dtype
+
+    @property
+    def process_workers(self):
+        return self._process_workers
+
+    @property
+    def resume(self):
+        return self._resume
+
+    @property
+    def pipeline_queue_size(self):
+        return self._pipeline_queue_size
+
+    @property
+    def tf_cache_dir(self):
+        return self._tf_cache_dir
+
+    @property
+    def tf_cache_size(self):
+        return self._tf_cache_size
+
+    @property
+    def stream_local_bg(self):
+        return self._stream_local_bg
+
+    @property
+    def birefringence_engine(self):
+        return self._birefringence_engine
+
+    @property
+    def precision(self):
+        return self._precision
+
+    @property
+    def reuse_buffers(self):
+        return self._reuse_buffers
     
 
     @output_channels.setter
@@ -736,6 +861,103 @@ class Processing:
             "pad_z must be an integer >= 0"
         self._pad_z = value
 
+    @output_format.setter
+    def output_format(self, value):
+        assert value in self._allowed_output_format_values, "{} is not an allowed output_format setting".format(value)
+        self._output_format = value
+
+    @zarr_chunks.setter
+    def zarr_chunks(self, value):
+        assert isinstance(value, list) and len(value) == 5 and \
+            all(isinstance(size, int) and (size > 0 or size == -1) for size in value), \
+            "zarr_chunks must be a list of 5 positive integers (or -1) for the (T, C, Z, Y, X) axes"
+        self._zarr_chunks = value
+
+    @reader_backend.setter
+    def reader_backend(self, value):
+        assert value in self._allowed_reader_backend_values, "{} is not an allowed reader_backend setting".format(value)
+        self._reader_backend = value
+
+    @prefetch_workers.setter
+    def prefetch_workers(self, value):
+        assert isinstance(value, int) and value >= 0, \
+            "prefetch_workers must be an integer >= 0"
+        self._prefetch_workers = value
+
+    @prefetch_depth.setter
+    def prefetch_depth(self, value):
+        assert isinstance(value, int) and value > 0, \
+            "prefetch_depth must be a positive integer"
+        self._prefetch_depth = value
+
+    @writer_workers.setter
+    def writer_workers(self, value):
+        assert isinstance(value, int) and value >= 0, \
+            "writer_workers must be an integer >= 0"
+        self._writer_workers = value
+
+    @writer_queue_size.setter
+    def writer_queue_size(self, value):
+        assert isinstance(value, int) and value > 0, \
+            "writer_queue_size must be a positive integer"
+        self._writer_queue_size = value
+
+    @intensity_dtype.setter
+    def intensity_dtype(self, value):
+        assert value in self._allowed_intensity_dtype_values, \
+            "{} is not an allowed intensity_dtype setting".format(value)
+        self._intensity_dtype = value
+
+    @process_workers.setter
+    def process_workers(self, value):
+        assert isinstance(value, int) and value >= 0, \
+            "process_workers must be an integer >= 0"
+        self._process_workers = value
+
+    @resume.setter
+    def resume(self, value):
+        assert isinstance(value, bool), "resume must be boolean"
+        self._resume = value
+
+    @pipeline_queue_size.setter
+    def pipeline_queue_size(self, value):
+        assert isinstance(value, int) and value >= 0, \
+            "pipeline_queue_size must be an integer >= 0"
+        self._pipeline_queue_size = value
+
+    @tf_cache_dir.setter
+    def tf_cache_dir(self, value):
+        assert value is None or isinstance(value, str), "tf_cache_dir must be a path"
+        self._tf_cache_dir = value
+
+    @tf_cache_size.setter
+    def tf_cache_size(self, value):
+        assert isinstance(value, (int, float)) and value > 0, \
+            "tf_cache_size must be a positive number"
+        self._tf_cache_size = value
+
+    @stream_local_bg.setter
+    def stream_local_bg(self, value):
+        assert isinstance(value, bool), "stream_local_bg must be boolean"
+        self._stream_local_bg = value
+
+    @birefringence_engine.setter
+    def birefringence_engine(self, value):
+        assert value in self._allowed_birefringence_engine_values, \
+            "{} is not an allowed birefringence_engine setting".format(value)
+        self._birefringence_engine = value
+
+    @precision.setter
+    def precision(self, value):
+        assert value in self._allowed_precision_values, \
+            "{} is not an allowed precision setting".format(value)
+        self._precision = value
+
+    @reuse_buffers.setter
+    def reuse_buffers(self, value):
+        assert isinstance(value, bool), "reuse_buffers must be boolean"
+        self._reuse_buffers = value
+
     def __repr__(self):
         out = str(self.__class__) + '\n'
         for (key, value) in self.__dict__.items():
@@ -0,0 +1,77 @@
+"""
+Write images in background threads so that encoding and disk writes overlap with the reconstruction
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class AsyncWriter(object):
+    """Bounded queue of write jobs served by a thread pool
+
+    `submit` blocks while `max_queued` jobs are pending, so the reconstruction
+    can't run away from the disk and hold an unbounded number of images in
+    memory. The first exception raised by a write job is re-raised in the
+    calling thread by the next `submit` or by `flush`.
+
+    Images passed to a write job must not be modified afterwards, as they are
+    written after `submit` has returned.
+
+    Parameters
+    ----------
+    n_workers : int
+        number of writer threads
+    max_queued : int
+        maximum number of write jobs queued or in progress
+
+    """
+
+    def __init__(self, n_workers=2, max_queued=16):
+        assert n_workers > 0, 'n_workers must be a positive integer'
+        assert max_queued > 0, 'max_queued must be a positive integer'
+        self.n_workers = n_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._error = None
+
+    def submit(self, write_func, *args):
+        """Queue write_func(*args), waiting for a free slot if the queue is full"""
+        self._raise_error()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(write_func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._job_done)
+
+    def _job_done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if not future.cancelled() and future.exception() is not None and self._error is None:
+                self._error = future.exception()
+        self._slots.release()
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def flush(self):
+        """Wait until all queued images are written. Raises the first error of the write jobs"""
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+        self._raise_error()
+
+    def close(self):
+        """Wait for the queued images and stop the writer threads.
+
+        Errors of the write jobs are not raised, call `flush` first to check them
+        """
+        self._executor.shutdown(wait=True)
@@ -1,16 +1,32 @@
 import os
 import functools
 
+
+def set_pt(img_io, pos_idx, t_idx):
+    """point the reader to the position with index pos_idx in img_io.pos_list and to time t_idx"""
+    img_io.img_in_pos_path = os.path.join(img_io.img_sm_path, img_io.pos_list[pos_idx])
+    img_io.pos_idx = pos_idx
+    img_io.t_idx = t_idx
+
+
+def pt_list(img_io):
+    """(position index, time index) of the units processed by loop_pt, in processing order"""
+    return [(pos_idx, t_idx) for pos_idx in range(len(img_io.pos_list)) for t_idx in img_io.t_list]
+
+
+def z_blocks(z_list, n_slice_local_bg):
+    """z-slices of z_list that are reconstructed together, in blocks of n_slice_local_bg ('all' for one block)"""
+    if n_slice_local_bg == 'all':
+        n_slice_local_bg = max(len(z_list), 1)
+    return [z_list[z_idx:z_idx + n_slice_local_bg] for z_idx in range(0, len(z_list), n_slice_local_bg)]
+
+
 def loop_pt(func):
     @functools.wraps(func)
     def wrapper_loop_pt(*args, **kwargs):
         img_io = kwargs['img_io']
-        for pos_idx, pos_name in enumerate(img_io.pos_list):
-            img_io.img_in_pos_path = os.path.join(img_io.img_sm_path, pos_name)
-            img_io.pos_idx = pos_idx
-            for t_idx in img_io.t_list:
-                img_io.t_idx = t_idx
-                kwargs['img_io'] = img_io
-                func(*args, **kwargs)
+        for pos_idx, t_idx in pt_list(img_io):
+            set_pt(img_io, pos_idx, t_idx)
+            kwargs['img_io'] = img_io
+            func(*args, **kwargs)
     return wrapper_loop_pt
-
@@ -35,8 +35,9 @@ def get_sub_dirs(ImgPath):
         list of sub-directory names
     """
     assert os.path.exists(ImgPath), 'Input folder does not exist!' 
-    subDirPath = glob.glob(os.path.join(ImgPath, '*/'))    
-    subDirName = [os.path.split(subdir[:-1])[1] for subdir in subDirPath]
+    # scandir gets the entry types from the listing, without a stat call per file
+    subDirName = [entry.name for entry in os.scandir(ImgPath)
+                  if entry.is_dir() and not entry.name.startswith('.')]
 #    assert subDirName, 'No sub directories found'
     return natsort.natsorted(subDirName)
 
@@ -138,8 +139,18 @@ def sort_pol_channels(img_pol):
     return img_pol
 
 
-def export_img(img_io, img_dict, separate_pos=False):
-    """export images in tiff format
+def write_tiff(img, file_path):
+    """write a single- or 3-channel (RGB) image to a tiff file"""
+    if len(img.shape) == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    if not cv2.imwrite(file_path, img):
+        raise IOError('Failed to write image "{}"'.format(file_path))
+
+
+def export_img(img_io, img_dict, separate_pos=False, z_idx=None):
+    """export images in tiff format, or with the image writer of img_io if it has one
+
+    If img_io has an async_writer, the images are written in its background threads.
 
     Parameters
     ----------
@@ -149,24 +160,32 @@ def export_img(img_io, img_dict, separate_pos=False):
         dictionary of images with (key, value) = (channel, image array)
     separate_pos: bool
         save images from different positions in separate folders if True
+    z_idx: int
+        z index of the images, img_io.z_idx if None
     -------
 
     """
     t_idx = img_io.t_idx
-    z_idx = img_io.z_idx
+    if z_idx is None:
+        z_idx = img_io.z_idx
     pos_idx = img_io.pos_idx
-    if separate_pos:
+    img_writer = getattr(img_io, 'img_writer', None)
+    async_writer = getattr(img_io, 'async_writer', None)
+    output_path = img_io.img_output_path
+    if img_writer is None and separate_pos:
         pos_name = img_io.pos_list[pos_idx]
         output_path = os.path.join(img_io.img_output_path, pos_name)
         os.makedirs(output_path, exist_ok=True)  # create folder for processed images
-    else:
-        output_path = img_io.img_output_path
-
-    for tiffName in img_dict:
-        if tiffName in img_io.output_chans:
-            fileName = 'img_'+tiffName+'_t%03d_p%03d_z%03d.tif'%(t_idx, pos_idx, z_idx)
-            if len(img_dict[tiffName].shape)<3:
-                cv2.imwrite(os.path.join(output_path, fileName), img_dict[tiffName])
-            else:
-                cv2.imwrite(os.path.join(output_path, fileName), cv2.cvtColor(img_dict[tiffName], cv2.COLOR_RGB2BGR))
 
+    for chan_name in img_dict:
+        if chan_name not in img_io.output_chans:
+            continue
+        if img_writer is not None:
+            job = (img_writer.write, img_dict[chan_name], chan_name, t_idx, pos_idx, z_idx)
+        else:
+            fileName = 'img_'+chan_name+'_t%03d_p%03d_z%03d.tif'%(t_idx, pos_idx, z_idx)
+            job = (write_tiff, img_dict[chan_name], os.path.join(output_path, fileName))
+        if async_writer is not None:
+            async_writer.submit(*job)
+        else:
+            job[0](*job[1:])
@@ -123,8 +123,15 @@ def mean_pooling_2d(im, block_size):
     width, height = im.shape
     width_new = width // block_size
     height_new = height // block_size
-    im_pooled = im[:width_new * block_size, :height_new * block_size]\
-        .reshape(width_new, block_size, height_new, block_size).mean(axis=(1, 3))
+    im_blocks = im[:width_new * block_size, :height_new * block_size]\
+        .reshape(width_new, block_size, height_new, block_size)
+    if np.issubdtype(im.dtype, np.integer):
+        # accumulate integer images in a wider integer type and round the mean back to the input dtype
+        n_px = block_size ** 2
+        im_sum = im_blocks.sum(axis=(1, 3), dtype=np.promote_types(im.dtype, np.uint32))
+        im_pooled = ((im_sum + n_px // 2) // n_px).astype(im.dtype)
+    else:
+        im_pooled = im_blocks.mean(axis=(1, 3))
     return im_pooled
 
 def mean_pooling_2d_stack(im, block_size):
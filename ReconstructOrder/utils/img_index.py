@@ -0,0 +1,133 @@
+"""
+Index of the image files in Micro-Manager position folders, so that folders with many files
+are listed once instead of on every reader construction
+"""
+import json
+import os
+import re
+import threading
+
+
+# (image name format, pattern of the image file names)
+_NAME_PATTERNS = [
+    ('mm_2_0', re.compile(r'^img_channel(?P<chan>\d+)_position(?P<pos>\d+)_time(?P<t>\d+)_z(?P<z>\d+)\.tif$')),
+    ('mm_1_4_22', re.compile(r'^img_(?P<t>\d{9})_(?P<chan>.+)_(?P<z>\d{3})\.tif$')),
+    ('recon_order', re.compile(r'^img_(?P<chan>.+)_t(?P<t>\d+)_p(?P<pos>\d+)_z(?P<z>\d+)\.tif$')),
+]
+
+_INDEX_VERSION = 1
+
+_index_cache = {}  # absolute folder path: ImgDirIndex
+_index_cache_lock = threading.Lock()
+
+
+def _dir_mtime(dir_path):
+    return os.stat(dir_path).st_mtime_ns
+
+
+def index_file_path(dir_path):
+    """path of the on-disk index of a folder.
+
+    The index is stored next to the folder rather than inside it, so that writing
+    the index doesn't change the modification time of the indexed folder
+    """
+    dir_path = os.path.abspath(dir_path)
+    return os.path.join(os.path.dirname(dir_path), '.{}.img_index.json'.format(os.path.basename(dir_path)))
+
+
+class ImgDirIndex(object):
+    """Map of (channel, t, p, z) to image file name for one position folder
+
+    Parameters
+    ----------
+    dir_path : str
+        path of the position folder
+    img_name_format : str
+        'mm_1_4_22', 'mm_2_0' or 'recon_order'. See mManagerReader.get_img_name
+    files : dict
+        {(chan, t_idx, pos_idx, z_idx): file name}. chan is the channel name, or the channel
+        index in the metadata for 'mm_2_0'. pos_idx is None for 'mm_1_4_22', whose file names
+        have no position index
+    dir_mtime : int
+        modification time (ns) of the folder when it was listed
+    """
+
+    def __init__(self, dir_path, img_name_format, files, dir_mtime):
+        self.dir_path = dir_path
+        self.img_name_format = img_name_format
+        self.files = files
+        self.dir_mtime = dir_mtime
+
+    @classmethod
+    def build(cls, dir_path):
+        """list the folder and parse the image file names"""
+        dir_mtime = _dir_mtime(dir_path)
+        parsed = {img_name_format: {} for img_name_format, _ in _NAME_PATTERNS}
+        for entry in os.scandir(dir_path):
+            for img_name_format, pattern in _NAME_PATTERNS:
+                match = pattern.match(entry.name)
+                if match:
+                    fields = match.groupdict()
+                    chan = int(fields['chan']) if img_name_format == 'mm_2_0' else fields['chan']
+                    pos_idx = int(fields['pos']) if 'pos' in fields else None
+                    key = (chan, int(fields['t']), pos_idx, int(fields['z']))
+                    parsed[img_name_format][key] = entry.name
+                    break
+        img_name_format = max(parsed, key=lambda name_format: len(parsed[name_format]))
+        if not parsed[img_name_format]:
+            raise ValueError('Unknown image name format')
+        return cls(dir_path, img_name_format, parsed[img_name_format], dir_mtime)
+
+    @classmethod
+    def load(cls, dir_path):
+        """Index of a folder from the in-memory or on-disk cache, rebuilt if the folder has changed
+
+        The rebuilt index is saved on disk if the parent folder is writable.
+        """
+        abs_path = os.path.abspath(dir_path)
+        dir_mtime = _dir_mtime(abs_path)
+        with _index_cache_lock:
+            index = _index_cache.get(abs_path)
+        if index is None or index.dir_mtime != dir_mtime:
+            index = cls._read(abs_path)
+            if index is None or index.dir_mtime != dir_mtime:
+                index = cls.build(abs_path)
+                index._write()
+            with _index_cache_lock:
+                _index_cache[abs_path] = index
+        return index
+
+    @classmethod
+    def _read(cls, abs_path):
+        try:
+            with open(index_file_path(abs_path), 'r') as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if content.get('version') != _INDEX_VERSION:
+            return None
+        files = {(chan, t_idx, pos_idx, z_idx): file_name
+                 for chan, t_idx, pos_idx, z_idx, file_name in content['files']}
+        return cls(abs_path, content['img_name_format'], files, content['dir_mtime'])
+
+    def _write(self):
+        content = {'version': _INDEX_VERSION,
+                   'img_name_format': self.img_name_format,
+                   'dir_mtime': self.dir_mtime,
+                   'files': [list(key) + [file_name] for key, file_name in self.files.items()]}
+        index_path = index_file_path(self.dir_path)
+        tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(content, f)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            # read-only data folder, keep the index in memory only
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, chan, t_idx, pos_idx, z_idx):
+        """file name of the image at (c,t,p,z), None if it was not in the folder when it was indexed"""
+        if self.img_name_format == 'mm_1_4_22':
+            pos_idx = None
+        return self.files.get((chan, t_idx, pos_idx, z_idx))
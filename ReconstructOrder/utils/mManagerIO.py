@@ -2,12 +2,22 @@
 Class to read mManager format images saved separately and their metadata (JSON) .
 """
 import json, os
+import struct
 import numpy as np
 import pandas as pd
 import cv2
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
-from ..utils.imgIO import get_sub_dirs, get_sorted_names
+import natsort
+
+from ..utils.imgIO import get_sub_dirs
+from ..utils.img_index import ImgDirIndex
+from ..utils.mm_metadata import MetadataFile
+from ..utils.imgProcessing import mean_pooling_2d
+from ..utils.prefetch import ImgPrefetcher
+from ..utils.async_writer import AsyncWriter
+from ..utils.tiff_index import tiff_plane_layout, memmap_plane
  
 
 
@@ -28,8 +38,8 @@ class mManagerReader(object):
 
     Attributes
     ----------
-    input_meta_file : dict
-        input mManager meta file of the acquistion
+    input_meta_file : MetadataFile
+        input mManager meta file of the acquistion. Entries other than 'Summary' are read on demand
     _meta_pos_list : list
         position list in the meta file
     _pos_list : list
@@ -88,11 +98,22 @@ class mManagerReader(object):
         Perform background correct (True) or not (False)
     binning : int
         binning (or pooling) size for the images
+    backend : str
+        'cv2' decodes each tiff with cv2.imread. 'memmap' returns read-only memory maps of
+        uncompressed tiffs so that only the accessed rows are read from disk
+    prefetcher : ImgPrefetcher or None
+        background reader serving read_img when prefetching is enabled
+    img_writer : object or None
+        writer used by export_img instead of writing one tiff per image, e.g. ZarrWriter
+    async_writer : AsyncWriter or None
+        thread pool writing the images of export_img in the background when asynchronous writing is enabled
 
     """
 
-    def __init__(self, img_sample_path, img_output_path=None, input_chans=[], output_chans=[], binning=1):
+    def __init__(self, img_sample_path, img_output_path=None, input_chans=[], output_chans=[], binning=1,
+                 backend='cv2'):
 
+        assert backend in ['cv2', 'memmap'], "backend must be 'cv2' or 'memmap'"
         pos_path = img_sample_path # mManager 2.0 single position format
         sub_dirs = get_sub_dirs(img_sample_path)
         if sub_dirs:
@@ -100,27 +121,39 @@ class mManagerReader(object):
             pos_path = os.path.join(img_sample_path, sub_dir)
             ##TODO: check the behavior of 2.0 gamma
         metadata_path = os.path.join(pos_path, 'metadata.txt')
-        with open(metadata_path, 'r') as f:
-            input_meta_file = json.load(f)
+        input_meta_file = MetadataFile(metadata_path)
+        summary = input_meta_file['Summary']
 
-        self.input_meta_file = input_meta_file
-        self.mm_version = input_meta_file['Summary']['MicroManagerVersion']
-        if self.mm_version == '1.4.22':
+        mm_version = summary['MicroManagerVersion']
+        if mm_version == '1.4.22':
             self.meta_parser = self._mm1_meta_parser
-        elif '2.0' in self.mm_version:
+        elif '2.0' in mm_version:
             self.meta_parser = self._mm2_meta_parser
         else:
             raise ValueError(
                 'Current MicroManager reader only supports version 1.4.22 and 2.0 but {} was detected'.
-                    format(self.mm_version))
+                    format(mm_version))
 
+        self._init_state(input_meta_file, img_sample_path, pos_path, img_output_path, summary['Prefix'],
+                         summary['ChNames'], input_chans, output_chans, summary['Positions'], summary['Frames'],
+                         summary['Slices'], binning, backend)
+        self._img_indices[pos_path] = ImgDirIndex.load(pos_path)
+        self._detect_img_name_format()
+        self.meta_parser()
+
+    def _init_state(self, input_meta_file, img_sample_path, pos_path, img_output_path, name, channels,
+                    input_chans, output_chans, n_pos, n_time, n_z, binning, backend):
+        """set the attributes shared by the readers of all the formats, with the current (c,t,p,z)
+        at the first image. width, height, time_stamp and the position lists are set by the readers"""
+        summary = input_meta_file['Summary']
+        self.input_meta_file = input_meta_file
+        self.mm_version = summary.get('MicroManagerVersion')
         self.img_sm_path = img_sample_path
         self.img_in_pos_path = pos_path
-        self.img_names = get_sorted_names(pos_path)
+        self._img_indices = {}  # position folder: index of its images
         self.img_name_format = None
-        self._detect_img_name_format()
         self.img_output_path = img_output_path
-        self.input_chans = self.channels = input_meta_file['Summary']['ChNames']
+        self.input_chans = self.channels = channels
         if input_chans:
             self.input_chans = input_chans
         self.n_input_chans = len(input_chans)
@@ -128,13 +161,13 @@ class mManagerReader(object):
         self.n_output_chans = len(output_chans)
         self.output_meta_file = []
         self.binning = binning
-        self.name = input_meta_file["Summary"]["Prefix"]
-        self.n_pos = input_meta_file['Summary']['Positions']
-        self.n_time = input_meta_file['Summary']['Frames']
-        self.n_z = input_meta_file['Summary']['Slices']
+        self.name = name
+        self.n_pos = n_pos
+        self.n_time = n_time
+        self.n_z = n_z
         self._t_list = self._meta_t_list = list(range(0, self.n_time))
         self._z_list = self._meta_z_list = list(range(0, self.n_z))
-        self.size_z_um = input_meta_file['Summary']['z-step_um']
+        self.size_z_um = summary.get('z-step_um')
         self.pos_idx = 0  # assuming only single image for background
         self.t_idx = 0
         self.z_idx = 0
@@ -142,7 +175,27 @@ class mManagerReader(object):
         self.bg = 'No Background'
         self.bg_method = 'Global'
         self.bg_correct = True
-        self.meta_parser()
+        self.prefetcher = None
+        self.img_writer = None
+        self.async_writer = None
+        self.backend = backend
+        self._plane_layouts = {}  # tiff path: plane layout, or None if it can't be memory-mapped
+
+    def __getstate__(self):
+        # reader and writer threads can't be pickled, e.g. to send the reader to another process.
+        # Prefetching and asynchronous writing are disabled in the copy
+        state = self.__dict__.copy()
+        state.update({'prefetcher': None, 'async_writer': None})
+        return state
+
+    def _parse_polacq_meta(self, summary):
+        """set the PolAcquisition settings in the summary metadata as attributes"""
+        self.acquScheme = summary['~ Acquired Using']
+        self.bg = summary['~ Background']
+        self.blackLevel = summary['~ BlackLevel']
+        self.mirror = summary['~ Mirror']
+        self.swing = summary['~ Swing (fraction)']
+        self.wavelength = summary['~ Wavelength (nm)']
 
     def _mm1_meta_parser(self):
         input_meta_file = self.input_meta_file
@@ -220,67 +273,294 @@ class mManagerReader(object):
             'some positions cannot be found in metadata'
         self._z_list = value
 
-    def _detect_img_name_format(self):
-        img_name = self.img_names[0]
-        if 'img_000000' in img_name:
-            self.img_name_format = 'mm_1_4_22'
-        elif 'position' in img_name:
-            self.img_name_format = 'mm_2_0'
-        elif 'img_' in img_name:
-            self.img_name_format = 'recon_order'
-        else:
-            raise ValueError('Unknown image name format')
-
-    def get_chan_name(self):
-        return self.input_chans[self.chan_idx]
+    @property
+    def img_names(self):
+        """sorted image file names in the first position folder"""
+        return natsort.natsorted(self._img_indices[self.img_in_pos_path].files.values())
 
-    def get_img_name(self):
+    def _detect_img_name_format(self):
+        self.img_name_format = self._img_indices[self.img_in_pos_path].img_name_format
+
+    def _get_img_index(self, pos_path):
+        """index of the images in a position folder, None if the folder can't be indexed"""
+        index = self._img_indices.get(pos_path)
+        if index is None:
+            try:
+                index = ImgDirIndex.load(pos_path)
+            except (OSError, ValueError):
+                return None
+            self._img_indices[pos_path] = index
+        return index
+
+    def get_chan_name(self, chan_idx=None):
+        if chan_idx is None:
+            chan_idx = self.chan_idx
+        return self.input_chans[chan_idx]
+
+    def get_img_name(self, chan_idx=None, t_idx=None, pos_idx=None, z_idx=None):
+        """file name of the image at (c,t,p,z). Indices default to the current ones"""
+        t_idx = self.t_idx if t_idx is None else t_idx
+        pos_idx = self.pos_idx if pos_idx is None else pos_idx
+        z_idx = self.z_idx if z_idx is None else z_idx
+        chan_name = self.get_chan_name(chan_idx)
         if self.img_name_format == 'mm_1_4_22':
             img_name = 'img_000000{:03d}_{}_{:03d}.tif'.\
-                format(self.t_idx, self.get_chan_name(), self.z_idx)
+                format(t_idx, chan_name, z_idx)
         elif self.img_name_format == 'mm_2_0':
-            chan_meta_idx = self.channels.index(self.get_chan_name())
+            chan_meta_idx = self.channels.index(chan_name)
             img_name = 'img_channel{:03d}_position{:03d}_time{:09d}_z{:03d}.tif'.\
-                format(chan_meta_idx, self.t_idx, self.pos_idx, self.z_idx)
+                format(chan_meta_idx, pos_idx, t_idx, z_idx)
         elif self.img_name_format == 'recon_order':
             img_name = 'img_{}_t{:03d}_p{:03d}_z{:03d}.tif'.\
-                format(self.t_idx, self.pos_idx, self.z_idx, self.get_chan_name())
+                format(chan_name, t_idx, pos_idx, z_idx)
         else:
             raise ValueError('Undefined image name format')
         return img_name
-    
-    def read_img(self):
-        """read a single image at (c,t,p,z)"""
-        img_name = self.get_img_name()
-        img_file = os.path.join(self.img_in_pos_path, img_name)
-        img = cv2.imread(img_file, -1) # flag -1 to preserve the bit dept of the raw image
-        if img is None:
-            warnings.warn('image "{}" cannot be found. Return None instead.'.format(img_name))
+
+    def read_img(self, dtype=np.float32):
+        """read a single image at (c,t,p,z)
+
+        Parameters
+        ----------
+        dtype : data type
+            data type of the returned image. The image is returned in the dtype of the file if None
+
+        Returns an image in dtype, or a read-only np.memmap in the raw dtype with the
+        'memmap' backend. None if the image doesn't exist.
+        """
+        key = (self.img_in_pos_path, self.chan_idx, self.t_idx, self.pos_idx, self.z_idx)
+        if self.prefetcher is not None:
+            img = self.prefetcher.get(key)
         else:
-            img = img.astype(np.float32, copy=False)  # convert to float32 without making a copy to save memory
+            img = self._read_img_at(*key)
+        if img is not None and dtype is not None and not isinstance(img, np.memmap):
+            img = img.astype(dtype, copy=False)  # convert without making a copy if the dtype already matches
+        return img
+
+    def _read_img_at(self, pos_path, chan_idx, t_idx, pos_idx, z_idx):
+        """read a single image at (c,t,p,z) in its native dtype without changing the reader state"""
+        img = self._read_raw_img(pos_path, chan_idx, t_idx, pos_idx, z_idx)
+        if img is None:
+            warnings.warn('image "{}" cannot be found. Return None instead.'.
+                          format(self.get_img_name(chan_idx, t_idx, pos_idx, z_idx)))
         return img
 
+    def _read_raw_img(self, pos_path, chan_idx, t_idx, pos_idx, z_idx):
+        """read a single image at (c,t,p,z) in its native dtype. None if it doesn't exist"""
+        img_file = self._get_img_file(pos_path, chan_idx, t_idx, pos_idx, z_idx)
+        if self.backend == 'memmap':
+            img = self._memmap_img(img_file)
+            if img is not None:
+                return img
+        return cv2.imread(img_file, -1) # flag -1 to preserve the bit dept of the raw image
+
+    def get_img_path(self, chan_idx, t_idx, pos_idx, z_idx):
+        """path of the image file at (c,t,p,z), pos_idx being the index in pos_list"""
+        pos_path = os.path.join(self.img_sm_path, self.pos_list[pos_idx])
+        return self._get_img_file(pos_path, chan_idx, t_idx, pos_idx, z_idx)
+
+    def _get_img_file(self, pos_path, chan_idx, t_idx, pos_idx, z_idx):
+        """path of the image at (c,t,p,z), looked up in the index of the position folder"""
+        img_name = None
+        index = self._get_img_index(pos_path)
+        if index is not None:
+            chan = self.get_chan_name(chan_idx)
+            if self.img_name_format == 'mm_2_0':
+                chan = self.channels.index(chan)
+            img_name = index.get(chan, t_idx, pos_idx, z_idx)
+        if img_name is None:
+            # not indexed, e.g. written after the folder was listed
+            img_name = self.get_img_name(chan_idx, t_idx, pos_idx, z_idx)
+        return os.path.join(pos_path, img_name)
+
+    def _memmap_img(self, img_file):
+        """memory-map an uncompressed tiff. None if the file is missing or can't be mapped"""
+        if img_file not in self._plane_layouts:
+            try:
+                self._plane_layouts[img_file] = tiff_plane_layout(img_file)
+            except (OSError, ValueError, struct.error):
+                return None
+        layout = self._plane_layouts[img_file]
+        if layout is None:
+            return None
+        return memmap_plane(img_file, layout)
+
+    def enable_prefetch(self, n_workers=2, depth=4):
+        """Serve read_img from a thread pool that reads ahead of the current z
+
+        Parameters
+        ----------
+        n_workers : int
+            number of reader threads
+        depth : int
+            number of z-slices (all input channels) to read ahead
+
+        """
+        self.disable_prefetch()
+        self.prefetcher = ImgPrefetcher(self._read_img_at,
+                                        n_workers=n_workers,
+                                        max_queued=depth * max(len(self.input_chans), 1))
+        self.prefetch_depth = depth
+
+    def disable_prefetch(self):
+        """Stop the prefetching threads and read images synchronously again"""
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def enable_async_write(self, n_workers=2, max_queued=16):
+        """Write the images of export_img in background threads
+
+        Parameters
+        ----------
+        n_workers : int
+            number of writer threads
+        max_queued : int
+            maximum number of images waiting to be written. export_img blocks when the queue is full
+
+        """
+        self.disable_async_write()
+        self.async_writer = AsyncWriter(n_workers=n_workers, max_queued=max_queued)
+
+    def flush_writes(self):
+        """Wait until all queued images are written. Raises the first error of the background writes"""
+        if self.async_writer is not None:
+            self.async_writer.flush()
+
+    def disable_async_write(self):
+        """Wait for the queued images, stop the writer threads and write images synchronously again"""
+        if self.async_writer is not None:
+            self.async_writer.close()
+            self.async_writer = None
+
+    def prefetch_slices(self, chan_idx_list=None):
+        """Queue reading of the current and the next z-slices of the current (t,p)
+
+        Parameters
+        ----------
+        chan_idx_list : list
+            indices of the input channels to read. All input channels if None
+
+        """
+        if self.prefetcher is None:
+            return
+        if chan_idx_list is None:
+            chan_idx_list = range(len(self.input_chans))
+        z_list = self.z_list
+        if self.z_idx in z_list:
+            z_start = z_list.index(self.z_idx)
+            z_ahead = z_list[z_start:z_start + self.prefetch_depth]
+        else:
+            z_ahead = [self.z_idx]
+        keys = [(self.img_in_pos_path, chan_idx, self.t_idx, self.pos_idx, z_idx)
+                for z_idx in z_ahead for chan_idx in chan_idx_list]
+        self.prefetcher.prefetch(keys)
+
+    def read_img_stack(self, chan_names=None, z_list=None, roi=None, binning=1,
+                       black_level=0, dtype=np.float32, n_workers=4, out=None):
+        """read a multi-channel z-stack at the current (t,p) into one contiguous array
+
+        The output buffer is allocated once and each plane is cropped, black-level
+        subtracted and binned straight into it. Planes are read in parallel.
+
+        Parameters
+        ----------
+        chan_names : list
+            names of the input channels to read. All input channels if None
+        z_list : list
+            z indices to read. self.z_list if None
+        roi : list
+            region of interest in format of [n_start_y, n_start_x, Ny, Nx]. Full frame if None
+        binning : int
+            binning (or pooling) size applied to each plane
+        black_level : float
+            camera black level subtracted from each plane. Integer outputs are clipped at 0
+        dtype : numpy dtype
+            dtype of the output array. None keeps the dtype of the raw images
+        n_workers : int
+            number of reader threads
+        out : np.ndarray
+            preallocated output array of shape (C, Z, Y, X) to fill
+
+        Returns
+        -------
+        img_stack : np.ndarray
+            image stack with shape (C, Z, Y, X)
+        """
+        if chan_names is None:
+            chan_names = self.input_chans
+        if z_list is None:
+            z_list = self.z_list
+        if roi is None:
+            roi = [0, 0, self.height, self.width]
+        assert roi[0] + roi[2] <= self.height and roi[1] + roi[3] <= self.width, \
+            "Region of interest is beyond the size of the actual image"
+        chan_idx_list = [self.input_chans.index(chan_name) for chan_name in chan_names]
+        planes = [(c, z, chan_idx, z_idx)
+                  for c, chan_idx in enumerate(chan_idx_list)
+                  for z, z_idx in enumerate(z_list)]
+        pos_path, t_idx, pos_idx = self.img_in_pos_path, self.t_idx, self.pos_idx
+
+        shape = (len(chan_idx_list), len(z_list), roi[2] // binning, roi[3] // binning)
+        if out is None:
+            if dtype is None:
+                _, _, chan_idx, z_idx = planes[0]
+                dtype = self._read_raw_img(pos_path, chan_idx, t_idx, pos_idx, z_idx).dtype
+            out = np.empty(shape, dtype=dtype)
+        elif out.shape != shape:
+            raise ValueError('Output buffer shape {} does not match stack shape {}'.format(out.shape, shape))
+
+        def fill_plane(plane):
+            c, z, chan_idx, z_idx = plane
+            img = self._read_raw_img(pos_path, chan_idx, t_idx, pos_idx, z_idx)
+            if img is None:
+                raise FileNotFoundError('image "{}" cannot be found'.
+                                        format(self.get_img_name(chan_idx, t_idx, pos_idx, z_idx)))
+            img = img[roi[0]:roi[0] + roi[2], roi[1]:roi[1] + roi[3]]
+            # the black level is subtracted before binning, in the output dtype, as by
+            # IntensityDataCreator.get_data_object
+            if np.issubdtype(out.dtype, np.integer):
+                black_level_int = out.dtype.type(round(black_level))
+                img = np.maximum(img.astype(out.dtype, copy=False), black_level_int)  # clipped at 0
+                img -= black_level_int
+            elif binning == 1:
+                np.subtract(img, black_level, out=out[c, z], dtype=out.dtype)
+                return
+            else:
+                img = np.subtract(img, black_level, dtype=out.dtype)
+            out[c, z] = mean_pooling_2d(img, binning)  # integer images are pooled with rounding
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # list() re-raises the first read error in the calling thread
+            list(executor.map(fill_plane, planes))
+        return out
+
+    def read_multi_chan_img_stack(self, z_range=None, z_ids=None):
+        """read multi-channel image stack at a given (t,p)
 
-    def read_multi_chan_img_stack(self, z_range=None):
-        """read multi-channel image stack at a given (t,p)"""
+        Parameters
+        ----------
+        z_range : list
+            [z_start, z_end) range of z indices to read
+        z_ids : list
+            z indices to read. Used instead of z_range if given
+
+        Returns
+        -------
+        img_chann : list
+            list of (z, y, x) float32 stacks, one per input channel
+        """
         if not os.path.exists(self.img_sm_path):
             raise FileNotFoundError(
                 "image file doesn't exist at:", self.img_sm_path
             )
-        if not z_range:
-            z_range = [0, self.nZ]
-        img_chann = []  # list of 2D or 3D images from different channels
-        for chan_idx in range(self.n_input_chans):
-            img_stack = []
-            self.chan_idx = chan_idx
-            for z_idx in range(z_range[0], z_range[1]):
-                self.z_idx = z_idx
-                img = self.read_img()
-                img_stack += [img]
-            img_stack = np.stack(img_stack)  # follow zyx order
-            img_chann += [img_stack]
-        return img_chann
-    
+        if z_ids is None:
+            if not z_range:
+                z_range = [0, self.n_z]
+            z_ids = list(range(z_range[0], z_range[1]))
+        img_stack = self.read_img_stack(z_list=z_ids)
+        return list(img_stack)  # follow zyx order
+
     def write_img(self, img):
         """only supports recon_order image name format currently"""
         if not os.path.exists(self.img_output_path): # create folder for processed images
@@ -297,8 +577,11 @@ class mManagerReader(object):
         self.input_meta_file['Summary']['ChNames'] = self.input_chans
         self.input_meta_file['Summary']['Channels'] = self.n_input_chans
         metaFileName = os.path.join(self.img_output_path, 'metadata.txt')
-        with open(metaFileName, 'w') as f:  
-            json.dump(self.input_meta_file, f)
+        if isinstance(self.input_meta_file, MetadataFile):
+            self.input_meta_file.write(metaFileName)  # streamed, per-frame entries are copied as they are
+        else:
+            with open(metaFileName, 'w') as f:
+                json.dump(self.input_meta_file, f)
         df_pos_path = os.path.join(self.img_output_path, 'pos_table.csv')
         df_pos = pd.DataFrame(list(enumerate(self.pos_list)),
                           columns=['pos idx', 'pos dir'])
@@ -328,14 +611,10 @@ class PolAcquReader(mManagerReader):
 
 
     """
-    def __init__(self, img_sample_path, img_output_path=None, input_chans=[], output_chans=[], binning=1):
-
-        mManagerReader.__init__(self, img_sample_path, img_output_path, input_chans, output_chans, binning)
-        metaFile = self.input_meta_file
-        self.acquScheme = metaFile['Summary']['~ Acquired Using']
-        self.bg = metaFile['Summary']['~ Background']
-        self.blackLevel = metaFile['Summary']['~ BlackLevel']
-        self.mirror = metaFile['Summary']['~ Mirror']
-        self.swing = metaFile['Summary']['~ Swing (fraction)']
-        self.wavelength = metaFile['Summary']['~ Wavelength (nm)']
+    def __init__(self, img_sample_path, img_output_path=None, input_chans=[], output_chans=[], binning=1,
+                 backend='cv2'):
+
+        mManagerReader.__init__(self, img_sample_path, img_output_path, input_chans, output_chans, binning,
+                                backend)
+        self._parse_polacq_meta(self.input_meta_file['Summary'])
 
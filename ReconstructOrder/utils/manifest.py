@@ -0,0 +1,110 @@
+"""
+Record of the reconstructed (position, time, z-block) units of an acquisition, so that an
+interrupted reconstruction can be resumed
+"""
+import hashlib
+import json
+import os
+
+
+# options that select the units to reconstruct or only change how fast they are reconstructed.
+# They don't change the output of a unit
+_RUNTIME_OPTIONS = {'dataset': ['processed_dir', 'samples', 'positions', 'z_slices', 'timepoints', 'background'],
+                    'processing': ['reader_backend', 'prefetch_workers', 'prefetch_depth', 'writer_workers',
+                                   'writer_queue_size', 'process_workers', 'resume', 'pipeline_queue_size',
+                                   'tf_cache_dir', 'tf_cache_size', 'stream_local_bg',
+                                   'birefringence_engine', 'reuse_buffers']}
+
+
+def config_hash(config, sample_path, bg_path):
+    """hash of the config options that change the reconstruction of a sample
+
+    Parameters
+    ----------
+    config : ConfigReader
+        config of the reconstruction
+    sample_path : str
+        path of the sample data
+    bg_path : str
+        path of the background data of the sample
+
+    Returns
+    -------
+    str
+        hex digest
+    """
+    options = {}
+    for section in ['dataset', 'processing', 'plotting']:
+        values = getattr(config, section).__dict__
+        options[section] = {key.strip('_'): value for key, value in values.items()
+                            if key.strip('_') not in _RUNTIME_OPTIONS.get(section, [])}
+    options['sample'] = os.path.basename(os.path.normpath(sample_path))
+    options['background'] = os.path.basename(os.path.normpath(bg_path))
+    return hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class CompletionManifest(object):
+    """Append-only log of the units of an acquisition whose images are written
+
+    Each line of the file is a JSON record of one unit, with the hash of the config that
+    reconstructed it and how long it took. Units recorded with another config hash are not
+    complete for the current config, but their durations still estimate the cost of the
+    units. Lines are appended with a single write, so that workers in several processes
+    can share the file.
+
+    Parameters
+    ----------
+    path : str
+        path of the manifest file
+    config_hash : str
+        hash of the config of the reconstruction, see config_hash
+    resume : bool
+        read the units completed by previous runs if True. Otherwise they are ignored
+        and all units are reconstructed again
+
+    """
+
+    def __init__(self, path, config_hash, resume=True):
+        self.path = path
+        self.config_hash = config_hash
+        self._done = set()
+        self._seconds = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # partly written line of an interrupted run
+                    key = self._key(record['pos'], record['p'], record['t'], record['z'])
+                    if record.get('seconds') is not None:
+                        self._seconds[key] = record['seconds']
+                    if resume and record.get('config') == config_hash:
+                        self._done.add(key)
+
+    @staticmethod
+    def _key(pos_name, pos_idx, t_idx, z_block):
+        return pos_name, pos_idx, t_idx, tuple(z_block)
+
+    def is_done(self, pos_name, pos_idx, t_idx, z_block):
+        """True if the z-slices z_block of position pos_idx (named pos_name) at time t_idx are reconstructed"""
+        return self._key(pos_name, pos_idx, t_idx, z_block) in self._done
+
+    def seconds(self, pos_name, pos_idx, t_idx, z_block):
+        """seconds the last reconstruction of a unit took, by any config. None if unknown"""
+        return self._seconds.get(self._key(pos_name, pos_idx, t_idx, z_block))
+
+    def record(self, pos_name, pos_idx, t_idx, z_block, seconds=None):
+        """Record a reconstructed unit that took seconds. Call it once its images are written"""
+        record = {'config': self.config_hash, 'pos': pos_name, 'p': pos_idx, 't': t_idx, 'z': list(z_block)}
+        if seconds is not None:
+            record['seconds'] = round(seconds, 3)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        key = self._key(pos_name, pos_idx, t_idx, z_block)
+        self._done.add(key)
+        if seconds is not None:
+            self._seconds[key] = record['seconds']
+
+    def __len__(self):
+        return len(self._done)
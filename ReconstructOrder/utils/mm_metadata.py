@@ -0,0 +1,182 @@
+"""
+Incremental parser of Micro-Manager metadata.txt files. Only the Summary block is decoded
+when the file is opened, per-frame entries are decoded on demand.
+"""
+import json
+import re
+import shutil
+from collections.abc import Mapping
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class MetadataFile(Mapping):
+    """Read-only mapping of the top-level entries of a metadata.txt file
+
+    The file is scanned in chunks with a JSON decoder and only the byte offsets of
+    the entries are recorded, so that per-frame entries of long acquisitions are not
+    held in memory. The scan stops at the requested key; the Summary block comes first
+    in Micro-Manager files, so reading it only reads the beginning of the file.
+    Decoded entries are cached, changes to them (e.g. to the Summary) are written by
+    `write`.
+
+    Parameters
+    ----------
+    path : str
+        path of the metadata.txt file
+    chunk_size : int
+        number of bytes read at a time
+    """
+
+    def __init__(self, path, chunk_size=1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._offsets = {}  # key: (start, end) byte offsets of the value
+        self._values = {}   # decoded values
+        self._entries = self._iter_entries()
+
+    def __getstate__(self):
+        # the open scan can't be pickled, it is restarted from the top of the file
+        state = self.__dict__.copy()
+        del state['_entries']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._entries = self._iter_entries()
+
+    def _iter_entries(self):
+        """yield (key, start, end) of the top-level entries, in file order
+
+        The file is decoded as latin-1 so that string indices are byte offsets;
+        keys and values are decoded as utf-8 from the raw bytes when they are used.
+        """
+        decoder = json.JSONDecoder()
+        with open(self.path, 'rb') as f:
+            buf, buf_start, pos, eof = '', 0, 0, False
+
+            def fill():
+                # read the next chunk and drop the part of the buffer that has been parsed
+                nonlocal buf, buf_start, pos, eof
+                chunk = f.read(self.chunk_size)
+                eof = not chunk
+                buf_start, buf, pos = buf_start + pos, buf[pos:] + chunk.decode('latin-1'), 0
+
+            def decode():
+                # decode the JSON value at pos, reading more of the file while it is incomplete
+                nonlocal pos
+                while True:
+                    try:
+                        value, end = decoder.raw_decode(buf, pos)
+                        if end < len(buf) or eof:
+                            pos = end
+                            return value
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                    fill()
+
+            def next_token():
+                # skip whitespace and return the next character, '' at the end of the file
+                nonlocal pos
+                while True:
+                    pos = _whitespace.match(buf, pos).end()
+                    if pos < len(buf) or eof:
+                        return buf[pos:pos + 1]
+                    fill()
+
+            if next_token() != '{':
+                raise ValueError('{} is not a JSON object'.format(self.path))
+            pos += 1
+            if next_token() == '}':
+                return
+            while True:
+                next_token()
+                key = decode().encode('latin-1').decode('utf-8')
+                if next_token() != ':':
+                    raise ValueError('Invalid JSON in {} after key "{}"'.format(self.path, key))
+                pos += 1
+                next_token()
+                start = buf_start + pos
+                decode()
+                yield key, start, buf_start + pos
+                token = next_token()
+                pos += 1
+                if token == '}':
+                    return
+                if token != ',':
+                    raise ValueError('Invalid JSON in {} after key "{}"'.format(self.path, key))
+
+    def _scan(self, stop_key=None):
+        """record entry offsets until stop_key is found, or to the end of the file"""
+        if stop_key in self._offsets:
+            return
+        for key, start, end in self._entries:
+            self._offsets[key] = (start, end)
+            if key == stop_key:
+                return
+
+    def written_keys(self):
+        """keys of the entries that are completely written, e.g. while the acquisition is still
+        writing the file. Unlike iterating over the mapping, an incomplete file is not an error"""
+        try:
+            self._scan()
+        except ValueError:
+            pass  # the last entry is being written
+        return list(self._offsets)
+
+    def _read_value(self, key):
+        start, end = self._offsets[key]
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return json.loads(f.read(end - start).decode('utf-8'))
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._scan(key)
+            if key not in self._offsets:
+                raise KeyError(key)
+            self._values[key] = self._read_value(key)
+        return self._values[key]
+
+    def __contains__(self, key):
+        self._scan(key)
+        return key in self._offsets
+
+    def __iter__(self):
+        self._scan()
+        return iter(self._offsets)
+
+    def __len__(self):
+        self._scan()
+        return len(self._offsets)
+
+    def write(self, path):
+        """Write the metadata to a new file, with the changes made to decoded entries
+
+        Unchanged parts of the file are copied as they are, without being decoded.
+        """
+        changed = sorted((self._offsets[key], key) for key in self._values)
+        with open(self.path, 'rb') as src, open(path, 'wb') as dst:
+            for (start, end), key in changed:
+                shutil.copyfileobj(_FileRange(src, src.tell(), start), dst)
+                dst.write(json.dumps(self._values[key]).encode('utf-8'))
+                src.seek(end)
+            shutil.copyfileobj(src, dst)
+
+
+class _FileRange(object):
+    """file-like view of the bytes [start, end) of an open file, for shutil.copyfileobj"""
+
+    def __init__(self, f, start, end):
+        self.f = f
+        self.remaining = end - start
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
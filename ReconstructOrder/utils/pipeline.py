@@ -0,0 +1,101 @@
+"""
+Chain generator stages into a pipeline, optionally running each stage in its own thread
+"""
+import queue
+import threading
+
+
+_END = object()  # last item of the output queue of a stage
+
+
+class PipelineStopped(Exception):
+    """raised in the stages of a threaded pipeline that is stopped after an error in another stage"""
+
+
+class _StageThread(threading.Thread):
+    """thread running a stage on the items of the previous stage, with a bounded output queue"""
+
+    def __init__(self, stage, items, queue_size, stop):
+        super().__init__(daemon=True)
+        self.stage = stage
+        self.items = items
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop = stop
+        self.error = None
+
+    def run(self):
+        try:
+            for item in self.stage(self.items):
+                self._put(item)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._put(_END)
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def output(self):
+        """items yielded by the stage. Raises the error of the stage after its last item"""
+        while True:
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop.is_set():
+                    raise PipelineStopped()
+                continue
+            if item is _END:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+
+def run_pipeline(source, stages, queue_size=0):
+    """Pass the items of source through the stages and consume the output of the last one
+
+    A stage is a function taking an iterable of items and returning an iterable (usually a
+    generator) of the items for the next stage. A stage can yield any number of items per
+    item it gets, and has to pass on the items it doesn't process.
+
+    Parameters
+    ----------
+    source : iterable
+        items of the first stage
+    stages : list
+        stage functions, in pipeline order
+    queue_size : int
+        0 chains the stages as generators in the calling thread. Otherwise each stage runs
+        in its own thread and passes its items to the next stage through a queue of
+        queue_size items, so that reading, computing and writing overlap. The first error
+        of a stage stops the other stages and is raised
+
+    """
+    items = source
+    if not queue_size:
+        for stage in stages:
+            items = stage(items)
+        for _ in items:
+            pass
+        return
+
+    stop = threading.Event()
+    threads = []
+    for stage in stages:
+        thread = _StageThread(stage, items, queue_size, stop)
+        threads.append(thread)
+        items = thread.output()
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in items:
+            pass
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
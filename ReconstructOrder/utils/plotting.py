@@ -171,8 +171,10 @@ def angular_hist(orientation,
     ax.set_thetamax(180)
     return ax, bars
 
-def render_birefringence_imgs(img_io, imgs, config, spacing=20, vectorScl=5, zoomin=False, dpi=300, norm=True, plot=True):
-    """ Parses transmission, retardance, orientation, and polarization images, scale and render them for export.  """
+def render_birefringence_imgs(img_io, imgs, config, spacing=20, vectorScl=5, zoomin=False, dpi=300, norm=True, plot=True,
+                              z_idx=None):
+    """ Parses transmission, retardance, orientation, and polarization images, scale and render them for export.
+    The figures are named with z_idx, or img_io.z_idx if it is None """
 
     outputChann = img_io.output_chans
     chann_scale = [0.25, 1, 0.05, 1, 1]  # scale fluor channels for composite images when norm=False
@@ -189,7 +191,9 @@ def render_birefringence_imgs(img_io, imgs, config, spacing=20, vectorScl=5, zoo
     if plot or any(chann in ['Retardance+Orientation', 'Polarization+Orientation', 'Brightfield+Retardance+Orientation']
                    for chann in outputChann):
         I_azi_ret_trans, I_azi_ret, I_azi_scat = aniso2hsv(I_trans, retard, azimuth_degree, polarization, norm=norm)
-        t_idx = img_io.t_idx; z_idx = img_io.z_idx; pos_idx = img_io.pos_idx
+        t_idx = img_io.t_idx; pos_idx = img_io.pos_idx
+        if z_idx is None:
+            z_idx = img_io.z_idx
         if plot:
             plot_recon_images(I_trans, retard, azimuth, polarization, I_azi_ret, I_azi_scat, zoomin=False, spacing=spacing,
                               vectorScl=vectorScl, dpi=dpi)
@@ -252,9 +256,7 @@ def render_birefringence_imgs(img_io, imgs, config, spacing=20, vectorScl=5, zoo
             continue
             
         imgDict[chann] = img
-        
-    img_io.channels = outputChann
-    img_io.nChann = len(outputChann)
+
     return img_io, imgDict
 
 
@@ -388,9 +390,10 @@ def plot_recon_images(s0, retard, azimuth, polarization, I_azi_ret, I_azi_scat,
     cbar.ax.set_yticklabels([r'$0^o$', r'$45^o$', r'$90^o$', r'$135^o$', r'$180^o$'])  # vertically oriented colorbar
 
 
-def plot_stokes(img_io, img_stokes, img_stokes_sm):
+def plot_stokes(img_io, img_stokes, img_stokes_sm, z_idx=None):
     t_idx = img_io.t_idx
-    z_idx = img_io.z_idx
+    if z_idx is None:
+        z_idx = img_io.z_idx
     pos_idx = img_io.pos_idx
     titles = ['s0', 's1', 's2', 's3']
     fig_name = 'stokes_t%03d_p%03d_z%03d.jpg' % (t_idx, pos_idx, z_idx)
@@ -399,9 +402,10 @@ def plot_stokes(img_io, img_stokes, img_stokes_sm):
     plot_sub_images(img_stokes_sm, titles, img_io.img_output_path, fig_name, colorbar=True)
 
 
-def plot_pol_imgs(img_io, imgs_pol, titles):
+def plot_pol_imgs(img_io, imgs_pol, titles, z_idx=None):
     t_idx = img_io.t_idx
-    z_idx = img_io.z_idx
+    if z_idx is None:
+        z_idx = img_io.z_idx
     pos_idx = img_io.pos_idx
     fig_name = 'imgs_pol_t%03d_p%03d_z%03d.jpg' % (t_idx, pos_idx, z_idx)
     plot_sub_images(imgs_pol, titles, img_io.img_output_path, fig_name, colorbar=True)
@@ -0,0 +1,78 @@
+"""
+Read images ahead of the reconstruction loop in background threads
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ImgPrefetcher(object):
+    """Bounded read-ahead queue of images served by a thread pool
+
+    Images are identified by hashable keys that are passed to `read_func` as
+    positional arguments. Keys requested via `prefetch` are read in the
+    background; `get` returns the prefetched image, or reads it synchronously
+    if it was never scheduled.
+
+    Parameters
+    ----------
+    read_func : callable
+        function that reads and returns the image for the unpacked key
+    n_workers : int
+        number of reader threads
+    max_queued : int
+        maximum number of images held in (or scheduled for) the read-ahead queue
+
+    """
+
+    def __init__(self, read_func, n_workers=2, max_queued=8):
+        assert n_workers > 0, 'n_workers must be a positive integer'
+        assert max_queued > 0, 'max_queued must be a positive integer'
+        self.read_func = read_func
+        self.n_workers = n_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+        self._pending = OrderedDict()
+
+    def prefetch(self, keys):
+        """Schedule reading of the images in `keys`, in the given order.
+
+        Queued images whose key is not in `keys` are stale (e.g. from the
+        previous position) and are dropped. No more than `max_queued` images
+        are scheduled at once.
+
+        Parameters
+        ----------
+        keys : list
+            keys of the upcoming images, most urgent first
+
+        """
+        keys = list(keys)
+        wanted = set(keys)
+        for key in [key for key in self._pending if key not in wanted]:
+            self._pending.pop(key).cancel()
+        for key in keys:
+            if len(self._pending) >= self.max_queued:
+                break
+            if key not in self._pending:
+                self._pending[key] = self._executor.submit(self.read_func, *key)
+
+    def get(self, key):
+        """Return the image for `key`, waiting for its read if it is in flight
+
+        Exceptions raised by `read_func` in the reader thread are re-raised here.
+        """
+        future = self._pending.pop(key, None)
+        if future is None:
+            return self.read_func(*key)
+        return future.result()
+
+    def clear(self):
+        """Drop all queued images"""
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def close(self):
+        """Drop all queued images and stop the reader threads"""
+        self.clear()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,149 @@
+"""
+Process the (position, time) units of an acquisition in a pool of worker processes.
+Idle workers take the next unit from the queue of the pool. Large arrays of the state
+shared by the units (background Stokes parameters, instrument matrix, phase transfer
+functions) are passed to the workers through shared memory
+"""
+import io
+import os
+import pickle
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .aux_utils import set_pt, pt_list
+from .scheduler import UtilisationReport
+
+
+class _SharedArrayPickler(pickle.Pickler):
+    """Pickler that copies numpy arrays larger than min_bytes into shared memory blocks
+    and pickles a reference to the block instead of the data.
+
+    The blocks are kept in `blocks` and have to be unlinked by the caller once
+    the pickle is no longer used. Needs Python 3.8 or later.
+    """
+
+    def __init__(self, file, min_bytes=1 << 16):
+        # imported here, the module is imported by reconstruct_batch on any Python version
+        from multiprocessing import shared_memory
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._shared_memory = shared_memory
+        self.min_bytes = min_bytes
+        self.blocks = []
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.nbytes < self.min_bytes or obj.dtype.hasobject:
+            return NotImplemented
+        block = self._shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        self.blocks.append(block)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=block.buf)[...] = obj
+        return _attach_shared_array, (block.name, obj.shape, obj.dtype.str)
+
+
+_attached_blocks = {}  # shared memory blocks opened by this worker process
+
+
+def _attach_shared_array(name, shape, dtype):
+    """read-only array backed by a shared memory block"""
+    from multiprocessing import shared_memory
+    block = _attached_blocks.get(name)
+    if block is None:
+        block = _attached_blocks[name] = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+
+_worker_func = None
+_worker_kwargs = None
+
+
+def _init_worker(state, prefetch, async_write):
+    global _worker_func, _worker_kwargs
+    _worker_func, _worker_kwargs = pickle.loads(state)
+    # the reader is a copy owned by this worker, with its own threads
+    img_io = _worker_kwargs['img_io']
+    if prefetch is not None:
+        img_io.enable_prefetch(*prefetch)
+    if async_write is not None:
+        img_io.enable_async_write(*async_write)
+
+
+def _run_unit(pos_idx, t_idx, z_blocks=None):
+    """process a unit, returns (worker pid, start time, end time)"""
+    start = time.time()
+    img_io = _worker_kwargs['img_io']
+    set_pt(img_io, pos_idx, t_idx)
+    func = getattr(_worker_func, '__wrapped__', _worker_func)  # undecorated by loop_pt
+    if z_blocks is None:
+        func(**_worker_kwargs)
+    else:
+        func(z_blocks=z_blocks, **_worker_kwargs)
+    img_io.flush_writes()
+    return os.getpid(), start, time.time()
+
+
+def loop_pt_processes(func, n_workers, prefetch=None, async_write=None, units=None, **kwargs):
+    """Call func for each (position, time) of kwargs['img_io'] in n_workers processes
+
+    Equivalent to func decorated with loop_pt, with the units run in parallel. The units
+    are started in order by the first idle worker. Each worker gets its own copy of
+    kwargs, unpickled once when the worker starts; numpy arrays in kwargs are shared
+    read-only between the workers. func must not modify its arguments across units,
+    the changes are not seen by the other workers.
+    Needs Python 3.8 or later, for the shared memory.
+
+    Parameters
+    ----------
+    func : callable
+        module-level function processing the current (p, t) of img_io, or the same function
+        decorated with loop_pt
+    n_workers : int
+        number of worker processes
+    prefetch : tuple or None
+        (n_workers, depth) arguments of mManagerReader.enable_prefetch for the reader of each worker
+    async_write : tuple or None
+        (n_workers, max_queued) arguments of mManagerReader.enable_async_write for the reader of each worker
+    units : list or None
+        (pos_idx, t_idx, z_blocks) units to process, in the order they are started. func is
+        called with the z_blocks keyword argument unless z_blocks is None. All the (p, t) of
+        img_io in loop_pt order if None
+    kwargs :
+        keyword arguments of func, including img_io
+
+    Returns
+    -------
+    UtilisationReport
+        time each worker spent processing units, printed at the end of the run
+
+    """
+    assert n_workers > 0, 'n_workers must be a positive integer'
+    if units is None:
+        units = [(pos_idx, t_idx, None) for pos_idx, t_idx in pt_list(kwargs['img_io'])]
+    report = UtilisationReport()
+    buffer = io.BytesIO()
+    pickler = _SharedArrayPickler(buffer)
+    try:
+        pickler.dump((func, kwargs))
+        executor = ProcessPoolExecutor(max_workers=n_workers,
+                                       mp_context=mp.get_context('spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(buffer.getvalue(), prefetch, async_write))
+        futures = []
+        try:
+            futures = [executor.submit(_run_unit, pos_idx, t_idx, z_blocks) for pos_idx, t_idx, z_blocks in units]
+            for future in futures:
+                report.add(*future.result())  # re-raises the first error of a worker
+        except BaseException:
+            for future in futures:
+                future.cancel()  # the units not started yet
+            executor.shutdown(wait=True)
+            raise
+        executor.shutdown(wait=True)
+    finally:
+        for block in pickler.blocks:
+            block.close()
+            block.unlink()
+    print(report.summary())
+    return report
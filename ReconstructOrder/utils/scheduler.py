@@ -0,0 +1,56 @@
+"""
+Order the units of a reconstruction by their cost and report how busy the workers were
+"""
+import time
+
+
+def order_by_cost(units, costs):
+    """Units in decreasing order of cost, so that the expensive units are started first and
+    the cheap ones fill the workers that become idle at the end of the run
+
+    Parameters
+    ----------
+    units : list
+        units to schedule
+    costs : list
+        estimated cost of each unit, None if unknown. Units of unknown cost are given the
+        mean cost of the other units
+
+    Returns
+    -------
+    list
+        units sorted by decreasing cost. Units of equal cost keep their order
+    """
+    known = [cost for cost in costs if cost is not None]
+    default = sum(known) / len(known) if known else 0
+    costs = [default if cost is None else cost for cost in costs]
+    order = sorted(range(len(units)), key=lambda idx: -costs[idx])
+    return [units[idx] for idx in order]
+
+
+class UtilisationReport(object):
+    """Time each worker spent processing units during a run"""
+
+    def __init__(self):
+        self.start = time.time()
+        self.end = self.start
+        self._units = {}  # worker: list of (start, end) of its units
+
+    def add(self, worker, start, end):
+        """record a unit processed by worker from start to end (time.time() values)"""
+        self._units.setdefault(worker, []).append((start, end))
+        self.end = max(self.end, end)
+
+    def busy_fraction(self, worker):
+        """fraction of the run the worker spent processing units"""
+        wall = self.end - self.start
+        busy = sum(end - start for start, end in self._units.get(worker, []))
+        return busy / wall if wall > 0 else 1.0
+
+    def summary(self):
+        """text table of the units and busy time of each worker"""
+        lines = ['Worker utilisation over {:.1f} s:'.format(self.end - self.start)]
+        for worker, units in sorted(self._units.items()):
+            lines.append('  worker {}: {} units, busy {:.0f}%'.format(
+                worker, len(units), 100 * self.busy_fraction(worker)))
+        return '\n'.join(lines)
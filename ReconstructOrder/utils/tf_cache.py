@@ -0,0 +1,95 @@
+"""
+On-disk cache of the phase transfer functions, keyed by the optical parameters that they depend on
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+
+_VERSION = 1  # changes when the computation of the transfer functions changes
+
+
+def tf_key(params):
+    """hex digest of the JSON of a dict of the parameters of transfer functions"""
+    params = dict(params, version=_VERSION)
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class TransferFunctionCache(object):
+    """Folder of the transfer functions computed by previous runs
+
+    Each entry is a sub-folder named after the key of its parameters with one .npy file
+    per array. Arrays are loaded as read-only memory maps. Entries are written to a
+    temporary folder that is then renamed, so that several processes can share the cache.
+    When the entries take more than max_size bytes the least recently used ones are deleted.
+
+    Parameters
+    ----------
+    cache_dir : str
+        folder of the cache, created if it doesn't exist
+    max_size : float
+        maximum size of the cache in bytes
+
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, params):
+        """dict of the arrays of the entry of params, None if it isn't cached"""
+        path = self._entry_path(tf_key(params))
+        try:
+            names = [name for name in os.listdir(path) if name.endswith('.npy')]
+            arrays = {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r') for name in names}
+            os.utime(path)  # most recently used
+        except (OSError, ValueError):
+            return None  # not cached, or deleted by another process
+        return arrays
+
+    def put(self, params, arrays):
+        """store the dict of arrays of params and evict the least recently used entries"""
+        path = self._entry_path(tf_key(params))
+        tmp_path = path + '.tmp-' + uuid.uuid4().hex
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        with open(os.path.join(tmp_path, 'params.json'), 'w') as f:
+            json.dump(params, f, sort_keys=True, default=str)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)  # written by another process meanwhile
+        self.evict()
+
+    def entries(self):
+        """(last use time, size in bytes, path) of the entries, least recently used first"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self._entry_path(key)
+            if '.tmp-' in key or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def evict(self):
+        """delete the least recently used entries until the cache fits in max_size"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,271 @@
+"""
+Read multi-page Micro-Manager (MMStack) and OME-TIFF stacks. Pages are located by their IFD offset
+and read directly, without decoding the rest of the file.
+"""
+import json
+import os
+import re
+import struct
+import threading
+import numpy as np
+import natsort
+
+from ..utils.mManagerIO import mManagerReader
+from ..utils.tiff_index import TiffHeader, read_ifd, plane_layout, memmap_plane, \
+    IMAGE_DESCRIPTION, MICROMANAGER_METADATA
+
+
+# Micro-Manager multi-page tiff header, following the 8 byte tiff header
+_MM_INDEX_MAP_OFFSET_HEADER = 54773648
+_MM_INDEX_MAP_HEADER = 3453623
+_MM_SUMMARY_HEADER = 2355492
+_MM_SUMMARY_OFFSET = 32
+
+_stack_suffixes = ('.ome.tif', '.ome.tiff')
+
+
+def is_tiff_stack_folder(path):
+    """True if the folder contains multi-page OME-TIFF (or Micro-Manager MMStack) files"""
+    if not os.path.isdir(path):
+        return False
+    return any(entry.name.lower().endswith(_stack_suffixes) for entry in os.scandir(path))
+
+
+def read_mm_header(fh, header):
+    """Read the summary metadata and the index map of a Micro-Manager multi-page tiff
+
+    Parameters
+    ----------
+    fh : file object
+        tiff file opened in binary mode
+    header : TiffHeader
+        header of the tiff file
+
+    Returns
+    -------
+    summary : dict or None
+        summary metadata, None if the file has none
+    index_map : np.ndarray or None
+        (N, 5) array of (channel, slice, frame, position, IFD offset) of the pages,
+        None if the file has no index map
+    """
+    if header.bigtiff:
+        return None, None
+    bo = header.byteorder
+    summary, index_map = None, None
+    fh.seek(8)
+    offset_header, index_map_offset = struct.unpack(bo + 'II', fh.read(8))
+    if offset_header == _MM_INDEX_MAP_OFFSET_HEADER:
+        fh.seek(index_map_offset)
+        map_header, count = struct.unpack(bo + 'II', fh.read(8))
+        if map_header == _MM_INDEX_MAP_HEADER:
+            index_map = np.frombuffer(fh.read(20 * count), dtype=bo + 'u4').reshape(count, 5)
+    fh.seek(_MM_SUMMARY_OFFSET)
+    summary_header, length = struct.unpack(bo + 'II', fh.read(8))
+    if summary_header == _MM_SUMMARY_HEADER:
+        summary = json.loads(fh.read(length).decode('utf-8'))
+    return summary, index_map
+
+
+def _ome_pixels(description):
+    """attributes of the Pixels element and channel names of OME-XML, None if it isn't OME-XML"""
+    match = re.search(r'<(?:\w+:)?Pixels\s([^>]*)>', description)
+    if match is None:
+        return None, []
+    attrs = dict(re.findall(r'(\w+)="([^"]*)"', match.group(1)))
+    chan_names = [dict(re.findall(r'(\w+)="([^"]*)"', chan)).get('Name')
+                  for chan in re.findall(r'<(?:\w+:)?Channel\s([^>]*?)/?>', description)]
+    return attrs, chan_names
+
+
+def _walk_pages(fh, header, pos_idx):
+    """index the pages of a tiff without MM index map by walking its IFD chain
+
+    The (c, t, z) coordinates of the pages are read from their Micro-Manager metadata tag,
+    or derived from the dimension order of the OME-XML description of the first page.
+
+    Returns
+    -------
+    pages : dict
+        {(c, t, p, z): IFD offset}
+    ome_chan_names : list
+        channel names in the OME-XML, empty if there is none
+    """
+    pages = {}
+    ome_pixels, ome_chan_names = None, []
+    offset, page_idx = header.first_ifd, 0
+    while offset:
+        tags, next_offset = read_ifd(fh, header, offset, tag_codes={IMAGE_DESCRIPTION, MICROMANAGER_METADATA})
+        if MICROMANAGER_METADATA in tags:
+            meta = json.loads(tags[MICROMANAGER_METADATA].decode('utf-8'))
+            key = (meta['ChannelIndex'], meta['FrameIndex'], meta.get('PositionIndex', pos_idx), meta['SliceIndex'])
+        else:
+            if page_idx == 0:
+                ome_pixels, ome_chan_names = _ome_pixels(tags.get(IMAGE_DESCRIPTION, b'').decode('utf-8', 'replace'))
+                if ome_pixels is None:
+                    ome_pixels = {'DimensionOrder': 'XYZCT', 'SizeZ': '1', 'SizeC': '1', 'SizeT': '1'}
+            coords, idx = {}, page_idx
+            for axis in ome_pixels['DimensionOrder'][2:]:
+                size = int(ome_pixels.get('Size' + axis, 1))
+                coords[axis], idx = idx % size, idx // size
+            key = (coords['C'], coords['T'], pos_idx, coords['Z'])
+        pages[key] = offset
+        offset, page_idx = next_offset, page_idx + 1
+    return pages, ome_chan_names
+
+
+class TiffStackReader(mManagerReader):
+    """Metadata and image reader for multi-page Micro-Manager (MMStack) and OME-TIFF stacks
+
+    The stack files of the acquisition folder are opened once to build an index of
+    (c, t, p, z) to (file, IFD offset), from the Micro-Manager index map in the file
+    header, or by walking the IFD chain for other OME-TIFFs. Each image is then read
+    with one read of its IFD and one read of its pixel data. Pages must be uncompressed.
+
+    Files whose pages have no position index (OME-TIFFs) are read as one position per
+    file, in natural sort order of the file names.
+
+    Parameters
+    ----------
+    img_sample_path : str
+        path of the folder with the stack files
+    img_output_path : str
+        full path of the output folder
+    input_chans : list
+        list of input channel names
+    output_chans : list
+        list of output channel names
+    binning : int
+        binning (or pooling) size for the images
+    backend : str
+        'cv2' reads each plane into memory. 'memmap' returns read-only memory maps of the
+        planes so that only the accessed rows are read from disk
+
+    Attributes
+    ----------
+    see mManagerReader. In addition, if the metadata contains PolAcquisition settings:
+    acquScheme, bg, blackLevel, mirror, swing, wavelength, see PolAcquReader
+    """
+
+    def __init__(self, img_sample_path, img_output_path=None, input_chans=[], output_chans=[], binning=1,
+                 backend='cv2'):
+        assert backend in ['cv2', 'memmap'], "backend must be 'cv2' or 'memmap'"
+        stack_files = natsort.natsorted(os.path.join(img_sample_path, entry.name)
+                                        for entry in os.scandir(img_sample_path)
+                                        if entry.name.lower().endswith(_stack_suffixes))
+        assert stack_files, 'No OME-TIFF files found in {}'.format(img_sample_path)
+        self._headers = {}
+        self._pages = {}  # (c, t, p, z): (file path, IFD offset)
+        self._layouts = {}  # (file path, IFD offset): plane layout
+        self._files = {}
+        self._lock = threading.Lock()
+        summary, chan_names = None, []
+        for file_idx, stack_file in enumerate(stack_files):
+            with open(stack_file, 'rb') as fh:
+                header = TiffHeader(fh)
+                self._headers[stack_file] = header
+                file_summary, index_map = read_mm_header(fh, header)
+                if index_map is not None:
+                    for chan_idx, z_idx, t_idx, pos_idx, ifd_offset in index_map.tolist():
+                        self._pages[(chan_idx, t_idx, pos_idx, z_idx)] = (stack_file, ifd_offset)
+                else:
+                    pages, ome_chan_names = _walk_pages(fh, header, file_idx)
+                    chan_names = chan_names or ome_chan_names
+                    self._pages.update({key: (stack_file, ifd_offset) for key, ifd_offset in pages.items()})
+                summary = summary or file_summary
+                if file_idx == 0:
+                    tags, _ = read_ifd(fh, header, header.first_ifd)
+                    layout = plane_layout(tags, header)
+                    if layout is None:
+                        raise ValueError('Compressed or tiled tiff stacks are not supported: {}'.format(stack_file))
+                    self.height, self.width = layout[1]
+
+        summary = dict(summary or {})
+        n_chan, n_time, n_pos, n_z = [max(key[i] for key in self._pages) + 1 for i in range(4)]
+        chan_names = summary.get('ChNames') or chan_names
+        if not chan_names or len(chan_names) != n_chan or not all(chan_names):
+            chan_names = ['Channel{}'.format(chan_idx) for chan_idx in range(n_chan)]
+        summary.setdefault('Prefix', os.path.basename(os.path.normpath(img_sample_path)))
+        summary['ChNames'] = chan_names
+        pos_dict_list = summary.get('StagePositions') or summary.get('InitialPositionList') or []
+        meta_pos_list = [pos_dict.get('Label') for pos_dict in pos_dict_list]
+        if len(meta_pos_list) != n_pos or not all(meta_pos_list):
+            meta_pos_list = ['Pos{}'.format(pos_idx) for pos_idx in range(n_pos)]
+
+        self._init_state({'Summary': summary}, img_sample_path, os.path.join(img_sample_path, meta_pos_list[0]),
+                         img_output_path, summary['Prefix'], chan_names, input_chans, output_chans,
+                         n_pos, n_time, n_z, binning, backend)
+        self.img_name_format = 'tiff_stack'
+        self._meta_pos_list = self._pos_list = meta_pos_list
+        self.time_stamp = summary.get('Time', summary.get('StartTime'))
+        if '~ Swing (fraction)' in summary:
+            self._parse_polacq_meta(summary)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.update({'_files': {}, '_lock': None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def close(self):
+        """close the open stack files"""
+        with self._lock:
+            for fh in self._files.values():
+                fh.close()
+            self._files = {}
+
+    def get_img_name(self, chan_idx=None, t_idx=None, pos_idx=None, z_idx=None):
+        """description of an image in the stacks, for messages"""
+        chan_idx = self.chan_idx if chan_idx is None else chan_idx
+        t_idx = self.t_idx if t_idx is None else t_idx
+        pos_idx = self.pos_idx if pos_idx is None else pos_idx
+        z_idx = self.z_idx if z_idx is None else z_idx
+        return '{} channel {} t{:03d} p{:03d} z{:03d}'.format(
+            self.img_sm_path, self.get_chan_name(chan_idx), t_idx, pos_idx, z_idx)
+
+    def _get_file(self, file_path):
+        fh = self._files.get(file_path)
+        if fh is None:
+            fh = self._files[file_path] = open(file_path, 'rb')
+        return fh
+
+    def _read_raw_img(self, pos_path, chan_idx, t_idx, pos_idx, z_idx):
+        """read a single page at (c,t,p,z) in its native dtype. None if it doesn't exist"""
+        chan_name = self.get_chan_name(chan_idx)
+        pos_name = os.path.relpath(pos_path, self.img_sm_path)
+        if chan_name not in self.channels or pos_name not in self._meta_pos_list:
+            return None
+        # index of the position in the stacks, pos_idx counts the positions being processed
+        key = (self.channels.index(chan_name), t_idx, self._meta_pos_list.index(pos_name), z_idx)
+        if key not in self._pages:
+            return None
+        page = self._pages[key]
+        file_path, ifd_offset = page
+        with self._lock:
+            layout = self._layouts.get(page)
+            if layout is None:
+                tags, _ = read_ifd(self._get_file(file_path), self._headers[file_path], ifd_offset)
+                layout = self._layouts[page] = plane_layout(tags, self._headers[file_path])
+        if layout is None:
+            raise ValueError('Compressed or tiled tiff pages are not supported: {}'.format(file_path))
+        if self.backend == 'memmap':
+            return memmap_plane(file_path, layout)
+        offset, shape, dtype = layout
+        img = np.empty(shape, dtype=dtype)
+        buf = memoryview(img).cast('B')
+        if hasattr(os, 'preadv'):
+            # positioned read, the file can be shared by the prefetching threads without locking
+            with self._lock:
+                fd = self._get_file(file_path).fileno()
+            n_read = os.preadv(fd, [buf], offset)
+        else:
+            with self._lock:
+                fh = self._get_file(file_path)
+                fh.seek(offset)
+                n_read = fh.readinto(buf)
+        if n_read != len(buf):
+            raise IOError('Unexpected end of file in {}'.format(file_path))
+        return img
@@ -0,0 +1,172 @@
+"""
+Minimal TIFF structure parser used to locate uncompressed image data in tiff files,
+so that planes can be memory-mapped or read by offset without decoding the whole file
+"""
+import struct
+import numpy as np
+
+
+# tiff tag codes used by the readers
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+IMAGE_DESCRIPTION = 270
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+SAMPLE_FORMAT = 339
+MICROMANAGER_METADATA = 51123
+
+_LAYOUT_TAGS = {IMAGE_WIDTH, IMAGE_LENGTH, BITS_PER_SAMPLE, COMPRESSION,
+                STRIP_OFFSETS, SAMPLES_PER_PIXEL, STRIP_BYTE_COUNTS, SAMPLE_FORMAT}
+
+# tiff field type: (struct format, size in bytes)
+_FIELD_TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('2I', 8),
+                6: ('b', 1), 7: ('s', 1), 8: ('h', 2), 9: ('i', 4), 10: ('2i', 8),
+                11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8)}
+
+_SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+class TiffHeader(object):
+    """Byte order, variant and first IFD offset of a tiff file
+
+    Parameters
+    ----------
+    fh : file object
+        tiff file opened in binary mode
+    """
+
+    def __init__(self, fh):
+        fh.seek(0)
+        order = fh.read(2)
+        if order == b'II':
+            self.byteorder = '<'
+        elif order == b'MM':
+            self.byteorder = '>'
+        else:
+            raise ValueError('Not a tiff file')
+        magic, = struct.unpack(self.byteorder + 'H', fh.read(2))
+        if magic == 42:
+            self.bigtiff = False
+            self.first_ifd, = struct.unpack(self.byteorder + 'I', fh.read(4))
+        elif magic == 43:
+            self.bigtiff = True
+            fh.read(4)  # offset size and padding
+            self.first_ifd, = struct.unpack(self.byteorder + 'Q', fh.read(8))
+        else:
+            raise ValueError('Not a tiff file')
+
+
+def read_ifd(fh, header, offset, tag_codes=_LAYOUT_TAGS):
+    """Read the requested tags of the image file directory (IFD) at `offset`
+
+    Parameters
+    ----------
+    fh : file object
+        tiff file opened in binary mode
+    header : TiffHeader
+        header of the tiff file
+    offset : int
+        byte offset of the IFD
+    tag_codes : set
+        codes of the tags to decode. Other tags are skipped without reading their values
+
+    Returns
+    -------
+    tags : dict
+        {tag code: tuple of values, or bytes for ASCII/UNDEFINED tags}
+    next_offset : int
+        byte offset of the next IFD, 0 for the last one
+    """
+    bo = header.byteorder
+    if header.bigtiff:
+        count_fmt, entry_fmt, entry_size, inline_size = 'Q', 'HHQ8s', 20, 8
+    else:
+        count_fmt, entry_fmt, entry_size, inline_size = 'H', 'HHI4s', 12, 4
+    fh.seek(offset)
+    n_entries, = struct.unpack(bo + count_fmt, fh.read(struct.calcsize(count_fmt)))
+    entries = fh.read(n_entries * entry_size)
+    next_offset, = struct.unpack(bo + ('Q' if header.bigtiff else 'I'),
+                                 fh.read(8 if header.bigtiff else 4))
+    tags = {}
+    for i in range(n_entries):
+        code, field_type, count, value = struct.unpack(bo + entry_fmt, entries[i * entry_size:(i + 1) * entry_size])
+        if code not in tag_codes or field_type not in _FIELD_TYPES:
+            continue
+        fmt, size = _FIELD_TYPES[field_type]
+        n_bytes = size * count
+        if n_bytes <= inline_size:
+            data = value[:n_bytes]
+        else:
+            data_offset, = struct.unpack(bo + ('Q' if header.bigtiff else 'I'), value)
+            fh.seek(data_offset)
+            data = fh.read(n_bytes)
+        if fmt == 's':
+            tags[code] = data.rstrip(b'\x00')
+        else:
+            tags[code] = struct.unpack(bo + fmt[-1] * (count * len(fmt)), data)
+    return tags, next_offset
+
+
+def plane_layout(tags, header):
+    """Location of the image data described by an IFD, if it can be read directly
+
+    Parameters
+    ----------
+    tags : dict
+        tags returned by read_ifd
+    header : TiffHeader
+        header of the tiff file
+
+    Returns
+    -------
+    tuple or None
+        (byte offset, shape, dtype) of the plane if it is an uncompressed
+        single-sample image stored in contiguous strips, None otherwise
+    """
+    if tags.get(COMPRESSION, (1,))[0] != 1 or tags.get(SAMPLES_PER_PIXEL, (1,))[0] != 1:
+        return None
+    if STRIP_OFFSETS not in tags or STRIP_BYTE_COUNTS not in tags:
+        return None  # tiled tiffs are not supported
+    offsets, counts = tags[STRIP_OFFSETS], tags[STRIP_BYTE_COUNTS]
+    for i in range(len(offsets) - 1):
+        if offsets[i] + counts[i] != offsets[i + 1]:
+            return None
+    bits = tags[BITS_PER_SAMPLE][0]
+    kind = _SAMPLE_FORMATS.get(tags.get(SAMPLE_FORMAT, (1,))[0])
+    if kind is None or bits not in (8, 16, 32, 64):
+        return None
+    dtype = np.dtype('{}{}{}'.format(header.byteorder, kind, bits // 8))
+    shape = (tags[IMAGE_LENGTH][0], tags[IMAGE_WIDTH][0])
+    if sum(counts) < shape[0] * shape[1] * dtype.itemsize:
+        return None
+    return offsets[0], shape, dtype
+
+
+def tiff_plane_layout(path):
+    """Parse the first IFD of a tiff file and return its plane layout, see plane_layout"""
+    with open(path, 'rb') as fh:
+        header = TiffHeader(fh)
+        tags, _ = read_ifd(fh, header, header.first_ifd)
+        return plane_layout(tags, header)
+
+
+def memmap_plane(path, layout):
+    """Read-only memory map of an uncompressed tiff plane
+
+    Parameters
+    ----------
+    path : str
+        path of the tiff file
+    layout : tuple
+        (byte offset, shape, dtype) of the plane as returned by plane_layout
+
+    Returns
+    -------
+    np.memmap
+        memory-mapped plane. Only the rows that are accessed are read from disk
+    """
+    offset, shape, dtype = layout
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
@@ -0,0 +1,152 @@
+"""
+SQLite work queue of (sample, position, time) reconstruction tasks, shared by worker processes
+on one or several machines
+"""
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+
+Task = namedtuple('Task', ['task_id', 'sample_idx', 'sample', 'pos_idx', 't_idx'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id     INTEGER PRIMARY KEY,
+    sample_idx  INTEGER NOT NULL,
+    sample      TEXT NOT NULL,
+    pos_idx     INTEGER NOT NULL,
+    t_idx       INTEGER NOT NULL,
+    state       TEXT NOT NULL DEFAULT 'pending',
+    worker      TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    UNIQUE (sample_idx, sample, pos_idx, t_idx)
+)
+"""
+
+
+class WorkQueue(object):
+    """Queue of reconstruction tasks in a SQLite file
+
+    Tasks are claimed atomically by a worker for `lease_time` seconds. A worker that is
+    still processing a task renews its lease; the task of a worker that crashed is claimed
+    again by another worker once its lease has expired. A task that has been claimed
+    `max_attempts` times without completing is marked as failed.
+
+    Adding tasks is idempotent, so that every worker can add the full task list when it
+    starts: tasks that are already in the queue keep their state. Tasks are keyed by the
+    index of their sample in the config, as a sample can be listed several times with
+    different backgrounds.
+
+    The file can be shared by workers on several nodes if the file system supports
+    POSIX file locks, which SQLite uses to serialize the transactions.
+
+    Parameters
+    ----------
+    db_path : str
+        path of the SQLite file, created if it doesn't exist
+    lease_time : float
+        seconds a claimed task is reserved for the worker that claimed it
+    max_attempts : int
+        number of times a task is claimed before it is marked as failed
+
+    """
+
+    def __init__(self, db_path, lease_time=600, max_attempts=3):
+        assert lease_time > 0, 'lease_time must be positive'
+        assert max_attempts > 0, 'max_attempts must be a positive integer'
+        self.db_path = db_path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        with self._transaction() as db:
+            db.execute(_SCHEMA)
+
+    def _transaction(self):
+        return _Transaction(self.db_path)
+
+    def add_tasks(self, tasks):
+        """Add (sample_idx, sample, pos_idx, t_idx) tasks that are not in the queue yet"""
+        with self._transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO tasks (sample_idx, sample, pos_idx, t_idx) VALUES (?, ?, ?, ?)',
+                           [(sample_idx, sample, pos_idx, t_idx) for sample_idx, sample, pos_idx, t_idx in tasks])
+
+    def claim(self, worker):
+        """Reserve the next pending task, or a task whose lease has expired, for worker
+
+        Returns
+        -------
+        task : Task or None
+            None if no task can be claimed now
+        """
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET state = 'failed', error = 'lease expired' "
+                       "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                       (now, self.max_attempts))
+            row = db.execute("SELECT task_id, sample_idx, sample, pos_idx, t_idx FROM tasks "
+                             "WHERE state = 'pending' OR (state = 'running' AND lease_until < ?) "
+                             "ORDER BY task_id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                       "WHERE task_id = ?", (worker, now + self.lease_time, row[0]))
+        return Task(*row)
+
+    def renew(self, task, worker):
+        """Extend the lease of a running task. False if the task is no longer leased to worker"""
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE tasks SET lease_until = ? "
+                                "WHERE task_id = ? AND worker = ? AND state = 'running'",
+                                (time.time() + self.lease_time, task.task_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, task, worker):
+        """Mark a task as done"""
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET state = 'done', lease_until = NULL, error = NULL "
+                       "WHERE task_id = ? AND worker = ?", (task.task_id, worker))
+
+    def fail(self, task, worker, error):
+        """Release a task after an error. It is queued again until it has been tried max_attempts times"""
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                       "lease_until = NULL, error = ? WHERE task_id = ? AND worker = ?",
+                       (self.max_attempts, str(error), task.task_id, worker))
+
+    def counts(self):
+        """number of tasks in each state ('pending', 'running', 'done', 'failed')"""
+        counts = dict.fromkeys(['pending', 'running', 'done', 'failed'], 0)
+        with self._transaction() as db:
+            counts.update(db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+        return counts
+
+    def failed_tasks(self):
+        """list of (Task, error) of the failed tasks"""
+        with self._transaction() as db:
+            rows = db.execute("SELECT task_id, sample_idx, sample, pos_idx, t_idx, error FROM tasks "
+                              "WHERE state = 'failed' ORDER BY task_id").fetchall()
+        return [(Task(*row[:5]), row[5]) for row in rows]
+
+
+class _Transaction(object):
+    """connection to the queue holding the write lock of the database until the block exits.
+    Committed if the block succeeds, rolled back otherwise"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.db.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+        finally:
+            self.db.close()
+        return False
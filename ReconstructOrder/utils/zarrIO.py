@@ -0,0 +1,336 @@
+"""
+Read and write images in chunked Zarr stores as an alternative to one tiff file per plane.
+Requires the optional zarr package.
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import natsort
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+from ..utils.mManagerIO import mManagerReader
+
+
+_float_chans = ['Stokes_0', 'Stokes_1', 'Stokes_2', 'Stokes_3',
+                'Stokes_0_sm', 'Stokes_1_sm', 'Stokes_2_sm', 'Stokes_3_sm']
+
+
+def _check_zarr():
+    if zarr is None:
+        raise ImportError('zarr is not installed. Install it with "pip install zarr" to use Zarr input or output')
+
+
+def is_zarr_store(path):
+    """True if path is the root of a Zarr store (v2 or v3)"""
+    return os.path.isdir(path) and (path.rstrip(os.sep).endswith('.zarr') or
+                                    any(os.path.exists(os.path.join(path, meta_file))
+                                        for meta_file in ['.zgroup', '.zarray', 'zarr.json']))
+
+
+def _require_array(group, name, **kwargs):
+    """create an array in a group, or open it if it exists (zarr 2 and 3 compatible)"""
+    if hasattr(group, 'require_array'):
+        return group.require_array(name, **kwargs)
+    return group.require_dataset(name, **kwargs)
+
+
+class ZarrWriter(object):
+    """Write output channels of one acquisition into a chunked, compressed Zarr store
+
+    The store holds one group per position. Single-channel images of each position are
+    written into the array '0' with (T, C, Z, Y, X) layout, RGB composite images into
+    the array 'rgb' with (T, C, Z, Y, X, 3) layout. Channel names of the C axes, the
+    acquisition metadata and the position table are stored as attributes.
+
+    Parameters
+    ----------
+    store_path : str
+        path of the Zarr store
+    img_io : mManagerReader
+        reader of the acquisition being reconstructed
+    chunks : list
+        chunk size of the (T, C, Z, Y, X) axes. -1 chunks the full axis
+
+    Attributes
+    ----------
+    channel_names : list
+        output channels in the C axis of the array '0'
+    rgb_channel_names : list
+        output channels in the C axis of the array 'rgb'
+    """
+
+    def __init__(self, store_path, img_io, chunks=(1, 1, 1, -1, -1)):
+        _check_zarr()
+        assert len(chunks) == 5, 'chunks must be given for the (T, C, Z, Y, X) axes'
+        self.store_path = store_path
+        self.chunks = list(chunks)
+        self.n_time = img_io.n_time
+        self.n_z = img_io.n_z
+        self.pos_list = img_io.pos_list
+        self.channel_names = [chan for chan in img_io.output_chans if '+' not in chan]
+        self.rgb_channel_names = [chan for chan in img_io.output_chans if '+' in chan]
+        self.dtype = np.float32 if any(chan in _float_chans for chan in self.channel_names) else np.uint16
+        self._root = None
+        self._arrays = {}
+        self._lock = threading.Lock()
+        # writes to chunks that span several planes must not interleave
+        self._serialize_writes = any(size != 1 for size in self.chunks[:3])
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = zarr.open_group(self.store_path, mode='a')
+            self._root.attrs.update({'channel_names': self.channel_names,
+                                     'rgb_channel_names': self.rgb_channel_names,
+                                     'axes': ['T', 'C', 'Z', 'Y', 'X']})
+        return self._root
+
+    def __getstate__(self):
+        # open stores and locks can't be pickled, they are re-created on first use
+        state = self.__dict__.copy()
+        state.update({'_root': None, '_arrays': {}, '_lock': None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def pos_name(self, pos_idx):
+        return self.pos_list[pos_idx] or 'Pos{}'.format(pos_idx)
+
+    def write_metadata(self, meta, pos_table):
+        """store the acquisition metadata and the position table as attributes
+
+        Parameters
+        ----------
+        meta : dict
+            metadata of the acquisition, e.g. the Summary block of metadata.txt
+        pos_table : list
+            list of (position index, position name)
+        """
+        self.root.attrs.update({'metadata': meta,
+                                'pos_table': [[pos_idx, pos_name] for pos_idx, pos_name in pos_table]})
+
+    def _get_array(self, pos_idx, rgb, img):
+        key = (pos_idx, rgb)
+        with self._lock:
+            if key not in self._arrays:
+                try:
+                    self._arrays[key] = self._require_pos_array(pos_idx, rgb, img)
+                except Exception:
+                    # created at the same time by a writer in another process, it can be opened now
+                    self._arrays[key] = self._require_pos_array(pos_idx, rgb, img)
+            return self._arrays[key]
+
+    def _require_pos_array(self, pos_idx, rgb, img):
+        pos_group = self.root.require_group(self.pos_name(pos_idx))
+        n_chan = len(self.rgb_channel_names) if rgb else len(self.channel_names)
+        shape = [self.n_time, n_chan, self.n_z] + list(img.shape[:2])
+        chunks = [dim if size == -1 else min(size, dim) for size, dim in zip(self.chunks, shape)]
+        if rgb:
+            shape, chunks = shape + [3], chunks + [3]
+        return _require_array(pos_group, 'rgb' if rgb else '0',
+                              shape=tuple(shape), chunks=tuple(chunks),
+                              dtype=img.dtype if rgb else self.dtype)
+
+    def write(self, img, chan_name, t_idx, pos_idx, z_idx):
+        """write one image of an output channel at (t,p,z)"""
+        rgb = chan_name in self.rgb_channel_names
+        array = self._get_array(pos_idx, rgb, img)
+        chan_idx = (self.rgb_channel_names if rgb else self.channel_names).index(chan_name)
+        if self._serialize_writes:
+            with self._lock:
+                array[t_idx, chan_idx, z_idx] = img
+        else:
+            array[t_idx, chan_idx, z_idx] = img
+
+
+class _ChunkCache(object):
+    """Thread-safe LRU cache of decoded blocks
+
+    Concurrent requests for a block that is being loaded wait for that load
+    instead of decoding the same chunks again.
+    """
+
+    def __init__(self, max_blocks):
+        assert max_blocks > 0, 'max_blocks must be a positive integer'
+        self.max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load_func):
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                return self._blocks[key]
+            loaded = self._loading.get(key)
+            is_loader = loaded is None
+            if is_loader:
+                loaded = self._loading[key] = threading.Event()
+        if not is_loader:
+            loaded.wait()
+            with self._lock:
+                if key in self._blocks:
+                    return self._blocks[key]
+            return load_func()  # the other load failed, or the block was already evicted
+        block = None
+        try:
+            block = load_func()
+        finally:
+            with self._lock:
+                if block is not None:
+                    self._blocks[key] = block
+                    while len(self._blocks) > self.max_blocks:
+                        self._blocks.popitem(last=False)
+                del self._loading[key]
+            loaded.set()
+        return block
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+class ZarrReader(mManagerReader):
+    """Metadata and image reader for acquisitions stored in a Zarr or OME-Zarr store
+
+    The store holds one group per position, each with a (T, C, Z, Y, X) image array:
+    the array '0' as written by ZarrWriter, or the full resolution level of OME-Zarr
+    multiscale images. A store whose root is an image is read as a single position.
+    Channel names are read from the 'channel_names' attribute of the store, or from
+    the OME-Zarr 'omero' metadata. Micro-Manager metadata stored in the 'metadata'
+    attribute, including the PolAcquisition settings, is used if present.
+
+    Images are read a whole chunk at a time, and decoded chunks are kept in an LRU
+    cache, so that reading the z-slices of a stack one by one decodes every chunk once.
+    Images returned by read_img are read-only views into the cache.
+
+    Parameters
+    ----------
+    img_sample_path : str
+        path of the Zarr store
+    img_output_path : str
+        full path of the output folder
+    input_chans : list
+        list of input channel names
+    output_chans : list
+        list of output channel names
+    binning : int
+        binning (or pooling) size for the images
+    cache_size : int
+        maximum number of decoded chunks kept in memory
+
+    Attributes
+    ----------
+    see mManagerReader. In addition, if the metadata contains PolAcquisition settings:
+    acquScheme, bg, blackLevel, mirror, swing, wavelength, see PolAcquReader
+    """
+
+    def __init__(self, img_sample_path, img_output_path=None, input_chans=[], output_chans=[], binning=1,
+                 cache_size=32):
+        _check_zarr()
+        root = zarr.open_group(img_sample_path, mode='r')
+        attrs = dict(root.attrs)
+        self._root = root
+        self._store_chans = attrs.get('channel_names')
+        if _image_array_name(root) is not None:
+            meta_pos_list = ['']  # the root of the store is a single image
+        else:
+            meta_pos_list = natsort.natsorted(root.group_keys())
+        assert meta_pos_list, 'No images found in Zarr store {}'.format(img_sample_path)
+        array = self._get_array(meta_pos_list[0])
+        assert array.ndim == 5, 'Zarr images must have (T, C, Z, Y, X) axes'
+        if self._store_chans is None:
+            self._store_chans = _omero_channel_names(self._get_group(meta_pos_list[0]), array.shape[1])
+
+        input_meta_file = dict(attrs.get('metadata', {}))
+        summary = dict(input_meta_file.get('Summary', {}))
+        input_meta_file['Summary'] = summary
+        name = summary.get('Prefix', os.path.splitext(os.path.basename(img_sample_path.rstrip(os.sep)))[0])
+        n_time, _, n_z, self.height, self.width = array.shape
+        self._init_state(input_meta_file, img_sample_path, os.path.join(img_sample_path, meta_pos_list[0]),
+                         img_output_path, name, list(self._store_chans), input_chans, output_chans,
+                         len(meta_pos_list), n_time, n_z, binning, 'zarr')
+        self._meta_pos_list = self._pos_list = meta_pos_list
+        self.time_stamp = summary.get('Time', summary.get('StartTime'))
+        self._chunk_cache = _ChunkCache(cache_size)
+        if '~ Swing (fraction)' in summary:
+            self._parse_polacq_meta(summary)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.update({'_root': None, '_chunk_cache': _ChunkCache(self._chunk_cache.max_blocks)})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._root = zarr.open_group(self.img_sm_path, mode='r')
+
+    def _get_group(self, pos_name):
+        return self._root[pos_name] if pos_name else self._root
+
+    def _get_array(self, pos_name):
+        group = self._get_group(pos_name)
+        array_name = _image_array_name(group)
+        assert array_name is not None, 'No image array found for position "{}"'.format(pos_name)
+        return group[array_name]
+
+    def _pos_name(self, pos_path):
+        pos_name = os.path.relpath(pos_path, self.img_sm_path)
+        return '' if pos_name == '.' else pos_name
+
+    def get_img_name(self, chan_idx=None, t_idx=None, pos_idx=None, z_idx=None):
+        """description of an image in the store, for messages"""
+        if chan_idx is None:
+            chan_idx = self.chan_idx
+        if t_idx is None:
+            t_idx = self.t_idx
+        if pos_idx is None:
+            pos_idx = self.pos_idx
+        if z_idx is None:
+            z_idx = self.z_idx
+        return '{} channel {} t{:03d} p{:03d} z{:03d}'.format(
+            self.img_sm_path, self.get_chan_name(chan_idx), t_idx, pos_idx, z_idx)
+
+    def _read_raw_img(self, pos_path, chan_idx, t_idx, pos_idx, z_idx):
+        """read a single image at (c,t,p,z) in its native dtype from the chunk cache"""
+        chan_name = self.input_chans[chan_idx]
+        if chan_name not in self._store_chans:
+            return None
+        pos_name = self._pos_name(pos_path)
+        array = self._get_array(pos_name)
+        idx = (t_idx, self._store_chans.index(chan_name), z_idx)
+        chunk_idx = tuple(i // size for i, size in zip(idx, array.chunks[:3]))
+
+        def load_block():
+            block = np.asarray(array[tuple(slice(i * size, (i + 1) * size)
+                                           for i, size in zip(chunk_idx, array.chunks[:3]))])
+            block.flags.writeable = False
+            return block
+
+        block = self._chunk_cache.get((pos_name,) + chunk_idx, load_block)
+        return block[tuple(i - j * size for i, j, size in zip(idx, chunk_idx, array.chunks[:3]))]
+
+
+def _image_array_name(group):
+    """name of the full resolution (T, C, Z, Y, X) array of an image group, None if the group has none"""
+    multiscales = group.attrs.get('multiscales')
+    if multiscales:
+        return multiscales[0]['datasets'][0]['path']
+    if '0' in list(group.array_keys()):
+        return '0'
+    return None
+
+
+def _omero_channel_names(group, n_chan):
+    """channel names from OME-Zarr 'omero' metadata, or 'Channel{i}' if there is none"""
+    channels = group.attrs.get('omero', {}).get('channels', [])
+    if len(channels) == n_chan:
+        return [chan.get('label', 'Channel{}'.format(i)) for i, chan in enumerate(channels)]
+    return ['Channel{}'.format(i) for i in range(n_chan)]
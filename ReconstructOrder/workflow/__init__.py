@@ -1,4 +1,5 @@
 # bchhun, {4/29/19}
 
 from . import multiDimProcess
-from .reconstructBatch import reconstruct_batch
\ No newline at end of file
+from .reconstructBatch import reconstruct_batch, run_queue_worker, dry_run
+from .watch import watch_acquisition
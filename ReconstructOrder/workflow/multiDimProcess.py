@@ -3,20 +3,22 @@ Process data collected over multiple positions, timepoints and z slices
 """
 
 import os
-import numpy as np
 import matplotlib
 import time
-import matplotlib.pyplot as plt
-from ..utils.imgIO import export_img
-from ..compute.reconstruct import ImgReconstructor
+from ..compute.reconstruct import ImgReconstructor, ReconstructionWorkspace
 from ..compute.reconstruct_phase import phase_reconstructor
-from ..utils.imgProcessing import im_bit_convert
-from ..utils.plotting import render_birefringence_imgs, plot_stokes, plot_pol_imgs
 from ..utils.mManagerIO import mManagerReader, PolAcquReader
-from ..datastructures import StokesData, IntensityDataCreator, IntensityData, PhysicalData
+from ..utils.zarrIO import ZarrReader, is_zarr_store
+from ..utils.tiffStackIO import TiffStackReader, is_tiff_stack_folder
+from ..datastructures import StokesData, IntensityDataCreator, IntensityData
 from ..utils.ConfigReader import ConfigReader
 from ..utils.flat_field import FlatFieldCorrector
 from ..utils.aux_utils import loop_pt
+from ..utils.pipeline import run_pipeline
+from .process_stages import SampleStages
+from .planner import ReconstructionPlan, plan_reconstruction
+from ..utils.manifest import CompletionManifest
+from ..utils.tf_cache import TransferFunctionCache
 from typing import Union
 
 matplotlib.use('Agg')
@@ -24,7 +26,9 @@ matplotlib.use('Agg')
 
 def create_metadata_object(data_path, config):
     """
-    Reads PolAcquisition metadata, if possible. Otherwise, reads MicroManager metadata.
+    Reads Zarr store metadata if data_path is a Zarr store, or the metadata of multi-page
+    OME-TIFF files if data_path contains them. Otherwise, reads PolAcquisition metadata,
+    if possible, or MicroManager metadata.
     TODO: move to imgIO?
 
     Parameters
@@ -40,15 +44,26 @@ def create_metadata_object(data_path, config):
         Metadata object
     """
 
+    if is_zarr_store(data_path):
+        return ZarrReader(data_path,
+                          output_chans=config.processing.output_channels,
+                          binning=config.processing.binning)
+    if is_tiff_stack_folder(data_path):
+        return TiffStackReader(data_path,
+                               output_chans=config.processing.output_channels,
+                               binning=config.processing.binning,
+                               backend=config.processing.reader_backend)
     try:
         img_obj = PolAcquReader(data_path,
                                 output_chans=config.processing.output_channels,
-                                binning=config.processing.binning
+                                binning=config.processing.binning,
+                                backend=config.processing.reader_backend
                                 )
     except:
         img_obj = mManagerReader(data_path,
                                  output_chans=config.processing.output_channels,
-                                 binning=config.processing.binning)
+                                 binning=config.processing.binning,
+                                 backend=config.processing.reader_backend)
     return img_obj
 
 
@@ -176,6 +191,19 @@ def parse_bg_options(img_obj_list, config):
     return img_obj_list
 
 
+def reconstruction_precision(img_io, config):
+    """
+    Floating point type of the ImgReconstructor of img_io: config.processing.precision, or
+    'float64' when the phase is reconstructed from the polarization channels. The phase
+    reconstructions amplify the rounding of s0 with small regularization parameters
+
+    """
+    plan = plan_reconstruction(img_io, config)
+    if plan.phase_deconv and plan.have_pol_data:
+        return 'float64'
+    return config.processing.precision
+
+
 def process_background(img_io, img_io_bg, config, img_int_creator: IntensityDataCreator):
     """
     Read background images, initiate ImgReconstructor to compute background stokes parameters
@@ -188,6 +216,7 @@ def process_background(img_io, img_io_bg, config, img_int_creator: IntensityData
     local_fit_order  = config.processing.local_fit_order
     use_gpu          = config.processing.use_gpu
     gpu_id           = config.processing.gpu_id
+    precision        = reconstruction_precision(img_io, config)
     
     if n_slice_local_bg == 'all':
         n_slice_local_bg = len(img_io.z_list)
@@ -201,7 +230,8 @@ def process_background(img_io, img_io_bg, config, img_int_creator: IntensityData
                                          azimuth_offset   = azimuth_offset,
                                          circularity      = circularity,
                                          use_gpu          = use_gpu,
-                                         gpu_id           = gpu_id)
+                                         gpu_id           = gpu_id,
+                                         precision        = precision)
 
     if img_io.bg_correct:
         background_stokes = img_reconstructor.compute_stokes(img_int_bg)
@@ -259,12 +289,16 @@ def phase_reconstructor_initializer(img_io: Union[mManagerReader, PolAcquReader]
     start_time=time.time()
     print('Computing phase transfer function (t=0 min)')
 
-    opt_mapping = {'Phase2D': '2D', 'Phase_semi3D': 'semi-3D', 'Phase3D': '3D'}
-    phase_deconv = [opt_mapping[opt] for opt in img_io.output_chans if opt in opt_mapping.keys()]
+    phase_deconv = plan_reconstruction(img_io, config).phase_deconv
+    
+    tf_cache = None
+    if config.processing.tf_cache_dir is not None:
+        tf_cache = TransferFunctionCache(config.processing.tf_cache_dir, config.processing.tf_cache_size * 1e9)
     
     ph_recon = phase_reconstructor((ROI[2], ROI[3], N_defocus), lambda_illu, ps, psz, NA_obj, NA_illu, focus_idx = focus_idx, \
                                    n_objective_media=n_objective_media, phase_deconv=phase_deconv, pad_z=pad_z,\
-                                   use_gpu=config.processing.use_gpu, gpu_id=config.processing.gpu_id)
+                                   use_gpu=config.processing.use_gpu, gpu_id=config.processing.gpu_id,
+                                   tf_cache=tf_cache)
 
     ph_recon.Phase_solver_para_setter(denoiser_2D    = config.processing.phase_denoiser_2D, \
                                       Tik_reg_abs_2D = config.processing.Tik_reg_abs_2D, Tik_reg_ph_2D = config.processing.Tik_reg_ph_2D, \
@@ -288,10 +322,16 @@ def process_sample_imgs(img_io: Union[mManagerReader, PolAcquReader]=None,
                         ff_corrector: FlatFieldCorrector=None,
                         int_bg: IntensityData=None,
                         stokes_bg: StokesData=None,
-                        ph_recon: phase_reconstructor=None):
+                        ph_recon: phase_reconstructor=None,
+                        manifest: CompletionManifest=None,
+                        plan: ReconstructionPlan=None,
+                        z_blocks: list=None,
+                        workspace: ReconstructionWorkspace=None):
     """
     Loop through each z supplied in the config; computes and export only images in the
     supplied output channels (stokes, birefringence, background corrected raw pol images);
+    The z-slices are passed through the stages of SampleStages that produce the output channels,
+    in separate threads if pipeline_queue_size > 0
 
     Parameters
     ----------
@@ -305,6 +345,16 @@ def process_sample_imgs(img_io: Union[mManagerReader, PolAcquReader]=None,
         BackgroundData object containing normalized stokes images
     ph_recon: object
         phase_reconstructor object that enables phase reconstruction
+    manifest: CompletionManifest
+        record of the reconstructed z-blocks. Recorded z-blocks are skipped and new ones are recorded
+        once their images are written
+    plan: ReconstructionPlan
+        computations needed for the output channels, planned from img_io and config if None
+    z_blocks: list
+        z-blocks of the position and time point to reconstruct, all the blocks of img_io.z_list if None
+    workspace: ReconstructionWorkspace
+        arrays reused from one z-block, position and time point to the next. Not used by a threaded
+        pipeline, whose stages reconstruct several blocks at the same time
     -------
     """
 
@@ -312,249 +362,25 @@ def process_sample_imgs(img_io: Union[mManagerReader, PolAcquReader]=None,
     pos_idx          = img_io.pos_idx
     z_list           = img_io.z_list
     n_slice_local_bg = img_reconstructor.n_slice_local_bg
-    norm             = config.plotting.normalize_color_images
-    separate_pos = config.processing.separate_positions
-    save_fig         = config.plotting.save_birefringence_fig
-    save_stokes_fig  = config.plotting.save_stokes_fig
-    save_pol_fig     = config.plotting.save_polarization_fig
-    
 
-    # 1) define allowed config values
-    #TODO: move the flag parser to ConfigReader and make flags part of the config attributes
-    pol_names       = ['Pol_State_0', 'Pol_State_1', 'Pol_State_2', 'Pol_State_3', 'Pol_State_4']
-    stokes_names    = ['Stokes_0', 'Stokes_1', 'Stokes_2', 'Stokes_3']
-    stokes_names_sm = [x + '_sm' for x in stokes_names]
-    birefring_names = ['Brightfield_computed', 'Retardance', 'Orientation', 'Orientation_x', 'Orientation_y',
-                       'Transmission', 'Polarization',
-                       'Retardance+Orientation', 'Polarization+Orientation', 'Brightfield+Retardance+Orientation',
-                       'Brightfield_computed+Retardance+Orientation',
-                       'Retardance+Fluorescence', 'Retardance+Fluorescence_all']
-    ret_Zavg_names  = ['RetardanceZavg', 'OrientationZavg']
-    phase_names     = ['Phase2D', 'Phase_semi3D', 'Phase3D', 'Absorption2D', 'Absorption_semi3D']
-    fluor_names     = ['405', '488', '568', '640', 'ex561em700']
-
-
-    # 2 )set flags based on names defined in 1)
-    save_stokes    = any(chan in stokes_names + stokes_names_sm for chan in img_io.output_chans) \
-                 or save_stokes_fig
-    save_phase     = any(chan in phase_names for chan in img_io.output_chans)
-    save_ret_Zavg  = any(chan in img_io.output_chans for chan in ret_Zavg_names)
-    save_birefring = any(chan in birefring_names for chan in img_io.output_chans) or save_fig or save_phase or save_ret_Zavg
-    save_BF        = 'Brightfield' in img_io.output_chans
-    save_pol       = any(chan in pol_names for chan in img_io.output_chans) or save_pol_fig
-    save_fluor     = any(chan in fluor_names for chan in img_io.output_chans)
-
-    have_pol_data = any([any([substring in chan_name for substring in ['State', 'state', 'Pol']])\
-                         for chan_name in img_io.input_chans])
-    if not have_pol_data:
-        save_birefring = False
+    pos_name = img_io.pos_list[pos_idx]
+    z_block_list = [z_list[z_stack_idx:z_stack_idx + n_slice_local_bg]
+                    for z_stack_idx in range(0, len(z_list), n_slice_local_bg)]
+    if z_blocks is not None:
+        z_block_list = [z_block for z_block in z_block_list if z_block in z_blocks]
+    if manifest is not None:
+        z_block_list = [z_block for z_block in z_block_list
+                        if not manifest.is_done(pos_name, pos_idx, t_idx, z_block)]
+        if not z_block_list:
+            print('Position %03d, time %03d is already reconstructed, skipped' % (pos_idx, t_idx))
+            return
 
     print('Processing position %03d, time %03d ... (t=0 min)' % (pos_idx, t_idx))
-    start_time=time.time()
-    for z_stack_idx in range(0, len(z_list), n_slice_local_bg):
-        stokes_param_sm_stack = [[] for i in range(len(stokes_names))]
-        fluor_stack_list = []
-        BF_stack = []
-
-        for z_list_idx in range(z_stack_idx, z_stack_idx + n_slice_local_bg):
-            z_idx = z_list[z_list_idx]
-
-            plt.close("all")  # close all the figures from the last run
-            img_io.z_idx = z_idx
-
-            # load raw intensity data
-            img_int_sm = img_int_creator.get_data_object(img_io)
-            img_int_sm = ff_corrector.correct_flat_field(img_int_sm)
-
-            img_dict = {}
-            if save_stokes or save_birefring:
-                # compute stokes
-                stokes_param_sm = img_reconstructor.compute_stokes(img_int_sm)
-                for stack, img in zip(stokes_param_sm_stack, stokes_param_sm.data):
-                    stack.append(img)
-                # retard = removeBubbles(retard)     # remove bright speckles in mounted brain slice images
-            img_bf = img_int_sm.get_image('BF')
-            if save_phase and not have_pol_data:
-                BF_stack.append(img_bf)
-            if save_BF and isinstance(img_bf, np.ndarray):
-                img_bf = img_bf / stokes_bg.s0  # flat-field correction
-                img_bf = im_bit_convert(img_bf * config.plotting.transmission_scaling, bit=16, norm=False)
-                img_dict.update({'Brightfield': img_bf})
-
-            if save_pol:
-                imgs_pol = []
-                for chan_name in int_bg.channel_names:
-                    imgs_pol += [img_int_sm.get_image(chan_name) / int_bg.get_image(chan_name)]
-                if save_pol_fig:
-                    plot_pol_imgs(img_io, imgs_pol, pol_names)
-                imgs_pol = [im_bit_convert(img * 10 ** 4, bit=16) for img in imgs_pol]
-                img_dict.update(dict(zip(pol_names, imgs_pol)))
-
-            img_fluor_list = [im_bit_convert(img_int_sm.get_image(chan)) for chan in fluor_names]
-            img_fluor = np.stack(img_fluor_list)
-            fluor_stack_list.append(img_fluor)
-            if save_fluor:
-                img_dict.update(dict(zip(fluor_names, img_fluor_list)))
-
-            export_img(img_io, img_dict, separate_pos)
-
-        # generate images?
-        if save_stokes or save_birefring:
-
-            # build StokesData
-            stk_dat = StokesData()
-            [stk_dat.s0,
-             stk_dat.s1,
-             stk_dat.s2,
-             stk_dat.s3] = [np.stack(stack, axis=-1) for stack in stokes_param_sm_stack]
-
-            norm_sample = img_reconstructor.stokes_normalization(stk_dat)
-            if img_io.bg_correct:
-                norm_sample = img_reconstructor.correct_background(norm_sample, stokes_bg)
-
-            if save_ret_Zavg:
-                stk_attribute_name = ['s0', 's1_norm', 's2_norm', 's3', 'polarization']
-                norm_sample_Zavg = StokesData()
-                [norm_sample_Zavg.s0,
-                 norm_sample_Zavg.s1_norm,
-                 norm_sample_Zavg.s2_norm,
-                 norm_sample_Zavg.s3,
-                 norm_sample_Zavg.polarization] = [np.mean(stack, axis=2) for stack in
-                                                  [norm_sample.__getattribute__(stack_name) for stack_name in stk_attribute_name]]
-
-                physical_data_Zavg = img_reconstructor.reconstruct_birefringence(norm_sample_Zavg)
-
-            elapsed_time=(time.time()-start_time)/60
-            print('Reconstructing retardance and orientation (t=%3.2f min)' % elapsed_time)
-
-            physical_data = img_reconstructor.reconstruct_birefringence(norm_sample)
-
-            elapsed_time=(time.time()-start_time)/60
-            print('Finished reconstructing retardance and orientation (t=%3.2f min)' % elapsed_time)
-
-
-            img_dict = {}
-            for z_idx in range(z_stack_idx, z_stack_idx + n_slice_local_bg):
-                plt.close("all")  # close all the figures from the last run
-                img_io.z_idx = z_list[z_idx]
-                z_sub_idx = z_idx - z_stack_idx
-
-                # extract the relevant z slice out of the data
-                s0           = physical_data.I_trans[..., z_sub_idx]
-                retard       = physical_data.retard[..., z_sub_idx]
-                azimuth      = physical_data.azimuth[..., z_sub_idx]
-                polarization = physical_data.polarization[..., z_sub_idx]
-                s1           = (norm_sample.s1_norm * norm_sample.s3)[..., z_sub_idx]
-                s2           = (norm_sample.s2_norm * norm_sample.s3)[..., z_sub_idx]
-                s3           = (norm_sample.s3)[..., z_sub_idx]
-
-
-                img_fluor = fluor_stack_list[z_sub_idx]
-
-                if save_birefring:
-                    imgs = [s0, retard, azimuth, polarization, img_fluor]
-                    img_io, img_dict = render_birefringence_imgs(img_io, imgs, config, spacing=20, vectorScl=8, zoomin=False,
-                                                                 dpi=200,
-                                                                 norm=norm, plot=save_fig)
-
-                if save_stokes:
-                    img_stokes = [s0, s1, s2, s3]
-                    img_stokes_sm = [stack[..., z_sub_idx] for stack in norm_sample.data]
-
-                    if save_stokes_fig:
-                        plot_stokes(img_io, img_stokes, img_stokes_sm)
-                    img_stokes         = [x.astype(np.float32, copy=False) for x in img_stokes]
-                    img_stokes_sm      = [x.astype(np.float32, copy=False) for x in img_stokes_sm]
-                    img_stokes_dict    = dict(zip(stokes_names, img_stokes))
-                    img_stokes_sm_dict = dict(zip(stokes_names_sm, img_stokes_sm))
-                    img_dict.update(img_stokes_dict)
-                    img_dict.update(img_stokes_sm_dict)
-
-                export_img(img_io, img_dict, separate_pos)
-
-            if save_ret_Zavg:
-                plt.close("all")  # close all the figures from the last run
-                img_io.z_idx = z_list[0]
-                img_dict = {}
-                retard   = physical_data_Zavg.retard
-                azimuth  = physical_data_Zavg.azimuth
-                for channel in list(set(ret_Zavg_names) & set(img_io.output_chans)):
-                    if channel == 'RetardanceZavg':
-                        img = im_bit_convert(retard * config.plotting.retardance_scaling, bit=16)
-                        img_dict[channel] = img.copy()
-                    elif channel == 'OrientationZavg':
-                        azimuth_degree = azimuth/np.pi*180
-                        img = im_bit_convert(azimuth_degree * 100, bit=16)
-                        img_dict[channel] = img.copy()
-                export_img(img_io, img_dict, separate_pos)
-
-
-            elapsed_time=(time.time()-start_time) / 60
-            print('Finish exporting birefringent reconstruction (t=%3.2f min)' % elapsed_time)
-
-        if save_phase:
-
-            if not have_pol_data:            
-                norm_sample = StokesData()
-                norm_sample.s0 = np.stack(BF_stack, axis=-1)
-                physical_data = PhysicalData()
-            for deconv_dim in ph_recon.phase_deconv:
-
-                if deconv_dim == '2D':
-                    elapsed_time = (time.time() - start_time) / 60
-                    print('Reconstructing 2D phase (t=%3.2f min)' % elapsed_time)
-
-                    physical_data.absorption_2D, physical_data.phase_2D = ph_recon.Phase_recon_2D(norm_sample)
-
-                    elapsed_time = (time.time() - start_time) / 60
-                    print('Finished reconstructing 2D phase (t=%3.2f min)' % elapsed_time)
-                if deconv_dim == 'semi-3D':
-                    elapsed_time = (time.time() - start_time) / 60
-                    print('Reconstructing semi-3D phase (t=%3.2f min)' % elapsed_time)
-
-                    physical_data.absorption_semi3D, physical_data.phase_semi3D = ph_recon.Phase_recon_semi_3D(norm_sample)
-
-                    elapsed_time = (time.time() - start_time) / 60
-                    print('Finished reconstructing semi-3D phase (t=%3.2f min)' % elapsed_time)
-                if deconv_dim == '3D':
-                    elapsed_time = (time.time() - start_time) / 60
-                    print('Reconstructing 3D phase (t=%3.2f min)' % elapsed_time)
-
-                    physical_data.phase_3D = ph_recon.Phase_recon_3D(norm_sample)
-
-                    elapsed_time = (time.time() - start_time) / 60
-                    print('Finished reconstructing 3D phase (t=%3.2f min)' % elapsed_time)
-
-
-            for z_idx in range(z_stack_idx, z_stack_idx + n_slice_local_bg):
-                plt.close("all")  # close all the figures from the last run
-                img_io.z_idx = z_list[z_idx]
-                z_sub_idx = z_idx - z_stack_idx
-
-                img_dict = {}
-                for channel in list(set(phase_names) & set(img_io.output_chans)):
-                    if ph_recon.focus_idx == z_sub_idx and channel == 'Phase2D':
-                        img = im_bit_convert(physical_data.phase_2D * config.plotting.phase_2D_scaling, bit=16, norm=True, limit=[-5, 5])
-                        img_dict[channel] = img.copy()
-                    elif ph_recon.focus_idx == z_sub_idx and channel == 'Absorption2D':
-                        img = im_bit_convert(physical_data.absorption_2D * config.plotting.absorption_2D_scaling, bit=16, norm=True, limit=[-1, 1])
-                        img_dict[channel] = img.copy()
-                    elif channel == 'Phase_semi3D':
-                        img = im_bit_convert(physical_data.phase_semi3D[..., z_sub_idx] * config.plotting.phase_2D_scaling, bit=16, norm=True, limit=[-5, 5])
-                        img_dict[channel] = img.copy()
-                    elif channel == 'Absorption_semi3D':
-                        img = im_bit_convert(physical_data.absorption_semi3D[..., z_sub_idx] * config.plotting.absorption_2D_scaling, bit=16, norm=True, limit=[-1, 1])
-                        img_dict[channel] = img.copy()
-                    elif channel == 'Phase3D':
-                        img = im_bit_convert(physical_data.phase_3D[..., z_sub_idx] * config.plotting.phase_3D_scaling, bit=16, norm=True, limit=[-5, 5])
-                        img_dict[channel] = img.copy()
-
-                export_img(img_io, img_dict, separate_pos)
-
-
-        elapsed_time=(time.time()-start_time) / 60
-        print('Finish processing and exporting all reconstructions (t=%3.2f min)' % elapsed_time)
-
-
-
-
+    if plan is None:
+        plan = plan_reconstruction(img_io, config)
+    # the stage threads would not use the device selected by gpu_id
+    queue_size = 0 if config.processing.use_gpu else config.processing.pipeline_queue_size
+    sample_stages = SampleStages(img_io, config, plan, img_reconstructor, img_int_creator, ff_corrector,
+                                 int_bg, stokes_bg, ph_recon, manifest,
+                                 workspace=workspace if queue_size == 0 else None)
+    run_pipeline(z_block_list, sample_stages.stages(), queue_size=queue_size)
@@ -0,0 +1,195 @@
+"""
+Plan the computations needed for the requested output channels
+"""
+from ..datastructures.create_intensity_data import IntensityDataCreator
+
+
+pol_names       = ['Pol_State_0', 'Pol_State_1', 'Pol_State_2', 'Pol_State_3', 'Pol_State_4']
+stokes_names    = ['Stokes_0', 'Stokes_1', 'Stokes_2', 'Stokes_3']
+stokes_names_sm = [x + '_sm' for x in stokes_names]
+birefring_names = ['Brightfield_computed', 'Retardance', 'Orientation', 'Orientation_x', 'Orientation_y',
+                   'Transmission', 'Polarization',
+                   'Retardance+Orientation', 'Polarization+Orientation', 'Brightfield+Retardance+Orientation',
+                   'Brightfield_computed+Retardance+Orientation',
+                   'Retardance+Fluorescence', 'Retardance+Fluorescence_all']
+fluor_composite_names = ['Retardance+Fluorescence', 'Retardance+Fluorescence_all']
+ret_Zavg_names  = ['RetardanceZavg', 'OrientationZavg']
+phase_names     = ['Phase2D', 'Phase_semi3D', 'Phase3D', 'Absorption2D', 'Absorption_semi3D']
+fluor_names     = ['405', '488', '568', '640', 'ex561em700']
+
+# phase deconvolution computing each phase and absorption output
+phase_deconv_outputs = {'Phase2D': '2D', 'Absorption2D': '2D',
+                        'Phase_semi3D': 'semi-3D', 'Absorption_semi3D': 'semi-3D',
+                        'Phase3D': '3D'}
+
+_pol_int_chans = ['IExt', 'I90', 'I135', 'I45', 'I0']
+
+# description of each computation step
+_step_descriptions = {
+    'read_pol': 'read the polarization channels',
+    'read_bf': 'read the brightfield channel',
+    'read_fluor': 'read the fluorescence channels',
+    'flat_field': 'flat-field correct the fluorescence images',
+    'fluorescence': 'convert the fluorescence images to 16 bit',
+    'brightfield': 'divide the brightfield images by the background transmission',
+    'pol_ratio': 'divide the polarization images by the background images',
+    'stokes': 'compute the Stokes parameters of each z-block',
+    'stokes_normalized': 'normalize the Stokes parameters of each z-block and correct the background',
+    'birefringence': 'compute retardance, orientation and transmission',
+    'birefringence_Zavg': 'compute retardance and orientation of the z-averaged Stokes parameters',
+    'phase_2D': 'reconstruct 2D phase and absorption',
+    'phase_semi3D': 'reconstruct semi-3D phase and absorption',
+    'phase_3D': 'reconstruct 3D phase',
+}
+
+_missing_input = {'read_pol': 'no polarization channel acquired', 'read_bf': 'no brightfield channel acquired'}
+
+_phase_steps = {'2D': 'phase_2D', 'semi-3D': 'phase_semi3D', '3D': 'phase_3D'}
+
+
+class ReconstructionPlan(object):
+    """Dependency graph of the computations producing the requested output channels
+
+    Each output channel and figure depends on computation steps, which depend on other
+    steps and finally on reading some input channels. Only the steps the requested
+    outputs depend on are run, and only the input channels they use are read.
+    Outputs that need input channels that were not acquired are skipped.
+
+    Parameters
+    ----------
+    output_chans : list
+        requested output channels
+    input_chans : list
+        acquired input channels
+    flatfield : bool
+        flat-field correct the fluorescence images
+    birefringence_fig : bool
+        save the figures of the birefringence
+    stokes_fig : bool
+        save the figures of the Stokes parameters
+    pol_fig : bool
+        save the figures of the polarization images
+
+    """
+
+    def __init__(self, output_chans, input_chans, flatfield=False,
+                 birefringence_fig=False, stokes_fig=False, pol_fig=False):
+        self.output_chans = list(output_chans)
+        self.input_chans = list(input_chans)
+        int_chans = {chan: IntensityDataCreator.int_chan_name(chan) for chan in self.input_chans}
+        chans_of_step = {
+            'read_pol': [chan for chan in self.input_chans if int_chans[chan] in _pol_int_chans],
+            'read_bf': [chan for chan in self.input_chans if int_chans[chan] == 'BF'],
+            'read_fluor': [chan for chan in self.input_chans if int_chans[chan] in fluor_names],
+        }
+        self.have_pol_data = bool(chans_of_step['read_pol'])
+        phase_input = 'stokes_normalized' if self.have_pol_data else 'read_bf'
+        self.dependencies = {
+            'read_pol': [],
+            'read_bf': [],
+            'read_fluor': [],
+            'flat_field': ['read_fluor'],
+            'fluorescence': ['read_fluor'] + (['flat_field'] if flatfield else []),
+            'brightfield': ['read_bf'],
+            'pol_ratio': ['read_pol'],
+            'stokes': ['read_pol'],
+            'stokes_normalized': ['stokes'],
+            'birefringence': ['stokes_normalized'],
+            'birefringence_Zavg': ['stokes_normalized'],
+            'phase_2D': [phase_input],
+            'phase_semi3D': [phase_input],
+            'phase_3D': [phase_input],
+        }
+
+        # steps needed by each requested output
+        outputs = {}
+        for chan in self.output_chans:
+            if chan in pol_names:
+                outputs[chan] = ['pol_ratio']
+            elif chan in stokes_names + stokes_names_sm:
+                outputs[chan] = ['stokes_normalized']
+            elif chan in fluor_composite_names:
+                outputs[chan] = ['birefringence', 'fluorescence']
+            elif chan in birefring_names:
+                outputs[chan] = ['birefringence']
+            elif chan in ret_Zavg_names:
+                outputs[chan] = ['birefringence_Zavg']
+            elif chan in phase_deconv_outputs:
+                outputs[chan] = [_phase_steps[phase_deconv_outputs[chan]]]
+            elif chan in fluor_names:
+                outputs[chan] = ['fluorescence']
+            elif chan == 'Brightfield':
+                outputs[chan] = ['brightfield']
+        for fig, enabled, steps in [('birefringence figure', birefringence_fig, ['birefringence']),
+                                    ('Stokes figure', stokes_fig, ['stokes_normalized']),
+                                    ('polarization figure', pol_fig, ['pol_ratio'])]:
+            if enabled:
+                outputs[fig] = steps
+
+        # outputs whose input channels were not acquired are skipped. Fluorescence channels
+        # that were not acquired are blank images
+        self.skipped = {}
+        self.outputs = {}
+        for output, steps in outputs.items():
+            missing = [step for step in self._closure(steps)
+                       if step in ['read_pol', 'read_bf'] and not chans_of_step[step]]
+            if missing:
+                self.skipped[output] = _missing_input[missing[0]]
+            else:
+                self.outputs[output] = steps
+        self.unknown = [chan for chan in self.output_chans if chan not in outputs]
+
+        needed = self._closure([step for steps in self.outputs.values() for step in steps])
+        self.steps = [step for step in self.dependencies if step in needed]
+        self.chans_of_step = chans_of_step
+        self.read_chans = [chan for chan in self.input_chans
+                           if any(chan in chans_of_step[step] for step in self.steps if step in chans_of_step)]
+        self.phase_deconv = [deconv for deconv, step in _phase_steps.items() if step in needed]
+
+    def _closure(self, steps):
+        """steps and all the steps they depend on"""
+        needed = set()
+        stack = list(steps)
+        while stack:
+            step = stack.pop()
+            if step not in needed:
+                needed.add(step)
+                stack.extend(self.dependencies[step])
+        return needed
+
+    def needs(self, *steps):
+        """True if one of the steps is in the plan"""
+        return any(step in self.steps for step in steps)
+
+    def renders(self, *outputs):
+        """True if one of the output channels is produced"""
+        return any(output in self.outputs for output in outputs)
+
+    def describe(self):
+        """text description of the plan"""
+        lines = ['Read channels: ' + (', '.join(self.read_chans) or 'none'), 'Steps:']
+        for step in self.steps:
+            if step in self.chans_of_step:
+                details = ' ({})'.format(', '.join(self.chans_of_step[step]) or 'not acquired, blank images')
+            elif self.dependencies[step]:
+                details = ' (after {})'.format(', '.join(self.dependencies[step]))
+            else:
+                details = ''
+            lines.append('  {}: {}{}'.format(step, _step_descriptions[step], details))
+        lines.append('Outputs:')
+        for output, steps in self.outputs.items():
+            lines.append('  {} <- {}'.format(output, ', '.join(steps)))
+        for output, reason in self.skipped.items():
+            lines.append('  {} skipped: {}'.format(output, reason))
+        for output in self.unknown:
+            lines.append('  {} skipped: unknown output channel'.format(output))
+        return '\n'.join(lines)
+
+
+def plan_reconstruction(img_io, config):
+    """ReconstructionPlan of the output channels of img_io with the options of config"""
+    return ReconstructionPlan(img_io.output_chans, img_io.input_chans,
+                              flatfield=config.processing.flatfield_correction,
+                              birefringence_fig=config.plotting.save_birefringence_fig,
+                              stokes_fig=config.plotting.save_stokes_fig,
+                              pol_fig=config.plotting.save_polarization_fig)
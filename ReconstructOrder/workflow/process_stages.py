@@ -0,0 +1,528 @@
+"""
+Stages of the reconstruction of one position and time point, chained by utils.pipeline.run_pipeline:
+
+read -> flat_field -> intensity -> stokes -> normalize -> birefringence -> phase -> render -> export
+
+z-slices flow through the stages up to normalize, which groups them into blocks of
+n_slice_local_bg slices for the background correction. The rendered images flow to export.
+With stream_local_bg, the slices of each block are read twice: the first pass accumulates
+the z-average of the block for the local background estimate, the second pass corrects and
+reconstructs the slices one at a time, in blocks of one slice.
+The stokes stage copies the polarization channels of the slices of a block into one buffer
+and computes the Stokes parameters of the block on its last slice. With the fused
+birefringence engine, the birefringence stage goes from that buffer to the birefringence.
+Stages that are not in the ReconstructionPlan of the requested output channels are left out
+of the pipeline.
+"""
+import time
+from collections import namedtuple
+import numpy as np
+import matplotlib.pyplot as plt
+
+from ..utils.imgIO import export_img
+from ..utils.imgProcessing import im_bit_convert
+from ..utils.plotting import render_birefringence_imgs, plot_stokes, plot_pol_imgs
+from ..datastructures import StokesData, PhysicalData, IntensityDataCreator
+from .planner import pol_names, stokes_names, stokes_names_sm, birefring_names, fluor_composite_names, \
+    ret_Zavg_names, phase_names, fluor_names
+
+
+
+class ZSlice(object):
+    """data of one z-slice passed between the stages"""
+
+    def __init__(self, z_idx, z_block, z_sub_idx, first_pass=False):
+        self.z_idx = z_idx
+        self.z_block = z_block
+        self.z_sub_idx = z_sub_idx
+        self.first_pass = first_pass  # only accumulated in the z-average for the local background
+        self.int_data = None  # IntensityData, until the block is formed
+        self.stokes = None  # StokesData of the block, on its last slice
+        self.int_raw = None  # (n_chann, Y, X, Z) intensities of the block on its last slice, for the fused engine
+        self.bf = None  # brightfield image, for phase without polarization data
+        self.fluor = None  # (5, Y, X) 16-bit fluorescence images, for the composite channels
+
+    @property
+    def is_last(self):
+        return self.z_sub_idx == len(self.z_block) - 1
+
+
+class ZBlock(object):
+    """z-slices reconstructed together, with the arrays stacked along the last axis"""
+
+    def __init__(self, z_block, slices, completes_block=True):
+        self.z_block = z_block
+        self.slices = slices
+        self.completes_block = completes_block  # False for the slices of a streamed block but the last
+        self.norm_sample = None  # normalized and background corrected StokesData
+        self.norm_sample_Zavg = None  # z-average of norm_sample, accumulated over a streamed block
+        self.int_raw = None  # (n_chann, Y, X, Z) polarization intensities, for the fused birefringence engine
+        self.physical_data = None
+        self.physical_data_Zavg = None
+        self.phase_data = None  # PhysicalData with the phase reconstructions
+
+
+SliceImages = namedtuple('SliceImages', ['z_idx', 'img_dict', 'imgs_pol'])  # images from the intensities of a slice
+Export = namedtuple('Export', ['z_idx', 'img_dict'])  # images to write at z_idx
+BlockDone = namedtuple('BlockDone', ['z_block'])  # all the images of the block have been passed to export
+
+
+class _ZMean(object):
+    """running average along z of attributes of the StokesData of single slices"""
+
+    def __init__(self, names):
+        self.names = names
+        self.sums = None
+        self.n = 0
+
+    def add(self, stokes):
+        imgs = [getattr(stokes, name)[..., 0] for name in self.names]
+        if self.sums is None:
+            self.sums = [img.copy() for img in imgs]
+        else:
+            for img_sum, img in zip(self.sums, imgs):
+                img_sum += img
+        self.n += 1
+
+    def mean(self):
+        stokes = StokesData()
+        for name, img_sum in zip(self.names, self.sums):
+            setattr(stokes, name, img_sum / self.n)
+        return stokes
+
+
+class SampleStages(object):
+    """Stages of the reconstruction of the position and time point img_io points to
+
+    Parameters
+    ----------
+    img_io: mManagerReader
+        reader pointed to the position and time point
+    config: ConfigReader
+        config of the reconstruction
+    plan: ReconstructionPlan
+        computations needed for the output channels
+    img_reconstructor: ImgReconstructor
+    img_int_creator: IntensityDataCreator
+    ff_corrector: FlatFieldCorrector
+    int_bg: IntensityData
+        background intensities
+    stokes_bg: StokesData
+        normalized background Stokes parameters
+    ph_recon: phase_reconstructor
+    manifest: CompletionManifest
+        z-blocks are recorded once their images are written
+    workspace: ReconstructionWorkspace
+        arrays reused by the reconstruction of the blocks. Only for a sequential pipeline, where
+        each block is exported before the next one is reconstructed
+
+    """
+
+    def __init__(self, img_io, config, plan, img_reconstructor, img_int_creator, ff_corrector,
+                 int_bg, stokes_bg, ph_recon, manifest=None, workspace=None):
+        self.img_io = img_io
+        self.config = config
+        self.img_reconstructor = img_reconstructor
+        self.img_int_creator = img_int_creator
+        self.ff_corrector = ff_corrector
+        self.int_bg = int_bg
+        self.stokes_bg = stokes_bg
+        self.ph_recon = ph_recon
+        self.manifest = manifest
+        self.workspace = workspace
+        # the images written by the threads of an async writer must not be views of the workspace
+        self.copy_exports = workspace is not None and getattr(img_io, 'async_writer', None) is not None
+        self.t_idx = img_io.t_idx
+        self.pos_idx = img_io.pos_idx
+        self.pos_name = img_io.pos_list[img_io.pos_idx]
+        self.z_list = img_io.z_list
+        self.start_time = time.time()
+
+        self.plan = plan
+        self.render_stokes    = plan.renders(*(stokes_names + stokes_names_sm + ['Stokes figure']))
+        self.render_birefring = plan.renders(*(birefring_names + ['birefringence figure']))
+        self.save_BF          = plan.needs('brightfield')
+        self.save_pol         = plan.needs('pol_ratio')
+        self.save_pol_fig     = plan.renders('polarization figure')
+        self.save_fluor       = plan.renders(*fluor_names)
+        self.fluor_composite  = plan.renders(*fluor_composite_names)
+        self.phase_from_bf    = bool(plan.phase_deconv) and not plan.have_pol_data
+        # the phase reconstructions need the whole block
+        self.stream_local_bg  = config.processing.stream_local_bg and plan.needs('stokes_normalized') and \
+            img_io.bg_method in ['Local_filter', 'Local_fit'] and not plan.phase_deconv
+        if self.stream_local_bg:
+            # the first pass only needs the polarization channels
+            self.pol_int_creator = IntensityDataCreator(input_chans=plan.chans_of_step['read_pol'],
+                                                        ROI=img_int_creator.roi,
+                                                        binning=img_int_creator.binning,
+                                                        dtype=img_int_creator.dtype)
+        # the fused engine gives the birefringence without the normalized Stokes parameters
+        self.fused_birefringence = config.processing.birefringence_engine == 'fused' and \
+            plan.needs('birefringence') and not plan.needs('birefringence_Zavg') and not self.render_stokes and \
+            (self.phase_from_bf or not plan.phase_deconv) and not img_reconstructor.use_gpu and \
+            not (img_io.bg_correct and img_reconstructor.bg_method in ['Local_filter', 'Local_fit'])
+
+    def _elapsed(self):
+        return (time.time() - self.start_time) / 60
+
+    def _normalized_out(self, stokes):
+        """workspace arrays for the normalized Stokes parameters, None without workspace"""
+        return None if self.workspace is None else self.workspace.normalized_stokes(stokes.s0.shape)
+
+    def _in_place(self, norm_sample):
+        """out argument correcting the background of the workspace arrays in place"""
+        return None if self.workspace is None else norm_sample
+
+    def _physical_out(self, shape):
+        """workspace arrays for the physical properties, None without workspace"""
+        return None if self.workspace is None else self.workspace.physical_data(shape)
+
+    def stages(self):
+        """stage functions producing the requested output channels, in pipeline order"""
+        stages = [self.read]
+        if self.plan.needs('flat_field'):
+            stages.append(self.flat_field)
+        if self.plan.needs('brightfield', 'pol_ratio', 'fluorescence') or self.phase_from_bf:
+            stages.append(self.intensity)
+        if self.plan.needs('stokes'):
+            stages.append(self.stokes)
+        stages.append(self.normalize)
+        if self.plan.needs('birefringence', 'birefringence_Zavg'):
+            stages.append(self.birefringence)
+        if self.plan.phase_deconv:
+            stages.append(self.phase)
+        stages += [self.render, self.export]
+        return stages
+
+    def read(self, z_blocks):
+        """read the intensities of the z-slices of each block, twice with stream_local_bg.
+        The only stage moving img_io.z_idx
+
+        A block is read in one pass into a (C, Z, Y, X) buffer by read_img_stack. Streamed blocks,
+        whose slices are not held in memory together, and readers with prefetch threads, which read
+        the next slices while the current ones are reconstructed, are read one slice at a time
+        """
+        for z_block in z_blocks:
+            for first_pass in ([True, False] if self.stream_local_bg else [False]):
+                img_int_creator = self.pol_int_creator if first_pass else self.img_int_creator
+                int_data_list = None
+                if not self.stream_local_bg and getattr(self.img_io, 'prefetcher', None) is None:
+                    try:
+                        int_data_list = img_int_creator.get_data_objects(self.img_io, z_block)
+                    except FileNotFoundError:
+                        pass  # read slice by slice, which skips the missing images with a warning
+                for z_sub_idx, z_idx in enumerate(z_block):
+                    self.img_io.z_idx = z_idx
+                    z_slice = ZSlice(z_idx, z_block, z_sub_idx, first_pass)
+                    if int_data_list is None:
+                        z_slice.int_data = img_int_creator.get_data_object(self.img_io)
+                    else:
+                        z_slice.int_data = int_data_list[z_sub_idx]
+                        int_data_list[z_sub_idx] = None
+                    yield z_slice
+
+    def flat_field(self, items):
+        for item in items:
+            if isinstance(item, ZSlice) and not item.first_pass:
+                item.int_data = self.ff_corrector.correct_flat_field(item.int_data)
+            yield item
+
+    def intensity(self, items):
+        """images computed from the intensities: brightfield, polarization states and fluorescence"""
+        for item in items:
+            if not isinstance(item, ZSlice) or item.first_pass:
+                yield item
+                continue
+            img_int_sm = item.int_data
+            img_dict = {}
+            img_bf = img_int_sm.get_image('BF')
+            if self.phase_from_bf:
+                item.bf = img_bf
+            if self.save_BF and isinstance(img_bf, np.ndarray):
+                img_bf = img_bf / self.stokes_bg.s0  # flat-field correction
+                img_bf = im_bit_convert(img_bf * self.config.plotting.transmission_scaling, bit=16, norm=False)
+                img_dict.update({'Brightfield': img_bf})
+
+            imgs_pol = None
+            if self.save_pol:
+                imgs_pol = []
+                for chan_name in self.int_bg.channel_names[:len(pol_names)]:  # the polarization channels
+                    imgs_pol += [img_int_sm.get_image(chan_name) / self.int_bg.get_image(chan_name)]
+                img_dict.update(dict(zip(pol_names, [im_bit_convert(img * 10 ** 4, bit=16) for img in imgs_pol])))
+
+            if self.plan.needs('fluorescence'):
+                img_fluor_list = [im_bit_convert(img_int_sm.get_image(chan)) for chan in fluor_names]
+                if self.fluor_composite:
+                    item.fluor = np.stack(img_fluor_list)
+                if self.save_fluor:
+                    img_dict.update(dict(zip(fluor_names, img_fluor_list)))
+
+            yield SliceImages(item.z_idx, img_dict, imgs_pol if self.save_pol_fig else None)
+            yield item
+
+    def stokes(self, items):
+        """copy the polarization channels of the slices of each block into one (n_chann, Y, X, Z) buffer,
+        and compute the Stokes parameters of the block with a single matrix multiply once it is filled"""
+        img_raw = None
+        n_chann, height, width = self.img_reconstructor.img_shape
+        for item in items:
+            if isinstance(item, ZSlice):
+                # streamed slices are corrected one at a time, as blocks of one slice
+                n_slices, z_pos = (1, 0) if self.stream_local_bg else (len(item.z_block), item.z_sub_idx)
+                if z_pos == 0:
+                    shape, dtype = (n_chann, height, width, n_slices), item.int_data.get_image('IExt').dtype
+                    if self.workspace is not None:
+                        img_raw = self.workspace.array('img_raw', shape, dtype)
+                    else:
+                        img_raw = np.empty(shape, dtype=dtype)
+                self.img_reconstructor.raw_intensities(item.int_data, out=img_raw[..., z_pos])
+                item.int_data = None
+                if z_pos == n_slices - 1:
+                    if self.fused_birefringence:
+                        item.int_raw = img_raw
+                    else:
+                        stokes = None if self.workspace is None else self.workspace.stokes(img_raw.shape[1:])
+                        item.stokes = self.img_reconstructor.compute_stokes_batch(img_raw, out=stokes)
+                    img_raw = None
+            yield item
+
+    def normalize(self, items):
+        """group the slices into blocks, normalize their Stokes parameters and correct the background"""
+        if self.stream_local_bg:
+            return self._normalize_streamed(items)
+        return self._normalize_blocks(items)
+
+    def _normalize_blocks(self, items):
+        slices = []
+        for item in items:
+            if not isinstance(item, ZSlice):
+                yield item
+                continue
+            item.int_data = None
+            slices.append(item)
+            if not item.is_last:
+                continue
+            block = ZBlock(item.z_block, slices)
+            slices = []
+            if item.int_raw is not None:
+                block.int_raw, item.int_raw = item.int_raw, None
+            elif item.stokes is not None:
+                stk_dat, item.stokes = item.stokes, None
+                norm_sample = self.img_reconstructor.stokes_normalization(stk_dat, out=self._normalized_out(stk_dat))
+                if self.img_io.bg_correct:
+                    norm_sample = self.img_reconstructor.correct_background(norm_sample, self.stokes_bg,
+                                                                            out=self._in_place(norm_sample))
+                block.norm_sample = norm_sample
+            yield block
+
+    def _normalize_streamed(self, items):
+        """normalize and correct the slices one at a time. The z-average of the globally corrected
+        slices of the first pass gives the local background of the second pass"""
+        local_bg_mean = _ZMean(['s0', 'polarization', 's1_norm', 's2_norm', 's3'])
+        Zavg_mean = _ZMean(['s0', 's1_norm', 's2_norm', 's3', 'polarization'])
+        local_bg = None
+        for item in items:
+            if not isinstance(item, ZSlice):
+                yield item
+                continue
+            item.int_data = None
+            stk_dat, item.stokes = item.stokes, None
+            norm_sample = self.img_reconstructor.stokes_normalization(stk_dat, out=self._normalized_out(stk_dat))
+            if item.first_pass:
+                local_bg_mean.add(self.img_reconstructor.correct_background_stokes(norm_sample, self.stokes_bg,
+                                                                                   out=self._in_place(norm_sample)))
+                if item.is_last:
+                    local_bg = self.img_reconstructor.compute_local_background(local_bg_mean.mean())
+                    local_bg_mean = _ZMean(local_bg_mean.names)
+                continue
+
+            block = ZBlock(item.z_block, [item], completes_block=item.is_last)
+            block.norm_sample = self.img_reconstructor.correct_background(norm_sample, self.stokes_bg,
+                                                                          local_background=local_bg,
+                                                                          out=self._in_place(norm_sample))
+            if self.plan.needs('birefringence_Zavg'):
+                Zavg_mean.add(block.norm_sample)
+                if item.is_last:
+                    block.norm_sample_Zavg = Zavg_mean.mean()
+                    Zavg_mean = _ZMean(Zavg_mean.names)
+            yield block
+
+    def birefringence(self, items):
+        for item in items:
+            if isinstance(item, ZBlock) and item.int_raw is not None:
+                print('Reconstructing retardance and orientation (t=%3.2f min)' % self._elapsed())
+                stokes_bg = self.stokes_bg if self.img_io.bg_correct else None
+                item.physical_data = self.img_reconstructor.reconstruct_birefringence_fused(
+                    item.int_raw, stokes_bg, out=self._physical_out(item.int_raw.shape[1:]))
+                item.int_raw = None
+                print('Finished reconstructing retardance and orientation (t=%3.2f min)' % self._elapsed())
+            elif isinstance(item, ZBlock) and item.norm_sample is not None:
+                norm_sample = item.norm_sample
+                if self.plan.needs('birefringence_Zavg') and item.completes_block:
+                    norm_sample_Zavg = item.norm_sample_Zavg
+                    if norm_sample_Zavg is None:
+                        stk_attribute_name = ['s0', 's1_norm', 's2_norm', 's3', 'polarization']
+                        norm_sample_Zavg = StokesData()
+                        [norm_sample_Zavg.s0,
+                         norm_sample_Zavg.s1_norm,
+                         norm_sample_Zavg.s2_norm,
+                         norm_sample_Zavg.s3,
+                         norm_sample_Zavg.polarization] = [np.mean(stack, axis=2) for stack in
+                                                          [norm_sample.__getattribute__(stack_name)
+                                                           for stack_name in stk_attribute_name]]
+                    item.physical_data_Zavg = self.img_reconstructor.reconstruct_birefringence(norm_sample_Zavg)
+
+                if self.plan.needs('birefringence'):
+                    print('Reconstructing retardance and orientation (t=%3.2f min)' % self._elapsed())
+                    item.physical_data = self.img_reconstructor.reconstruct_birefringence(
+                        norm_sample, out=self._physical_out(norm_sample.s0.shape))
+                    print('Finished reconstructing retardance and orientation (t=%3.2f min)' % self._elapsed())
+            yield item
+
+    def phase(self, items):
+        for item in items:
+            if not isinstance(item, ZBlock):
+                yield item
+                continue
+            if self.phase_from_bf:
+                norm_sample = StokesData()
+                norm_sample.s0 = np.stack([z_slice.bf for z_slice in item.slices],
+                                          axis=-1).astype(np.float32, copy=False)
+            else:
+                norm_sample = item.norm_sample
+            physical_data = item.phase_data = PhysicalData()
+            for deconv_dim in self.ph_recon.phase_deconv:
+                if deconv_dim == '2D':
+                    print('Reconstructing 2D phase (t=%3.2f min)' % self._elapsed())
+                    physical_data.absorption_2D, physical_data.phase_2D = self.ph_recon.Phase_recon_2D(norm_sample)
+                    print('Finished reconstructing 2D phase (t=%3.2f min)' % self._elapsed())
+                if deconv_dim == 'semi-3D':
+                    print('Reconstructing semi-3D phase (t=%3.2f min)' % self._elapsed())
+                    physical_data.absorption_semi3D, physical_data.phase_semi3D = \
+                        self.ph_recon.Phase_recon_semi_3D(norm_sample)
+                    print('Finished reconstructing semi-3D phase (t=%3.2f min)' % self._elapsed())
+                if deconv_dim == '3D':
+                    print('Reconstructing 3D phase (t=%3.2f min)' % self._elapsed())
+                    physical_data.phase_3D = self.ph_recon.Phase_recon_3D(norm_sample)
+                    print('Finished reconstructing 3D phase (t=%3.2f min)' % self._elapsed())
+            yield item
+
+    def render(self, items):
+        """scale the reconstructions to 16-bit images and plot the figures. The only stage using matplotlib"""
+        for item in items:
+            if isinstance(item, SliceImages):
+                if item.imgs_pol is not None:
+                    plt.close("all")  # close all the figures from the last run
+                    plot_pol_imgs(self.img_io, item.imgs_pol, pol_names, z_idx=item.z_idx)
+                yield Export(item.z_idx, item.img_dict)
+            elif isinstance(item, ZBlock):
+                if item.physical_data is not None or (item.norm_sample is not None and self.render_stokes):
+                    yield from self._render_birefringence(item)
+                if item.physical_data_Zavg is not None:
+                    yield self._render_Zavg(item)
+                if item.phase_data is not None:
+                    yield from self._render_phase(item)
+                if item.completes_block:
+                    yield BlockDone(item.z_block)
+            else:
+                yield item
+
+    def _render_birefringence(self, block):
+        config = self.config
+        norm_sample, physical_data = block.norm_sample, block.physical_data
+        for z_sub_idx, z_slice in enumerate(block.slices):
+            plt.close("all")  # close all the figures from the last run
+
+            img_dict = {}
+            if self.render_birefring:
+                imgs = [physical_data.I_trans[..., z_sub_idx],
+                        physical_data.retard[..., z_sub_idx],
+                        physical_data.azimuth[..., z_sub_idx],
+                        physical_data.polarization[..., z_sub_idx],
+                        z_slice.fluor]
+                _, img_dict = render_birefringence_imgs(self.img_io, imgs, config, spacing=20, vectorScl=8,
+                                                        zoomin=False, dpi=200,
+                                                        norm=config.plotting.normalize_color_images,
+                                                        plot=config.plotting.save_birefringence_fig,
+                                                        z_idx=z_slice.z_idx)
+
+            if self.render_stokes:
+                # extract the relevant z slice out of the data
+                s0 = norm_sample.s0[..., z_sub_idx]
+                s3 = norm_sample.s3[..., z_sub_idx]
+                s1 = norm_sample.s1_norm[..., z_sub_idx] * s3
+                s2 = norm_sample.s2_norm[..., z_sub_idx] * s3
+                img_stokes = [s0, s1, s2, s3]
+                img_stokes_sm = [stack[..., z_sub_idx] for stack in norm_sample.data]
+
+                if config.plotting.save_stokes_fig:
+                    plot_stokes(self.img_io, img_stokes, img_stokes_sm, z_idx=z_slice.z_idx)
+                img_stokes         = [x.astype(np.float32, copy=self.copy_exports) for x in img_stokes]
+                img_stokes_sm      = [x.astype(np.float32, copy=self.copy_exports) for x in img_stokes_sm]
+                img_dict.update(dict(zip(stokes_names, img_stokes)))
+                img_dict.update(dict(zip(stokes_names_sm, img_stokes_sm)))
+            yield Export(z_slice.z_idx, img_dict)
+
+        print('Finish exporting birefringent reconstruction (t=%3.2f min)' % self._elapsed())
+
+    def _render_Zavg(self, block):
+        plt.close("all")  # close all the figures from the last run
+        img_dict = {}
+        retard   = block.physical_data_Zavg.retard
+        azimuth  = block.physical_data_Zavg.azimuth
+        for channel in list(set(ret_Zavg_names) & set(self.img_io.output_chans)):
+            if channel == 'RetardanceZavg':
+                img = im_bit_convert(retard * self.config.plotting.retardance_scaling, bit=16)
+                img_dict[channel] = img.copy()
+            elif channel == 'OrientationZavg':
+                azimuth_degree = azimuth/np.pi*180
+                img = im_bit_convert(azimuth_degree * 100, bit=16)
+                img_dict[channel] = img.copy()
+        return Export(self.z_list[0], img_dict)
+
+    def _render_phase(self, block):
+        config = self.config
+        physical_data = block.phase_data
+        for z_slice in block.slices:
+            plt.close("all")  # close all the figures from the last run
+            z_sub_idx = z_slice.z_sub_idx
+            img_dict = {}
+            for channel in list(set(phase_names) & set(self.img_io.output_chans)):
+                if self.ph_recon.focus_idx == z_sub_idx and channel == 'Phase2D':
+                    img = im_bit_convert(physical_data.phase_2D * config.plotting.phase_2D_scaling,
+                                         bit=16, norm=True, limit=[-5, 5])
+                    img_dict[channel] = img.copy()
+                elif self.ph_recon.focus_idx == z_sub_idx and channel == 'Absorption2D':
+                    img = im_bit_convert(physical_data.absorption_2D * config.plotting.absorption_2D_scaling,
+                                         bit=16, norm=True, limit=[-1, 1])
+                    img_dict[channel] = img.copy()
+                elif channel == 'Phase_semi3D':
+                    img = im_bit_convert(physical_data.phase_semi3D[..., z_sub_idx] * config.plotting.phase_2D_scaling,
+                                         bit=16, norm=True, limit=[-5, 5])
+                    img_dict[channel] = img.copy()
+                elif channel == 'Absorption_semi3D':
+                    img = im_bit_convert(physical_data.absorption_semi3D[..., z_sub_idx] *
+                                         config.plotting.absorption_2D_scaling, bit=16, norm=True, limit=[-1, 1])
+                    img_dict[channel] = img.copy()
+                elif channel == 'Phase3D':
+                    img = im_bit_convert(physical_data.phase_3D[..., z_sub_idx] * config.plotting.phase_3D_scaling,
+                                         bit=16, norm=True, limit=[-5, 5])
+                    img_dict[channel] = img.copy()
+            yield Export(z_slice.z_idx, img_dict)
+
+    def export(self, items):
+        """write the images, and record the z-blocks in the manifest once their images are written"""
+        separate_pos = self.config.processing.separate_positions
+        block_start = self.start_time
+        for item in items:
+            if isinstance(item, Export):
+                export_img(self.img_io, item.img_dict, separate_pos, z_idx=item.z_idx)
+            elif isinstance(item, BlockDone):
+                print('Finish processing and exporting all reconstructions (t=%3.2f min)' % self._elapsed())
+                if self.manifest is not None:
+                    self.img_io.flush_writes()  # the images of the z-block are written before it is recorded
+                    # the time since the previous block, which overlaps this one in a threaded pipeline
+                    self.manifest.record(self.pos_name, self.pos_idx, self.t_idx, item.z_block,
+                                         seconds=time.time() - block_start)
+                    block_start = time.time()
+            yield item
@@ -1,8 +1,21 @@
-from ..workflow.multiDimProcess import process_background, process_sample_imgs, read_metadata, parse_bg_options, phase_reconstructor_initializer
+from ..workflow.multiDimProcess import process_sample_imgs, read_metadata, parse_bg_options
 from ..utils.ConfigReader import ConfigReader
 from ..utils.flat_field import FlatFieldCorrector
+from ..utils.zarrIO import ZarrWriter
+from ..utils.process_pool import loop_pt_processes
+from ..utils.work_queue import WorkQueue
+from ..utils.aux_utils import set_pt, pt_list, z_blocks
+from ..utils.manifest import CompletionManifest, config_hash
+from ..utils.scheduler import order_by_cost
+from .planner import plan_reconstruction, ret_Zavg_names
+from .reconstruction_cache import ReconstructionCache
 from ..datastructures import IntensityDataCreator
+from ..compute.reconstruct import ReconstructionWorkspace
 import os
+import socket
+import threading
+import time
+import traceback
 
 
 def process_position_list(img_obj_list, config):
@@ -95,8 +108,51 @@ def process_timepoint_list(img_obj_list, config):
     return img_obj_list
 
 
-def _process_one_acqu(img_obj, bg_obj, config):
+def _open_manifest(img_obj, bg_obj, config):
+    """completion manifest of an acquisition in its processed folder"""
+    return CompletionManifest(os.path.join(img_obj.img_output_path, 'manifest.jsonl'),
+                              config_hash(config, img_obj.img_sm_path, bg_obj.img_sm_path),
+                              resume=config.processing.resume)
+
+
+def _pending_pt(img_obj, manifest, config):
+    """(position index, time index) of the acquisition with z-slices that are not in the manifest"""
+    blocks = z_blocks(img_obj.z_list, config.processing.n_slice_local_bg)
+    return [(pos_idx, t_idx) for pos_idx, t_idx in pt_list(img_obj)
+            if not all(manifest.is_done(img_obj.pos_list[pos_idx], pos_idx, t_idx, z_block) for z_block in blocks)]
+
+
+def _schedule_units(img_obj, manifest, config, plan):
+    """(pos_idx, t_idx, z_blocks) units of the acquisition left to reconstruct, for the process pool
+
+    The z-blocks of a position and time point are separate units, so that the blocks of
+    expensive positions are spread over the workers. They are kept together when the
+    z-averaged outputs or zarr chunks span several blocks. The units are ordered by
+    decreasing cost: the time they took in a previous run recorded in the manifest, or the
+    number of z-blocks of the unit
     """
+    blocks = z_blocks(img_obj.z_list, config.processing.n_slice_local_bg)
+    split = not plan.renders(*ret_Zavg_names) and \
+        (config.processing.output_format != 'zarr' or config.processing.zarr_chunks[2] == 1)
+    units, costs = [], []
+    for pos_idx, t_idx in pt_list(img_obj):
+        pos_name = img_obj.pos_list[pos_idx]
+        pending = [z_block for z_block in blocks if not manifest.is_done(pos_name, pos_idx, t_idx, z_block)]
+        if not pending:
+            continue
+        for unit_blocks in ([[z_block] for z_block in pending] if split else [pending]):
+            units.append((pos_idx, t_idx, unit_blocks))
+            seconds = [manifest.seconds(pos_name, pos_idx, t_idx, z_block) for z_block in unit_blocks]
+            costs.append(sum(seconds) if None not in seconds else None)
+    if all(cost is None for cost in costs):
+        costs = [len(unit_blocks) for _, _, unit_blocks in units]
+    return order_by_cost(units, costs)
+
+
+def _prepare_acqu(img_obj, bg_obj, config, manifest=None, cache=None):
+    """Compute the state shared by all the positions and time points of an acquisition:
+    background, flat-field and phase transfer functions. Writes the metadata and the
+    config file in the processed folder
 
     Parameters
     ----------
@@ -105,15 +161,22 @@ def _process_one_acqu(img_obj, bg_obj, config):
     bg_obj : mManagerReader instance for background images
     config : obj
         ConfigReader instance
+    manifest : CompletionManifest
+        completion manifest of the acquisition
+    cache : ReconstructionCache
+        background and phase transfer functions of the previous samples of the batch.
+        They are computed for this acquisition only if None
 
     Returns
     -------
+    sample_kwargs : dict
+        keyword arguments of process_sample_imgs
 
     """
     ph_recon = None
+    if cache is None:
+        cache = ReconstructionCache()
     print('Processing ' + img_obj.name + ' ....')
-    img_int_creator_bg = IntensityDataCreator(ROI=config.dataset.ROI,
-                                           binning=config.processing.binning)
 
     # Write metadata in processed folder
     img_obj.writeMetaData()
@@ -121,47 +184,285 @@ def _process_one_acqu(img_obj, bg_obj, config):
     # Write config file in processed folder
     config.write_config(os.path.join(img_obj.img_output_path, 'config.yml'))  # save the config file in the processed folder
 
-    # img_obj, img_reconstructor = process_background(img_obj, bg_obj, config)
-    stokes_bg_norm, int_bg, img_reconstructor = process_background(img_obj, bg_obj, config, img_int_creator_bg)
+    if config.processing.output_format == 'zarr':
+        img_obj.img_writer = ZarrWriter(os.path.join(img_obj.img_output_path, img_obj.name + '.zarr'),
+                                        img_obj, chunks=config.processing.zarr_chunks)
+        img_obj.img_writer.write_metadata({'Summary': img_obj.input_meta_file['Summary']},
+                                          list(enumerate(img_obj.pos_list)))
+
+    # samples with the same background share its Stokes parameters and ImgReconstructor
+    stokes_bg_norm, int_bg, img_reconstructor = cache.background(img_obj, bg_obj, config)
 
+    plan = plan_reconstruction(img_obj, config)
     ff_corrector = FlatFieldCorrector(img_obj, config, method='open')
-    flatField = config.processing.flatfield_correction
-    if flatField:  # find background fluorescence for flatField correction
+    if plan.needs('flat_field'):  # find background fluorescence for flatField correction
         ff_corrector.compute_flat_field()
      # determine if we will initiate phase reconstruction
-    phase_names = ['Phase2D', 'Phase_semi3D', 'Phase3D']
-    save_phase = any(chan in phase_names for chan in img_obj.output_chans)
-    if save_phase:
-        ph_recon = phase_reconstructor_initializer(img_obj, config)
-
-    # old int_creator object has bg-channels assigned.  Need to create a new one
-    img_int_creator_sm = IntensityDataCreator(ROI=config.dataset.ROI,
-                                           binning=config.processing.binning)
-
-    process_sample_imgs(img_io=img_obj,
-                        config=config,
-                        img_reconstructor=img_reconstructor,
-                        img_int_creator=img_int_creator_sm,
-                        ff_corrector=ff_corrector,
-                        int_bg=int_bg,
-                        stokes_bg=stokes_bg_norm,
-                        ph_recon=ph_recon)
+    if plan.phase_deconv:
+        ph_recon = cache.phase_reconstructor(img_obj, config)
+        if config.processing.stream_local_bg:
+            print('stream_local_bg is not used with phase reconstruction, which needs the whole z-stack')
+
+    # old int_creator object has bg-channels assigned.  Need to create a new one.
+    # Only the channels used by the output channels are read
+    img_int_creator_sm = IntensityDataCreator(input_chans=plan.read_chans,
+                                           ROI=config.dataset.ROI,
+                                           binning=config.processing.binning,
+                                           dtype=config.processing.intensity_dtype)
+
+    # the positions and time points of the sample reuse the arrays of the reconstruction
+    workspace = ReconstructionWorkspace(img_reconstructor.dtype) if config.processing.reuse_buffers else None
+
+    return dict(img_io=img_obj,
+                config=config,
+                img_reconstructor=img_reconstructor,
+                img_int_creator=img_int_creator_sm,
+                ff_corrector=ff_corrector,
+                int_bg=int_bg,
+                stokes_bg=stokes_bg_norm,
+                ph_recon=ph_recon,
+                manifest=manifest,
+                plan=plan,
+                workspace=workspace)
+
+
+def _reader_threads(config):
+    """(n_workers, depth) of the prefetch threads and (n_workers, max_queued) of the writer threads,
+    None if they are disabled"""
+    prefetch = async_write = None
+    if config.processing.prefetch_workers:
+        prefetch = (config.processing.prefetch_workers, config.processing.prefetch_depth)
+    if config.processing.writer_workers:
+        async_write = (config.processing.writer_workers, config.processing.writer_queue_size)
+    return prefetch, async_write
+
+
+def _process_one_acqu(img_obj, bg_obj, config, cache=None):
+    """
+
+    Parameters
+    ----------
+    img_obj : mManagerReader
+        mManagerReader instance for sample images
+    bg_obj : mManagerReader instance for background images
+    config : obj
+        ConfigReader instance
+    cache : ReconstructionCache
+        background and phase transfer functions shared with the other samples of the batch
+
+    Returns
+    -------
+
+    """
+    manifest = _open_manifest(img_obj, bg_obj, config)
+    if not _pending_pt(img_obj, manifest, config):
+        # nothing left to reconstruct, the background and transfer functions aren't needed
+        print(img_obj.name + ' is already reconstructed, skipped')
+        return
+    sample_kwargs = _prepare_acqu(img_obj, bg_obj, config, manifest, cache)
+    prefetch, async_write = _reader_threads(config)
+
+    if config.processing.process_workers:
+        assert config.processing.output_format != 'zarr' or config.processing.zarr_chunks[0] == 1, \
+            "zarr_chunks must be 1 along T to write different time points from several processes"
+        units = _schedule_units(img_obj, manifest, config, sample_kwargs['plan'])
+        loop_pt_processes(process_sample_imgs, config.processing.process_workers,
+                          prefetch=prefetch, async_write=async_write, units=units, **sample_kwargs)
+    else:
+        if prefetch is not None:
+            img_obj.enable_prefetch(*prefetch)
+        if async_write is not None:
+            img_obj.enable_async_write(*async_write)
+        try:
+            process_sample_imgs(**sample_kwargs)
+            img_obj.flush_writes()
+        finally:
+            img_obj.disable_prefetch()
+            img_obj.disable_async_write()
 
     #TODO: Write log file and metadata at the end of reconstruction
 
 
-def reconstruct_batch(configfile):
-    config = ConfigReader()
-    config.read_config(configfile)
-    
+def read_acquisitions(config):
+    """Read the metadata of the samples and backgrounds in the config and apply the
+    position, z-slice, time point and background options
 
-    # read meta data
+    Parameters
+    ----------
+    config : obj
+        ConfigReader instance
+
+    Returns
+    -------
+    img_obj_list : list
+        mManagerReader instances of the samples
+    bg_obj_list : list
+        mManagerReader instances of the backgrounds of the samples
+    """
     img_obj_list, bg_obj_list = read_metadata(config)
     img_obj_list = process_position_list(img_obj_list, config)
     img_obj_list = process_z_slice_list(img_obj_list, config)
     img_obj_list = process_timepoint_list(img_obj_list, config)
     # process background options
     img_obj_list = parse_bg_options(img_obj_list, config)
+    return img_obj_list, bg_obj_list
+
+
+def reconstruct_batch(configfile):
+    config = ConfigReader()
+    config.read_config(configfile)
+    
+
+    # read meta data
+    img_obj_list, bg_obj_list = read_acquisitions(config)
+
+    cache = ReconstructionCache()
+    for img_obj, bg_obj in zip(img_obj_list, bg_obj_list):
+        _process_one_acqu(img_obj, bg_obj, config, cache)
+
+
+def dry_run(configfile):
+    """Print what a reconstruction with a config would do, without reconstructing: the units of
+    each sample, the channels that are read and the computations done for the requested output
+    channels. Only the metadata of the samples is read
 
+    Parameters
+    ----------
+    configfile : str
+        path of the config file
+
+    Returns
+    -------
+    plans : list
+        ReconstructionPlan of each sample
+    """
+    config = ConfigReader()
+    config.read_config(configfile)
+    img_obj_list, bg_obj_list = read_acquisitions(config)
+    plans = []
     for img_obj, bg_obj in zip(img_obj_list, bg_obj_list):
-        _process_one_acqu(img_obj, bg_obj, config)
+        plan = plan_reconstruction(img_obj, config)
+        plans.append(plan)
+        n_blocks = len(z_blocks(img_obj.z_list, config.processing.n_slice_local_bg))
+        print('Sample {} (background {}): {} positions, {} time points, {} z-slices in {} blocks'.format(
+            img_obj.name, bg_obj.name, len(img_obj.pos_list), len(img_obj.t_list), len(img_obj.z_list), n_blocks))
+        print('Output folder: ' + img_obj.img_output_path)
+        if config.processing.resume:
+            manifest_path = os.path.join(img_obj.img_output_path, 'manifest.jsonl')
+            manifest = CompletionManifest(manifest_path, config_hash(config, img_obj.img_sm_path, bg_obj.img_sm_path))
+            print('{} of {} positions and time points left to reconstruct'.format(
+                len(_pending_pt(img_obj, manifest, config)), len(pt_list(img_obj))))
+        print(plan.describe())
+    return plans
+
+
+def run_queue_worker(configfile, queue_path, lease_time=600, poll_interval=10):
+    """Reconstruct the (sample, position, time) tasks of a config claimed from a shared work queue
+
+    Any number of workers, on one or several machines sharing the file system, can be
+    started with the same config and queue. Each worker adds the tasks of the config to the
+    queue if they are not there yet, then processes the tasks it claims until none are
+    left. Tasks of crashed workers are processed again once their lease has expired.
+    The background, flat-field and phase transfer functions are computed by each worker
+    for the samples of the tasks it claims, the background and phase transfer functions
+    once for the samples that share them. process_workers is not used, one worker
+    processes one task at a time.
+
+    Parameters
+    ----------
+    configfile : str
+        path of the config file
+    queue_path : str
+        path of the SQLite file of the work queue
+    lease_time : float
+        seconds a claimed task is reserved for a worker. The lease is renewed while the
+        task is being processed
+    poll_interval : float
+        seconds to wait for tasks leased by other workers to complete or to expire
+
+    """
+    config = ConfigReader()
+    config.read_config(configfile)
+    img_obj_list, bg_obj_list = read_acquisitions(config)
+    prefetch, async_write = _reader_threads(config)
+    samples = config.dataset.samples
+
+    manifests = [_open_manifest(img_obj, bg_obj, config) for img_obj, bg_obj in zip(img_obj_list, bg_obj_list)]
+
+    queue = WorkQueue(queue_path, lease_time=lease_time)
+    queue.add_tasks([(idx, sample, pos_idx, t_idx)
+                     for idx, (sample, img_obj, manifest) in enumerate(zip(samples, img_obj_list, manifests))
+                     for pos_idx, t_idx in _pending_pt(img_obj, manifest, config)])
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    sample_idx, sample_kwargs = None, None
+    cache = ReconstructionCache()
+    process_pt = process_sample_imgs.__wrapped__  # one (p, t), without the loop of loop_pt
+    while True:
+        task = queue.claim(worker)
+        if task is None:
+            if not queue.counts()['running']:
+                break
+            time.sleep(poll_interval)  # wait for the tasks of other workers, they may crash
+            continue
+        try:
+            with _LeaseRenewal(queue, task, worker):
+                idx = task.sample_idx
+                if idx != sample_idx:
+                    # the state of the previous sample is dropped, tasks are claimed in sample order
+                    _stop_reader_threads(sample_kwargs)
+                    sample_idx, sample_kwargs = None, None
+                    sample_kwargs = _prepare_acqu(img_obj_list[idx], bg_obj_list[idx], config, manifests[idx], cache)
+                    sample_idx = idx
+                    if prefetch is not None:
+                        sample_kwargs['img_io'].enable_prefetch(*prefetch)
+                    if async_write is not None:
+                        sample_kwargs['img_io'].enable_async_write(*async_write)
+                img_io = sample_kwargs['img_io']
+                set_pt(img_io, task.pos_idx, task.t_idx)
+                process_pt(**sample_kwargs)
+                img_io.flush_writes()
+        except Exception as e:
+            traceback.print_exc()
+            queue.fail(task, worker, repr(e))
+        else:
+            queue.complete(task, worker)
+    _stop_reader_threads(sample_kwargs)
+
+    failed = queue.failed_tasks()
+    if failed:
+        raise RuntimeError('{} tasks failed: {}'.format(
+            len(failed), ', '.join('{} p{} t{} ({})'.format(task.sample, task.pos_idx, task.t_idx, error)
+                                   for task, error in failed)))
+
+
+def _stop_reader_threads(sample_kwargs):
+    if sample_kwargs is not None:
+        sample_kwargs['img_io'].disable_prefetch()
+        sample_kwargs['img_io'].disable_async_write()
+
+
+class _LeaseRenewal(object):
+    """renews the lease of a task in a background thread while the block runs"""
+
+    def __init__(self, queue, task, worker):
+        self.queue = queue
+        self.task = task
+        self.worker = worker
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+
+    def _renew(self):
+        while not self._stop.wait(self.queue.lease_time / 3):
+            if not self.queue.renew(self.task, self.worker):
+                print('Lease of {} p{} t{} was lost, another worker may process it'.
+                      format(self.task.sample, self.task.pos_idx, self.task.t_idx))
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
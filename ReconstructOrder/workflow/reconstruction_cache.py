@@ -0,0 +1,86 @@
+"""
+Share the background and the phase transfer functions between the samples of a batch
+"""
+import os
+from collections import OrderedDict
+
+from ..datastructures import IntensityDataCreator
+from .multiDimProcess import process_background, phase_reconstructor_initializer, reconstruction_precision
+from .planner import plan_reconstruction
+
+
+def _roi(img_io, config):
+    if config.dataset.ROI is None:
+        return 0, 0, img_io.height, img_io.width
+    return tuple(config.dataset.ROI)
+
+
+def background_key(img_io, img_io_bg, config):
+    """options and metadata that the background Stokes parameters and the ImgReconstructor
+    of a sample depend on"""
+    n_slice_local_bg = config.processing.n_slice_local_bg
+    if n_slice_local_bg == 'all':
+        n_slice_local_bg = len(img_io.z_list)
+    return (os.path.abspath(img_io_bg.img_sm_path), _roi(img_io_bg, config), config.processing.binning,
+            str(config.processing.intensity_dtype), img_io_bg.blackLevel, img_io.swing, img_io.wavelength,
+            img_io.bg_method, img_io.bg_correct, n_slice_local_bg, config.processing.local_fit_order,
+            config.processing.azimuth_offset, config.processing.circularity,
+            config.processing.use_gpu, config.processing.gpu_id, reconstruction_precision(img_io, config))
+
+
+def phase_key(img_io, config):
+    """geometry and optics parameters that the phase transfer functions of a sample depend on"""
+    processing = config.processing
+    return (_roi(img_io, config), img_io.n_z, img_io.size_z_um, img_io.wavelength,
+            processing.pixel_size, processing.magnification, processing.NA_objective, processing.NA_condenser,
+            processing.n_objective_media, processing.focus_zidx, processing.pad_z,
+            tuple(plan_reconstruction(img_io, config).phase_deconv), processing.use_gpu, processing.gpu_id)
+
+
+class ReconstructionCache(object):
+    """Background Stokes parameters, ImgReconstructor and phase reconstructor shared by the
+    samples of a batch
+
+    The samples of a batch often have the same background and the same geometry. Their
+    background and phase transfer functions are computed for the first sample and reused
+    for the next ones with the same background_key and phase_key. The cache is meant for
+    the samples of one config: the phase solver parameters are not part of the key.
+
+    Parameters
+    ----------
+    max_phase_recons : int
+        number of phase reconstructors kept. Their transfer functions can take several GB
+        for 3D stacks, the least recently used ones are dropped
+
+    """
+
+    def __init__(self, max_phase_recons=1):
+        self.max_phase_recons = max_phase_recons
+        self._backgrounds = {}
+        self._phase_recons = OrderedDict()
+
+    def background(self, img_io, img_io_bg, config):
+        """(normalized background Stokes parameters, background intensity, ImgReconstructor) of
+        a sample, see process_background. The returned objects are shared and must not be modified
+        """
+        key = background_key(img_io, img_io_bg, config)
+        if key in self._backgrounds:
+            print('Using the background {} computed for a previous sample'.format(img_io_bg.name))
+        else:
+            img_int_creator_bg = IntensityDataCreator(ROI=config.dataset.ROI,
+                                                      binning=config.processing.binning,
+                                                      dtype=config.processing.intensity_dtype)
+            self._backgrounds[key] = process_background(img_io, img_io_bg, config, img_int_creator_bg)
+        return self._backgrounds[key]
+
+    def phase_reconstructor(self, img_io, config):
+        """phase reconstructor of a sample, see phase_reconstructor_initializer"""
+        key = phase_key(img_io, config)
+        if key in self._phase_recons:
+            print('Using the phase transfer function computed for a previous sample')
+            self._phase_recons.move_to_end(key)
+        else:
+            while self._phase_recons and len(self._phase_recons) >= self.max_phase_recons:
+                self._phase_recons.popitem(last=False)
+            self._phase_recons[key] = phase_reconstructor_initializer(img_io, config)
+        return self._phase_recons[key]
@@ -0,0 +1,178 @@
+"""
+Reconstruct an acquisition while Micro-Manager is writing it
+"""
+import os
+import time
+
+from ..utils.ConfigReader import ConfigReader
+from ..utils.aux_utils import set_pt, pt_list, z_blocks
+from ..utils.mm_metadata import MetadataFile
+from .multiDimProcess import process_sample_imgs
+from .reconstructBatch import read_acquisitions, _open_manifest, _prepare_acqu, _reader_threads
+from .reconstruction_cache import ReconstructionCache
+
+
+class AcquisitionWatcher(object):
+    """Find the (position, time, z-block) units of an acquisition that are written and
+    not reconstructed yet
+
+    A unit is ready when the image files of all the input channels of its z-slices exist
+    and the metadata.txt of the position has their entries, which Micro-Manager writes
+    after the image. The image files are only checked for the units whose entries are
+    written, and the units of a position after the first one that is not ready are left
+    for the next poll, as the time points of a position are acquired in order.
+
+    Parameters
+    ----------
+    img_io : mManagerReader
+        reader of the acquisition, with one tiff file per image
+    manifest : CompletionManifest
+        record of the reconstructed units
+    n_slice_local_bg : int or str
+        number of z-slices reconstructed together, 'all' for the whole z_list
+
+    """
+
+    def __init__(self, img_io, manifest, n_slice_local_bg):
+        self.img_io = img_io
+        self.manifest = manifest
+        self.blocks = z_blocks(img_io.z_list, n_slice_local_bg)
+        self._meta_keys = {}  # metadata.txt path: ((mtime, size), names of the written entries)
+
+    def _written_frames(self, pos_idx):
+        """names of the entries of the metadata.txt of a position, cached until the file changes"""
+        meta_path = os.path.join(self.img_io.img_sm_path, self.img_io.pos_list[pos_idx], 'metadata.txt')
+        try:
+            stat = os.stat(meta_path)
+        except OSError:
+            return set()
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._meta_keys.get(meta_path)
+        if cached is None or cached[0] != version:
+            # mm 2.0 keys contain the image file name, e.g. 'Coords-Default/img_channel000_..._z000.tif'
+            keys = MetadataFile(meta_path).written_keys()
+            cached = self._meta_keys[meta_path] = (version, set(keys) | {os.path.basename(key) for key in keys})
+        return cached[1]
+
+    def _is_written(self, pos_idx, t_idx, z_idx, written_frames):
+        img_io = self.img_io
+        img_paths = [img_io.get_img_path(chan_idx, t_idx, pos_idx, z_idx)
+                     for chan_idx in range(len(img_io.input_chans))]
+        for chan_idx, img_path in enumerate(img_paths):
+            if img_io.mm_version == '1.4.22':
+                meta_chan_idx = img_io.channels.index(img_io.get_chan_name(chan_idx))
+                frame_key = 'FrameKey-{}-{}-{}'.format(t_idx, meta_chan_idx, z_idx)
+            else:
+                frame_key = os.path.basename(img_path)
+            if frame_key not in written_frames:
+                return False
+        # the file system is only queried for the frames in the metadata, it can be slow on network shares
+        return all(os.path.exists(img_path) for img_path in img_paths)
+
+    def pending_units(self):
+        """(pos_idx, t_idx, z_block) of the units that are not reconstructed"""
+        return [(pos_idx, t_idx, z_block) for pos_idx, t_idx in pt_list(self.img_io) for z_block in self.blocks
+                if not self.manifest.is_done(self.img_io.pos_list[pos_idx], pos_idx, t_idx, z_block)]
+
+    def ready_units(self):
+        """{(pos_idx, t_idx): z-slices} of the units that are written and not reconstructed"""
+        ready = {}
+        not_ready_pos = set()
+        for pos_idx, t_idx, z_block in self.pending_units():
+            if pos_idx in not_ready_pos:
+                continue
+            written_frames = self._written_frames(pos_idx)
+            if all(self._is_written(pos_idx, t_idx, z_idx, written_frames) for z_idx in z_block):
+                ready.setdefault((pos_idx, t_idx), []).extend(z_block)
+            else:
+                not_ready_pos.add(pos_idx)  # the later time points of the position aren't written either
+        return ready
+
+
+def watch_acquisition(configfile, poll_interval=10, idle_timeout=3600):
+    """Reconstruct the samples of a config while they are being acquired
+
+    The samples folders are polled every poll_interval seconds and the z-blocks whose images
+    are all written are reconstructed. The background, the reconstructor and the phase transfer
+    functions are computed once per sample, when its first images are found. Reconstructed
+    units are recorded in the completion manifest, so a watch that is restarted continues
+    where it stopped. Returns when all the positions, time points and z-slices in the
+    metadata summary are reconstructed, or when no new image was found for idle_timeout seconds.
+
+    Parameters
+    ----------
+    configfile : str
+        path of the config file. The background has to be acquired already.
+        Flat-field correction is not supported, it needs the complete acquisition
+    poll_interval : float
+        seconds between two checks for new images
+    idle_timeout : float
+        seconds without new images after which the watch stops
+
+    """
+    config = ConfigReader()
+    config.read_config(configfile)
+    assert not config.processing.flatfield_correction, \
+        'flatfield_correction needs the complete acquisition and is not supported in watch mode'
+    config.processing.resume = True  # units reconstructed before a restart of the watch are skipped
+
+    last_progress = time.time()
+    waiting_for = None
+    while True:
+        # the reader needs the summary metadata and the first image of each sample
+        try:
+            img_obj_list, bg_obj_list = read_acquisitions(config)
+            break
+        except (OSError, ValueError, KeyError) as e:
+            if time.time() - last_progress > idle_timeout:
+                raise
+            if str(e) != waiting_for:
+                waiting_for = str(e)
+                print('Waiting for the acquisition to start ({})'.format(e))
+            time.sleep(poll_interval)
+
+    prefetch, async_write = _reader_threads(config)
+    watchers = []
+    for img_obj, bg_obj in zip(img_obj_list, bg_obj_list):
+        manifest = _open_manifest(img_obj, bg_obj, config)
+        watchers.append(AcquisitionWatcher(img_obj, manifest, config.processing.n_slice_local_bg))
+    sample_kwargs_list = [None] * len(watchers)
+    cache = ReconstructionCache()
+    process_pt = process_sample_imgs.__wrapped__  # one (p, t), without the loop of loop_pt
+
+    try:
+        while any(watcher.pending_units() for watcher in watchers):
+            progress = False
+            for sample_idx, watcher in enumerate(watchers):
+                for (pos_idx, t_idx), z_list in watcher.ready_units().items():
+                    if sample_kwargs_list[sample_idx] is None:
+                        sample_kwargs = _prepare_acqu(img_obj_list[sample_idx], bg_obj_list[sample_idx],
+                                                      config, watcher.manifest, cache)
+                        if prefetch is not None:
+                            sample_kwargs['img_io'].enable_prefetch(*prefetch)
+                        if async_write is not None:
+                            sample_kwargs['img_io'].enable_async_write(*async_write)
+                        sample_kwargs_list[sample_idx] = sample_kwargs
+                    img_io = watcher.img_io
+                    full_z_list = img_io.z_list
+                    set_pt(img_io, pos_idx, t_idx)
+                    img_io.z_list = z_list  # only the z-blocks that are written
+                    try:
+                        process_pt(**sample_kwargs_list[sample_idx])
+                        img_io.flush_writes()
+                    finally:
+                        img_io.z_list = full_z_list
+                    progress = True
+            if progress:
+                last_progress = time.time()
+            elif time.time() - last_progress > idle_timeout:
+                print('No new images for {} s, stopping the watch'.format(idle_timeout))
+                break
+            else:
+                time.sleep(poll_interval)
+    finally:
+        for img_obj, sample_kwargs in zip(img_obj_list, sample_kwargs_list):
+            if sample_kwargs is not None:
+                img_obj.disable_prefetch()
+                img_obj.disable_async_write()
+                img_obj.writeMetaData()  # with the entries of the images acquired since the start
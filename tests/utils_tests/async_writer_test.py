@@ -0,0 +1,77 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from ReconstructOrder.utils.async_writer import AsyncWriter
+from ReconstructOrder.utils.imgIO import export_img
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+
+
+def test_async_writer_back_pressure():
+    """
+    submit blocks while max_queued jobs are pending
+    """
+    release = threading.Event()
+    written = []
+
+    def write(idx):
+        release.wait()
+        written.append(idx)
+
+    writer = AsyncWriter(n_workers=1, max_queued=2)
+    writer.submit(write, 0)
+    writer.submit(write, 1)
+    blocked = threading.Thread(target=writer.submit, args=(write, 2))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.flush()
+    assert written == [0, 1, 2]
+    writer.close()
+
+
+def test_async_writer_error():
+    """
+    errors of the write jobs are raised in the calling thread
+    """
+    def write(idx):
+        if idx == 1:
+            raise IOError('disk full')
+
+    writer = AsyncWriter(n_workers=2, max_queued=4)
+    for idx in range(3):
+        writer.submit(write, idx)
+    with pytest.raises(IOError, match='disk full'):
+        writer.flush()
+    writer.flush()
+    writer.close()
+
+
+def test_export_img_async(setup_mm_acquisition, tmp_path):
+    acq_path, _ = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_output_path = str(tmp_path)
+    img_io.output_chans = ['Retardance', 'Retardance+Orientation']
+    img_io.t_idx, img_io.pos_idx, img_io.z_idx = 1, 0, 2
+    img_io.enable_async_write(n_workers=2, max_queued=1)
+    img_dict = {'Retardance': np.arange(32 * 40, dtype=np.uint16).reshape(32, 40),
+                'Retardance+Orientation': np.random.RandomState(0).randint(0, 255, (32, 40, 3)).astype(np.uint8),
+                'Orientation': np.zeros((32, 40), np.uint16)}
+    export_img(img_io, img_dict, separate_pos=True)
+    img_io.flush_writes()
+    img_io.disable_async_write()
+    assert img_io.async_writer is None
+
+    assert sorted(os.listdir(str(tmp_path / 'Pos0'))) == ['img_Retardance+Orientation_t001_p000_z002.tif',
+                                                         'img_Retardance_t001_p000_z002.tif']
+    assert_array_equal(cv2.imread(str(tmp_path / 'Pos0' / 'img_Retardance_t001_p000_z002.tif'), -1),
+                       img_dict['Retardance'])
+    rgb = cv2.imread(str(tmp_path / 'Pos0' / 'img_Retardance+Orientation_t001_p000_z002.tif'), -1)
+    assert_array_equal(cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB), img_dict['Retardance+Orientation'])
@@ -0,0 +1,198 @@
+import json
+import os
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+
+"""
+pytest fixtures providing small synthetic Micro-Manager 1.4.22 acquisitions on disk, and helpers
+building synthetic intensity data in memory
+"""
+
+
+_chan_names = ['State0', 'State1', 'State2', 'State3', 'State4']
+
+
+def write_mm_acquisition(acq_path, n_pos=2, n_time=2, n_z=3, height=32, width=40, seed=0):
+    """
+    write one tiff per (c,t,p,z) plus metadata.txt in each position folder
+
+    Returns
+    -------
+    dict
+        {(chan_name, t_idx, pos_idx, z_idx): uint16 image}
+    """
+    rng = np.random.RandomState(seed)
+    pos_names = ['Pos%d' % pos_idx for pos_idx in range(n_pos)]
+    summary = {'MicroManagerVersion': '1.4.22',
+               'ChNames': _chan_names,
+               'Prefix': os.path.basename(acq_path),
+               'Positions': n_pos,
+               'Frames': n_time,
+               'Slices': n_z,
+               'z-step_um': 0.5,
+               'InitialPositionList': [{'Label': pos_name} for pos_name in pos_names],
+               'Width': width,
+               'Height': height,
+               'Time': '2019-09-16 10:00:00',
+               '~ Acquired Using': '5-Frame',
+               '~ Background': 'No Background',
+               '~ BlackLevel': 100,
+               '~ Mirror': 'No',
+               '~ Swing (fraction)': 0.03,
+               '~ Wavelength (nm)': 532}
+    imgs = {}
+    for pos_idx, pos_name in enumerate(pos_names):
+        pos_path = os.path.join(acq_path, pos_name)
+        os.makedirs(pos_path)
+        meta = {'Summary': summary}
+        for t_idx in range(n_time):
+            for z_idx in range(n_z):
+                for chan_idx, chan_name in enumerate(_chan_names):
+                    img = rng.randint(1000, 3000, size=(height, width)).astype(np.uint16)
+                    cv2.imwrite(os.path.join(pos_path, 'img_000000%03d_%s_%03d.tif' % (t_idx, chan_name, z_idx)), img)
+                    meta['FrameKey-%d-%d-%d' % (t_idx, chan_idx, z_idx)] = {'Exposure-ms': 10}
+                    imgs[(chan_name, t_idx, pos_idx, z_idx)] = img
+        with open(os.path.join(pos_path, 'metadata.txt'), 'w') as f:
+            json.dump(meta, f)
+    return imgs
+
+
+def write_mm_stack(stack_path, summary, planes):
+    """
+    write a little-endian Micro-Manager multi-page tiff with summary metadata and index map
+
+    Parameters
+    ----------
+    stack_path : str
+        path of the .ome.tif file
+    summary : dict
+        summary metadata
+    planes : dict
+        {(chan_idx, t_idx, pos_idx, z_idx): 2D uint16 image}
+    """
+    summary_bytes = json.dumps(summary).encode('utf-8')
+    data = bytearray(struct.pack('<2sHI', b'II', 42, 0))
+    data += struct.pack('<8I', 54773648, 0, 483765892, 0, 99384722, 0, 2355492, len(summary_bytes))
+    data += summary_bytes
+    index_map, prev_next_ptr = [], 4
+    for (chan_idx, t_idx, pos_idx, z_idx), img in planes.items():
+        data += b'\0' * (len(data) % 2)
+        pixel_offset = len(data)
+        data += img.astype('<u2').tobytes()
+        data += b'\0' * (len(data) % 2)
+        ifd_offset = len(data)
+        struct.pack_into('<I', data, prev_next_ptr, ifd_offset)
+        height, width = img.shape
+        entries = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, 1, 16), (259, 3, 1, 1), (262, 3, 1, 1),
+                   (273, 4, 1, pixel_offset), (277, 3, 1, 1), (278, 4, 1, height), (279, 4, 1, img.size * 2)]
+        data += struct.pack('<H', len(entries))
+        for code, field_type, count, value in entries:
+            data += struct.pack('<HHI', code, field_type, count) + \
+                (struct.pack('<HH', value, 0) if field_type == 3 else struct.pack('<I', value))
+        prev_next_ptr = len(data)
+        data += struct.pack('<I', 0)
+        index_map.append((chan_idx, z_idx, t_idx, pos_idx, ifd_offset))
+    struct.pack_into('<I', data, 12, len(data))
+    data += struct.pack('<II', 3453623, len(index_map))
+    for entry in index_map:
+        data += struct.pack('<5I', *entry)
+    with open(stack_path, 'wb') as f:
+        f.write(bytes(data))
+
+
+@pytest.fixture
+def setup_mm_acquisition(tmp_path):
+    """
+    synthetic 5-frame PolAcquisition with 2 positions, 2 timepoints and 3 z-slices
+
+    Returns
+    -------
+    acquisition path, dict of the written images
+    """
+    acq_path = os.path.join(str(tmp_path), 'SM_2019_0916_1000_1')
+    imgs = write_mm_acquisition(acq_path)
+    yield acq_path, imgs
+
+
+def reconstruct_sample(acq_path, bg_path, processed_dir, **processing):
+    """
+    reconstruct an acquisition with a config set up in code, through process_sample_imgs
+
+    Parameters
+    ----------
+    acq_path, bg_path : str
+        sample and background acquisitions, in the same folder
+    processed_dir : str
+        output folder, created if it doesn't exist
+    processing :
+        processing options of the config
+
+    Returns
+    -------
+    dict
+        {path relative to processed_dir: image} of the tiffs written for the sample
+    """
+    from ReconstructOrder.utils.ConfigReader import ConfigReader
+    from ReconstructOrder.workflow.multiDimProcess import process_sample_imgs
+    from ReconstructOrder.workflow.reconstructBatch import read_acquisitions, _prepare_acqu
+
+    os.makedirs(processed_dir, exist_ok=True)
+    config = ConfigReader()
+    config.dataset.data_dir = os.path.dirname(acq_path)
+    config.dataset.processed_dir = processed_dir
+    config.dataset.samples = [os.path.basename(acq_path)]
+    config.dataset.background = [os.path.basename(bg_path)]
+    config.dataset.positions = [['all']]
+    config.dataset.z_slices = [['all']]
+    config.dataset.timepoints = [['all']]
+    for key, value in processing.items():
+        setattr(config.processing, key, value)
+
+    [img_io], [bg_io] = read_acquisitions(config)
+    process_sample_imgs(**_prepare_acqu(img_io, bg_io, config))
+    imgs = {}
+    for dir_path, _, file_names in os.walk(processed_dir):
+        for file_name in file_names:
+            if file_name.endswith('.tif'):
+                img_path = os.path.join(dir_path, file_name)
+                imgs[os.path.relpath(img_path, processed_dir)] = cv2.imread(img_path, -1)
+    return imgs
+
+
+def intensity_data(imgs, dir_path=None, name=''):
+    """
+    IntensityData of the 5 polarization channels
+
+    Parameters
+    ----------
+    imgs : list
+        2D images of the channels 'IExt', 'I0', 'I45', 'I90' and 'I135'
+    dir_path : str
+        if not None, the images are saved to .npy files in dir_path and loaded as memory maps
+    name : str
+        prefix of the .npy files
+
+    Returns
+    -------
+    IntensityData
+    """
+    from ReconstructOrder.datastructures import IntensityData
+
+    int_obj = IntensityData()
+    for chan_idx, img in enumerate(imgs):
+        if dir_path is not None:
+            path = os.path.join(dir_path, '{}_{}.npy'.format(name, chan_idx))
+            np.save(path, img)
+            img = np.load(path, mmap_mode='r')
+        int_obj.append_image(img)
+    int_obj.channel_names = ['IExt', 'I0', 'I45', 'I90', 'I135']
+    return int_obj
+
+
+def random_intensity_data(rng, shape, dtype=np.uint16):
+    """IntensityData of 5 channels of uniform random intensities between 1000 and 4000"""
+    return intensity_data([(1000 + 3000 * rng.random(shape)).astype(dtype) for _ in range(5)])
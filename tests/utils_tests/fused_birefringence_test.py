@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ReconstructOrder.compute.reconstruct import ImgReconstructor
+from ReconstructOrder.datastructures import StokesData
+
+from .conftest import random_intensity_data
+
+
+@pytest.mark.parametrize('circularity', ['rcp', 'lcp'])
+@pytest.mark.parametrize('dtype', [np.float32, np.uint16])
+def test_fused_birefringence(circularity, dtype):
+    """
+    the fused engine gives the same birefringence as the step by step reconstruction, for any tile size
+    """
+    rng = np.random.default_rng(0)
+    int_bg = random_intensity_data(rng, (13, 11), dtype)
+    reconstructor = ImgReconstructor(int_bg, swing=0.03, wavelength=532, azimuth_offset=10, circularity=circularity)
+    stokes_bg = reconstructor.stokes_normalization(reconstructor.compute_stokes(int_bg))
+
+    slices = [random_intensity_data(rng, (13, 11), dtype) for _ in range(3)]
+    stokes = StokesData()
+    [stokes.s0,
+     stokes.s1,
+     stokes.s2,
+     stokes.s3] = [np.stack(stack, axis=-1) for stack in
+                   zip(*[reconstructor.compute_stokes(int_obj).data for int_obj in slices])]
+    norm_sample = reconstructor.stokes_normalization(stokes)
+    norm_sample = reconstructor.correct_background(norm_sample, stokes_bg)
+    expected = reconstructor.reconstruct_birefringence(norm_sample)
+
+    img_raw = np.stack([reconstructor.raw_intensities(int_obj) for int_obj in slices], axis=-1)
+    for tile_pixels in [1, 50, 1 << 15]:
+        fused = reconstructor.reconstruct_birefringence_fused(img_raw, stokes_bg, tile_pixels=tile_pixels)
+        for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+            np.testing.assert_array_equal(getattr(fused, name), getattr(expected, name))
+
+    # single slice without background correction
+    expected = reconstructor.reconstruct_birefringence(
+        reconstructor.stokes_normalization(reconstructor.compute_stokes(slices[0])))
+    fused = reconstructor.reconstruct_birefringence_fused(reconstructor.raw_intensities(slices[0]), tile_pixels=20)
+    for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+        np.testing.assert_array_equal(getattr(fused, name), getattr(expected, name))
+
+
+def test_compute_stokes_batch():
+    """
+    the Stokes parameters of a z-stack buffer are written into out, equal to those of each slice
+    """
+    rng = np.random.default_rng(1)
+    slices = [random_intensity_data(rng, (13, 11), np.uint16) for _ in range(3)]
+    reconstructor = ImgReconstructor(slices[0], swing=0.03, wavelength=532)
+    img_raw = np.empty((5, 13, 11, 3), dtype=np.uint16)
+    for z_idx, int_obj in enumerate(slices):
+        reconstructor.raw_intensities(int_obj, out=img_raw[..., z_idx])
+
+    out = np.empty((4, 13, 11, 3), dtype=reconstructor.dtype)
+    stokes = reconstructor.compute_stokes_batch(img_raw, out=out)
+    assert np.shares_memory(stokes.s2, out)
+    for z_idx, int_obj in enumerate(slices):
+        for img_batch, img in zip(stokes.data, reconstructor.compute_stokes(int_obj).data):
+            np.testing.assert_array_equal(img_batch[..., z_idx], img)
+
+    with pytest.raises(ValueError):
+        reconstructor.compute_stokes_batch(img_raw, out=np.empty((4, 13, 11, 3), dtype=reconstructor.dtype)[..., ::-1])
+    with pytest.raises(ValueError):
+        reconstructor.compute_stokes_batch(img_raw, out=np.empty((4, 13, 11, 3), dtype=np.float64))
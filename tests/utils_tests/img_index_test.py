@@ -0,0 +1,50 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from ReconstructOrder.utils import img_index
+from ReconstructOrder.utils.img_index import ImgDirIndex, index_file_path
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+
+
+def test_index_cached_on_disk(setup_mm_acquisition, monkeypatch):
+    """
+    the index is saved next to the position folder and reused until the folder changes
+    """
+    acq_path, imgs = setup_mm_acquisition
+    pos_path = os.path.join(acq_path, 'Pos1')
+    index = ImgDirIndex.load(pos_path)
+    assert index.img_name_format == 'mm_1_4_22'
+    assert len(index.files) == len([key for key in imgs if key[2] == 1])
+    assert index.get('State3', 1, 1, 2) == 'img_000000001_State3_002.tif'
+    assert index.get('State3', 1, 1, 5) is None
+    assert os.path.isfile(index_file_path(pos_path))
+
+    # a new process reads the index from disk without listing the folder
+    monkeypatch.setattr(img_index, '_index_cache', {})
+    with monkeypatch.context() as m:
+        m.setattr(img_index.os, 'scandir', None)
+        assert ImgDirIndex.load(pos_path).files == index.files
+
+    cv2.imwrite(os.path.join(pos_path, 'img_000000002_State0_000.tif'), np.zeros((32, 40), np.uint16))
+    os.utime(pos_path, ns=(index.dir_mtime + 10 ** 9, index.dir_mtime + 10 ** 9))
+    assert ImgDirIndex.load(pos_path).get('State0', 2, 1, 0) == 'img_000000002_State0_000.tif'
+
+
+@pytest.mark.parametrize('img_name_format, img_name', [
+    ('mm_2_0', 'img_channel002_position001_time000000003_z004.tif'),
+    ('recon_order', 'img_State2_t003_p001_z004.tif'),
+])
+def test_img_name_formats(setup_mm_acquisition, tmp_path, img_name_format, img_name):
+    acq_path, _ = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_name_format = img_name_format
+    assert img_io.get_img_name(chan_idx=2, t_idx=3, pos_idx=1, z_idx=4) == img_name
+
+    cv2.imwrite(str(tmp_path / img_name), np.zeros((8, 8), np.uint16))
+    index = ImgDirIndex.build(str(tmp_path))
+    assert index.img_name_format == img_name_format
+    chan = 2 if img_name_format == 'mm_2_0' else 'State2'
+    assert index.get(chan, 3, 1, 4) == img_name
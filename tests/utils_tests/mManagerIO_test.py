@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal, assert_allclose
+
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.utils.imgProcessing import mean_pooling_2d
+from ReconstructOrder.datastructures import IntensityDataCreator
+from ReconstructOrder.compute.reconstruct import ImgReconstructor
+
+
+def test_read_img_stack(setup_mm_acquisition):
+    """
+    bulk read returns a (C, Z, Y, X) float32 array identical to plane-by-plane reads
+    """
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_in_pos_path = acq_path + '/Pos1'
+    img_io.pos_idx, img_io.t_idx = 1, 1
+
+    stack = img_io.read_img_stack(chan_names=['State2', 'State0'], roi=[2, 4, 16, 20], black_level=100)
+
+    assert stack.shape == (2, 3, 16, 20)
+    assert stack.dtype == np.float32
+    assert stack.flags['C_CONTIGUOUS']
+    for c, chan_name in enumerate(['State2', 'State0']):
+        for z_idx in range(3):
+            img = imgs[(chan_name, 1, 1, z_idx)][2:18, 4:24].astype(np.float32) - 100
+            assert_array_equal(stack[c, z_idx], img)
+
+
+def test_read_img_stack_binning_native(setup_mm_acquisition):
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_in_pos_path = acq_path + '/Pos0'
+
+    stack = img_io.read_img_stack(z_list=[2], binning=2)
+    assert stack.shape == (5, 1, 16, 20)
+    assert_allclose(stack[4, 0], mean_pooling_2d(imgs[('State4', 0, 0, 2)].astype(np.float32), 2), rtol=1e-6)
+
+    out = np.zeros((5, 1, 32, 40), dtype=np.uint16)
+    stack = img_io.read_img_stack(z_list=[1], dtype=None, black_level=2000, out=out)
+    assert stack is out
+    assert_array_equal(out[1, 0], np.clip(imgs[('State1', 0, 0, 1)].astype(int) - 2000, 0, None))
+
+    with pytest.raises(ValueError):
+        img_io.read_img_stack(z_list=[0, 1], out=out)
+
+
+def test_read_multi_chan_img_stack(setup_mm_acquisition):
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_in_pos_path = acq_path + '/Pos0'
+    img_chann = img_io.read_multi_chan_img_stack(z_range=[1, 3])
+    assert len(img_chann) == 5
+    assert img_chann[3].shape == (2, 32, 40)
+    assert_array_equal(img_chann[3][0], imgs[('State3', 0, 0, 1)])
+
+
+@pytest.mark.parametrize('binning', [1, 2])
+def test_uint16_intensity_data(setup_mm_acquisition, binning):
+    """
+    uint16 intensity images match the float32 ones up to the rounding of the binned pixels,
+    and give the same Stokes parameters
+    """
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_in_pos_path = acq_path + '/Pos1'
+    img_io.pos_idx, img_io.t_idx, img_io.z_idx = 1, 1, 2
+    int_float = IntensityDataCreator(ROI=[2, 4, 16, 20], binning=binning).get_data_object(img_io)
+    int_uint = IntensityDataCreator(ROI=[2, 4, 16, 20], binning=binning,
+                                    dtype=np.uint16).get_data_object(img_io)
+
+    for chan_name in ['IExt', 'I0', 'I45', 'I90', 'I135', '405']:
+        img = int_uint.get_image(chan_name)
+        assert img.dtype == np.uint16
+        assert img.shape == (16 // binning, 20 // binning)
+        assert_allclose(img, int_float.get_image(chan_name), atol=0 if binning == 1 else 0.5)
+
+    reconstructor = ImgReconstructor(int_float, swing=0.03, wavelength=532)
+    stokes_float = reconstructor.compute_stokes(int_float)
+    stokes_uint = reconstructor.compute_stokes(int_uint)
+    # rounding error of the binned pixels propagated through the instrument matrix
+    atol = 1e-6 if binning == 1 else 0.5 * np.abs(reconstructor.inst_mat_inv).sum(axis=1).max()
+    for img_float, img_uint in zip(stokes_float.data, stokes_uint.data):
+        assert_allclose(img_uint, img_float, atol=atol)
+
+
+def test_uint16_black_level_clipped(setup_mm_acquisition):
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_in_pos_path = acq_path + '/Pos0'
+    img_io.blackLevel = 2000
+    int_obj = IntensityDataCreator(dtype=np.uint16).get_data_object(img_io)
+    assert_array_equal(int_obj.get_image('I90'),
+                       np.clip(imgs[('State1', 0, 0, 0)].astype(int) - 2000, 0, None))
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.uint16])
+@pytest.mark.parametrize('binning', [1, 2])
+def test_block_intensity_data(setup_mm_acquisition, binning, dtype):
+    """
+    the intensity data of a block read in one pass are the same as those of each slice
+    """
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.img_in_pos_path = acq_path + '/Pos1'
+    img_io.pos_idx, img_io.t_idx = 1, 1
+    img_io.blackLevel = 1500
+    int_creator = IntensityDataCreator(ROI=[2, 4, 16, 20], binning=binning, dtype=dtype)
+    int_block = int_creator.get_data_objects(img_io, [2, 0])
+
+    for int_obj, z_idx in zip(int_block, [2, 0]):
+        img_io.z_idx = z_idx
+        int_slice = int_creator.get_data_object(img_io)
+        for chan_name in ['IExt', 'I0', 'I45', 'I90', 'I135', '405']:
+            assert int_obj.get_image(chan_name).dtype == dtype
+            assert_array_equal(int_obj.get_image(chan_name), int_slice.get_image(chan_name))
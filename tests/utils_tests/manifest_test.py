@@ -0,0 +1,53 @@
+from ReconstructOrder.utils.ConfigReader import ConfigReader
+from ReconstructOrder.utils.manifest import CompletionManifest, config_hash
+
+
+def test_manifest_resume(tmp_path):
+    """
+    units recorded with the same config hash are done after a restart, a partly written last line is ignored
+    """
+    path = str(tmp_path / 'manifest.jsonl')
+    manifest = CompletionManifest(path, 'hash1')
+    manifest.record('Pos0', 0, 0, [0, 1])
+    manifest.record('Pos1', 1, 0, [0, 1])
+    with open(path, 'a') as f:
+        f.write('{"config": "hash1", "pos": "Po')
+
+    manifest = CompletionManifest(path, 'hash1')
+    assert len(manifest) == 2
+    assert manifest.is_done('Pos0', 0, 0, [0, 1])
+    assert not manifest.is_done('Pos0', 0, 0, [0])
+    assert not manifest.is_done('Pos0', 0, 1, [0, 1])
+
+    assert len(CompletionManifest(path, 'hash2')) == 0
+    assert len(CompletionManifest(path, 'hash1', resume=False)) == 0
+
+
+def test_manifest_seconds(tmp_path):
+    """
+    the durations of the units are read from the records of any config
+    """
+    path = str(tmp_path / 'manifest.jsonl')
+    manifest = CompletionManifest(path, 'hash1')
+    manifest.record('Pos0', 0, 0, [0, 1], seconds=2.5)
+    manifest.record('Pos0', 0, 1, [0, 1])
+    assert manifest.seconds('Pos0', 0, 0, [0, 1]) == 2.5
+
+    manifest = CompletionManifest(path, 'hash2', resume=False)
+    assert len(manifest) == 0
+    assert manifest.seconds('Pos0', 0, 0, [0, 1]) == 2.5
+    assert manifest.seconds('Pos0', 0, 1, [0, 1]) is None
+
+
+def test_config_hash():
+    """
+    the hash changes with the reconstruction options, not with the performance options
+    """
+    config = ConfigReader()
+    ref_hash = config_hash(config, '/data/SM', '/data/BG')
+    config.processing.prefetch_workers = 4
+    config.processing.resume = True
+    assert config_hash(config, '/data/SM/', '/data/BG') == ref_hash
+    assert config_hash(config, '/data/SM2', '/data/BG') != ref_hash
+    config.processing.binning = 2
+    assert config_hash(config, '/data/SM', '/data/BG') != ref_hash
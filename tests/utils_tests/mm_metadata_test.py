@@ -0,0 +1,54 @@
+import json
+import pickle
+
+import pytest
+
+from ReconstructOrder.utils.mm_metadata import MetadataFile
+
+
+@pytest.fixture
+def metadata_path(tmp_path):
+    meta = {'Summary': {'Prefix': 'acq', 'ChNames': ['State0', 'Ø'], 'Frames': 20}}
+    for t_idx in range(20):
+        meta['FrameKey-{}-0-0'.format(t_idx)] = {'ElapsedTime-ms': t_idx * 1.5, 'Comment': 'é' * t_idx}
+    path = str(tmp_path / 'metadata.txt')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    return path, meta
+
+
+def test_summary_read_first(metadata_path):
+    """
+    reading the Summary only scans the beginning of the file, other entries are read on demand
+    """
+    path, meta = metadata_path
+    meta_file = MetadataFile(path, chunk_size=64)
+    assert meta_file['Summary'] == meta['Summary']
+    assert list(meta_file._offsets) == ['Summary']
+    assert meta_file['FrameKey-7-0-0'] == meta['FrameKey-7-0-0']
+    assert 'FrameKey-30-0-0' not in meta_file
+    assert dict(meta_file) == meta
+    assert pickle.loads(pickle.dumps(meta_file))['FrameKey-19-0-0'] == meta['FrameKey-19-0-0']
+
+
+def test_write(metadata_path, tmp_path):
+    path, meta = metadata_path
+    meta_file = MetadataFile(path, chunk_size=64)
+    meta_file['Summary']['ChNames'] = ['State0']
+    meta_file.write(str(tmp_path / 'out.txt'))
+    meta['Summary']['ChNames'] = ['State0']
+    with open(str(tmp_path / 'out.txt'), encoding='utf-8') as f:
+        assert json.load(f) == meta
+
+
+def test_written_keys_incomplete_file(metadata_path):
+    """
+    the entries before the one being written are listed, without error
+    """
+    path, meta = metadata_path
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:data.index('"FrameKey-12-0-0"'.encode('utf-8')) + 30])
+    meta_file = MetadataFile(path, chunk_size=64)
+    assert meta_file.written_keys() == ['Summary'] + ['FrameKey-{}-0-0'.format(t_idx) for t_idx in range(12)]
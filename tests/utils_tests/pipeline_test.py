@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from ReconstructOrder.utils.pipeline import run_pipeline
+
+
+def _double(items):
+    for item in items:
+        yield 2 * item
+
+
+def _pairs(items):
+    pair = []
+    for item in items:
+        pair.append(item)
+        if len(pair) == 2:
+            yield tuple(pair)
+            pair = []
+
+
+@pytest.mark.parametrize('queue_size', [0, 1, 3])
+def test_run_pipeline(queue_size):
+    """
+    items go through the stages in order, stages run in their own threads when queue_size > 0
+    """
+    out, threads = [], set()
+
+    def collect(items):
+        for item in items:
+            out.append(item)
+            threads.add(threading.current_thread())
+            yield item
+
+    run_pipeline(range(10), [_double, _pairs, collect], queue_size=queue_size)
+    assert out == [(0, 2), (4, 6), (8, 10), (12, 14), (16, 18)]
+    assert (threading.current_thread() in threads) == (queue_size == 0)
+
+
+def test_run_pipeline_error():
+    """
+    the error of a stage is raised and stops the other stages, also when they are blocked on full queues
+    """
+    def fail(items):
+        for item in items:
+            if item == 6:
+                raise ValueError('bad item')
+            yield item
+
+    n_threads = threading.active_count()
+    with pytest.raises(ValueError, match='bad item'):
+        run_pipeline(iter(range(1000)), [_double, fail, _pairs], queue_size=1)
+    assert threading.active_count() == n_threads
@@ -0,0 +1,47 @@
+from ReconstructOrder.workflow.planner import ReconstructionPlan
+
+
+input_chans = ['State0', 'State1', 'State2', 'State3', 'State4', 'BF', 'Widefield_405']
+
+
+def test_read_only_needed_channels():
+    """
+    only the input channels of the requested outputs are read
+    """
+    plan = ReconstructionPlan(['Retardance', 'Orientation'], input_chans)
+    assert plan.read_chans == ['State0', 'State1', 'State2', 'State3', 'State4']
+    assert plan.steps == ['read_pol', 'stokes', 'stokes_normalized', 'birefringence']
+    assert not plan.needs('flat_field', 'fluorescence', 'brightfield', 'pol_ratio')
+
+    plan = ReconstructionPlan(['405'], input_chans, flatfield=True)
+    assert plan.read_chans == ['Widefield_405']
+    assert plan.steps == ['read_fluor', 'flat_field', 'fluorescence']
+
+
+def test_stokes_and_phase_skip_birefringence():
+    """
+    Stokes and phase outputs don't compute the birefringence
+    """
+    plan = ReconstructionPlan(['Stokes_0', 'Stokes_1_sm'], input_chans)
+    assert not plan.needs('birefringence', 'birefringence_Zavg')
+    plan = ReconstructionPlan(['Phase2D', 'Absorption2D', 'Phase_semi3D'], input_chans)
+    assert not plan.needs('birefringence')
+    assert plan.phase_deconv == ['2D', 'semi-3D']
+
+    plan = ReconstructionPlan(['Retardance', 'Brightfield_computed'], input_chans, birefringence_fig=True)
+    assert plan.phase_deconv == []
+    assert plan.renders('birefringence figure')
+
+
+def test_missing_inputs():
+    """
+    outputs of channels that were not acquired are skipped, phase is reconstructed from brightfield
+    without polarization channels
+    """
+    plan = ReconstructionPlan(['Retardance', 'Phase3D', 'Brightfield', '488', 'Foo'], ['BF'])
+    assert plan.skipped == {'Retardance': 'no polarization channel acquired'}
+    assert plan.unknown == ['Foo']
+    assert plan.renders('Phase3D', 'Brightfield', '488')
+    assert plan.read_chans == ['BF']
+    assert plan.dependencies['phase_3D'] == ['read_bf']
+    assert 'Retardance skipped' in plan.describe()
@@ -0,0 +1,66 @@
+import threading
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from ReconstructOrder.utils.prefetch import ImgPrefetcher
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.datastructures import IntensityDataCreator
+
+
+def test_prefetcher_bounded():
+    """
+    no more than max_queued reads are scheduled, stale keys are dropped
+    """
+    reads = []
+    lock = threading.Lock()
+
+    def read(idx):
+        with lock:
+            reads.append(idx)
+        return idx * 2
+
+    prefetcher = ImgPrefetcher(read, n_workers=2, max_queued=3)
+    prefetcher.prefetch([(i,) for i in range(10)])
+    assert len(prefetcher._pending) == 3
+    assert prefetcher.get((0,)) == 0
+    prefetcher.prefetch([(5,), (6,)])
+    assert set(prefetcher._pending) == {(5,), (6,)}
+    assert prefetcher.get((6,)) == 12
+    # never scheduled keys are read synchronously
+    assert prefetcher.get((9,)) == 18
+    prefetcher.close()
+
+
+def test_prefetcher_propagates_errors():
+    def read(idx):
+        raise IOError('cannot read %d' % idx)
+
+    prefetcher = ImgPrefetcher(read, n_workers=1, max_queued=2)
+    prefetcher.prefetch([(1,)])
+    with pytest.raises(IOError):
+        prefetcher.get((1,))
+    prefetcher.close()
+
+
+def test_prefetched_data_object_matches_sync(setup_mm_acquisition):
+    """
+    IntensityData built with prefetching is identical to synchronous reads
+    """
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    creator = IntensityDataCreator(ROI=[2, 4, 16, 20])
+    expected = []
+    for z_idx in img_io.z_list:
+        img_io.z_idx = z_idx
+        expected.append(creator.get_data_object(img_io).get_image('I45'))
+
+    img_io.enable_prefetch(n_workers=3, depth=2)
+    for z_idx, img_exp in zip(img_io.z_list, expected):
+        img_io.z_idx = z_idx
+        img = creator.get_data_object(img_io).get_image('I45')
+        assert_array_equal(img, img_exp)
+        assert_array_equal(img, imgs[('State3', 0, 0, z_idx)][2:18, 4:24].astype(np.float32) - 100)
+    img_io.disable_prefetch()
+    assert img_io.prefetcher is None
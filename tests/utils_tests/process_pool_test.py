@@ -0,0 +1,78 @@
+import io
+import os
+import pickle
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from ReconstructOrder.utils.aux_utils import loop_pt
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.utils.process_pool import _SharedArrayPickler, loop_pt_processes
+
+
+@loop_pt
+def _sum_slice(img_io=None, weights=None, offsets=None, out_dir=None):
+    """writes the weighted sum of the first z-slice of each channel, one file per (p, t)"""
+    img_io.z_idx = 0
+    total = 0
+    for chan_idx in range(len(img_io.input_chans)):
+        img_io.chan_idx = chan_idx
+        total += np.sum(img_io.read_img() * weights) + offsets[chan_idx]
+    out_path = os.path.join(out_dir, 'p{}_t{}.npy'.format(img_io.pos_idx, img_io.t_idx))
+    np.save(out_path, [total, os.getpid(), offsets.flags.writeable])
+
+
+def test_shared_array_pickler():
+    """
+    large arrays are unpickled as read-only views of one shared memory block, small ones are copied
+    """
+    large, small = np.arange(100000, dtype=np.float64), np.arange(10)
+    buffer = io.BytesIO()
+    pickler = _SharedArrayPickler(buffer)
+    pickler.dump({'a': large, 'b': large, 'c': small})
+    try:
+        assert len(pickler.blocks) == 1
+        assert len(buffer.getvalue()) < 1000
+        arrays = pickle.loads(buffer.getvalue())
+        assert arrays['a'] is arrays['b']
+        assert not arrays['a'].flags.writeable
+        assert_array_equal(arrays['a'], large)
+        assert_array_equal(arrays['c'], small)
+    finally:
+        for block in pickler.blocks:
+            block.close()
+            block.unlink()
+
+
+def test_loop_pt_processes(setup_mm_acquisition, tmp_path):
+    """
+    every (p, t) unit is processed by the workers, with the same result as the serial loop
+    """
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    weights = np.full((32, 40), 0.5)
+    offsets = np.arange(1 << 14, dtype=np.float64)  # large enough to be shared
+    serial_dir, parallel_dir = tmp_path / 'serial', tmp_path / 'parallel'
+    serial_dir.mkdir()
+    parallel_dir.mkdir()
+
+    _sum_slice(img_io=img_io, weights=weights, offsets=offsets, out_dir=str(serial_dir))
+    loop_pt_processes(_sum_slice, 2, prefetch=(1, 2), img_io=img_io, weights=weights, offsets=offsets,
+                      out_dir=str(parallel_dir))
+
+    assert sorted(os.listdir(parallel_dir)) == ['p0_t0.npy', 'p0_t1.npy', 'p1_t0.npy', 'p1_t1.npy']
+    for file_name in os.listdir(serial_dir):
+        total, pid, writeable = np.load(str(parallel_dir / file_name))
+        total_serial, pid_serial, _ = np.load(str(serial_dir / file_name))
+        assert total == total_serial
+        assert pid != pid_serial
+        assert not writeable
+
+
+def test_loop_pt_processes_error(setup_mm_acquisition, tmp_path):
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    with pytest.raises(FileNotFoundError):
+        loop_pt_processes(_sum_slice, 2, img_io=img_io, weights=np.ones((32, 40)),
+                          offsets=np.zeros(5), out_dir=str(tmp_path / 'missing'))
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from .conftest import write_mm_acquisition, reconstruct_sample
+
+
+def _assert_same_outputs(imgs, expected):
+    assert sorted(imgs) == sorted(expected)
+    for img_path, img in expected.items():
+        assert_array_equal(imgs[img_path], img, err_msg=img_path)
+
+
+@pytest.mark.parametrize('processing', [
+    dict(background_correction='Input', n_slice_local_bg=1,
+         output_channels=['Brightfield_computed', 'Retardance', 'Orientation', 'Polarization', 'Orientation_x',
+                          'Stokes_1', 'Stokes_2_sm', 'Pol_State_0']),
+    dict(background_correction='Local_filter', n_slice_local_bg='all',
+         output_channels=['Retardance', 'Orientation', 'Polarization', 'RetardanceZavg', 'Stokes_0']),
+])
+def test_pipeline_queue(setup_mm_acquisition, tmp_path, processing):
+    """
+    the stages of process_sample_imgs write the same images in threads as one after the other
+    """
+    acq_path, _ = setup_mm_acquisition
+    bg_path = os.path.join(str(tmp_path), 'BG_2019_0916_1000_1')
+    write_mm_acquisition(bg_path, n_pos=1, n_time=1, n_z=1, seed=1)
+
+    expected = reconstruct_sample(acq_path, bg_path, str(tmp_path / 'sequential'), pipeline_queue_size=0,
+                                  **processing)
+    # every z-slice of the 2 positions and 2 time points
+    assert len([img_path for img_path in expected if 'img_Retardance_t' in img_path]) == 12
+    assert any(np.any(img) for img in expected.values())
+    imgs = reconstruct_sample(acq_path, bg_path, str(tmp_path / 'threads'), pipeline_queue_size=2, **processing)
+    _assert_same_outputs(imgs, expected)
+
+
+def test_stream_local_bg(setup_mm_acquisition, tmp_path):
+    """
+    the z-slices streamed twice through the local background correction give the same images as the stacked block
+    """
+    acq_path, _ = setup_mm_acquisition
+    bg_path = os.path.join(str(tmp_path), 'BG_2019_0916_1000_1')
+    write_mm_acquisition(bg_path, n_pos=1, n_time=1, n_z=1, seed=1)
+    processing = dict(background_correction='Local_filter', n_slice_local_bg='all',
+                      output_channels=['Brightfield_computed', 'Retardance', 'Orientation', 'Polarization',
+                                       'RetardanceZavg', 'OrientationZavg', 'Stokes_2', 'Stokes_0_sm'])
+
+    expected = reconstruct_sample(acq_path, bg_path, str(tmp_path / 'stacked'), **processing)
+    # one z-average for each of the 2 positions and 2 time points
+    assert len([img_path for img_path in expected if 'RetardanceZavg' in img_path]) == 4
+    imgs = reconstruct_sample(acq_path, bg_path, str(tmp_path / 'streamed'), stream_local_bg=True, **processing)
+    _assert_same_outputs(imgs, expected)
+
+
+def test_phase_precision(setup_mm_acquisition, tmp_path):
+    """
+    the phase from the polarization channels does not depend on the precision of the birefringence
+    """
+    acq_path, _ = setup_mm_acquisition
+    bg_path = os.path.join(str(tmp_path), 'BG_2019_0916_1000_1')
+    write_mm_acquisition(bg_path, n_pos=1, n_time=1, n_z=1, seed=1)
+    processing = dict(background_correction='Input', output_channels=['Phase2D', 'Phase_semi3D', 'Retardance'],
+                      pixel_size=6.5, magnification=20, NA_objective=0.4, NA_condenser=0.2, n_objective_media=1.0,
+                      focus_zidx=1, pad_z=0)
+
+    expected = reconstruct_sample(acq_path, bg_path, str(tmp_path / 'float64'), precision='float64', **processing)
+    assert len([img_path for img_path in expected if 'Phase2D' in img_path]) == 4
+    imgs = reconstruct_sample(acq_path, bg_path, str(tmp_path / 'float32'), precision='float32', **processing)
+    _assert_same_outputs(imgs, expected)
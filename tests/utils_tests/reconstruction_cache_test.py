@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+from ReconstructOrder.datastructures import StokesData
+from ReconstructOrder.utils.ConfigReader import ConfigReader
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.workflow.reconstruction_cache import ReconstructionCache
+from .conftest import write_mm_acquisition
+
+
+def _reader(acq_path, bg_io=None):
+    img_io = PolAcquReader(acq_path)
+    bg_io = bg_io or img_io
+    img_io.swing, img_io.wavelength, img_io.blackLevel = bg_io.swing, bg_io.wavelength, bg_io.blackLevel
+    img_io.bg_method, img_io.bg_correct = 'Global', True
+    return img_io
+
+
+def test_shared_background(setup_mm_acquisition, tmp_path):
+    """
+    samples with the same background share its Stokes parameters, which correcting a sample doesn't modify
+    """
+    acq_path, _ = setup_mm_acquisition
+    acq_path_2 = os.path.join(str(tmp_path), 'SM_2019_0916_1000_2')
+    bg_path = os.path.join(str(tmp_path), 'BG_2019_0916_1000_1')
+    write_mm_acquisition(acq_path_2, seed=1)
+    write_mm_acquisition(bg_path, n_pos=1, n_time=1, n_z=1, seed=2)
+    bg_io = PolAcquReader(bg_path)
+    config = ConfigReader()
+    cache = ReconstructionCache()
+
+    stokes_bg, int_bg, img_reconstructor = cache.background(_reader(acq_path, bg_io), bg_io, config)
+    assert cache.background(_reader(acq_path_2, bg_io), bg_io, config)[2] is img_reconstructor
+    config.processing.binning = 2
+    assert cache.background(_reader(acq_path_2, bg_io), bg_io, config)[2] is not img_reconstructor
+
+    stokes_bg_s0 = stokes_bg.s0.copy()
+    sample = StokesData()
+    [sample.s0, sample.polarization, sample.s1_norm, sample.s2_norm] = [np.ones((32, 40, 3))] * 4
+    corrected = img_reconstructor.correct_background_stokes(sample, stokes_bg)
+    assert corrected.s0.shape == (32, 40, 3)
+    np.testing.assert_array_equal(corrected.s0[..., 1], 1 / stokes_bg_s0)
+    np.testing.assert_array_equal(stokes_bg.s0, stokes_bg_s0)
@@ -0,0 +1,24 @@
+from ReconstructOrder.utils.scheduler import order_by_cost, UtilisationReport
+
+
+def test_order_by_cost():
+    """
+    expensive units first, units of unknown cost get the mean cost, ties keep their order
+    """
+    units = ['a', 'b', 'c', 'd', 'e']
+    assert order_by_cost(units, [1, 5, None, 3, 1]) == ['b', 'd', 'c', 'a', 'e']
+    assert order_by_cost(units, [None] * 5) == units
+
+
+def test_utilisation_report():
+    """
+    busy time of each worker over the run
+    """
+    report = UtilisationReport()
+    report.start = report.end = 100
+    report.add(1, 100, 150)
+    report.add(1, 150, 200)
+    report.add(2, 100, 150)
+    assert report.busy_fraction(1) == 1
+    assert report.busy_fraction(2) == 0.5
+    assert 'worker 2: 1 units, busy 50%' in report.summary()
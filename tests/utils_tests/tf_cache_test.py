@@ -0,0 +1,34 @@
+import os
+import time
+
+import numpy as np
+
+from ReconstructOrder.utils.tf_cache import TransferFunctionCache
+
+
+def test_tf_cache(tmp_path):
+    """
+    cached arrays are memory-mapped, the least recently used entries are evicted
+    """
+    cache_dir = str(tmp_path / 'tf_cache')
+    array = np.arange(1000, dtype=np.complex64).reshape(10, 10, 10)
+    params = {'img_dim': [10, 10, 10], 'NA_obj': 0.4, 'deconv': '3D'}
+    cache = TransferFunctionCache(cache_dir, max_size=20000)
+    assert cache.get(params) is None
+    cache.put(params, {'H_re': array, 'H_im': 2 * array})
+
+    arrays = TransferFunctionCache(cache_dir, max_size=20000).get(params)
+    assert isinstance(arrays['H_re'], np.memmap)
+    np.testing.assert_array_equal(arrays['H_im'], 2 * array)
+    assert cache.get(dict(params, NA_obj=0.5)) is None
+
+    # each entry takes 16 kB: the second one evicts the first, unless the first was used since
+    old_time = time.time() - 100
+    os.utime(os.path.join(cache_dir, os.listdir(cache_dir)[0]), (old_time, old_time))
+    cache.put(dict(params, NA_obj=0.5), {'H_re': array, 'H_im': array})
+    assert cache.get(params) is None
+    assert len(cache.entries()) == 1
+
+    cache.max_size = 40000
+    cache.put(params, {'H_re': array, 'H_im': array})
+    assert len(cache.entries()) == 2
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.utils.tiffStackIO import TiffStackReader, is_tiff_stack_folder
+from .conftest import write_mm_acquisition, write_mm_stack
+
+
+def test_mm_stack_reader(tmp_path):
+    """
+    pages are found through the Micro-Manager index map, positions can span several files
+    """
+    rng = np.random.RandomState(0)
+    chan_names = ['State0', 'State1', 'State2']
+    summary = {'Prefix': 'acq', 'ChNames': chan_names, 'z-step_um': 0.5,
+               'StagePositions': [{'Label': 'A1'}, {'Label': 'B2'}],
+               '~ Acquired Using': '4-Frame', '~ Background': 'BG', '~ BlackLevel': 100, '~ Mirror': 'No',
+               '~ Swing (fraction)': 0.1, '~ Wavelength (nm)': 532}
+    planes = {(c, t, p, z): rng.randint(0, 4000, (12, 10)).astype(np.uint16)
+              for c in range(3) for t in range(2) for p in range(2) for z in range(4)}
+    # position B2 is split into two files, as for stacks larger than 4 GB
+    write_mm_stack(str(tmp_path / 'acq_MMStack_A1.ome.tif'), summary,
+                   {key: img for key, img in planes.items() if key[2] == 0})
+    write_mm_stack(str(tmp_path / 'acq_MMStack_B2.ome.tif'), summary,
+                   {key: img for key, img in planes.items() if key[2] == 1 and key[1] == 0})
+    write_mm_stack(str(tmp_path / 'acq_MMStack_B2_1.ome.tif'), summary,
+                   {key: img for key, img in planes.items() if key[2] == 1 and key[1] == 1})
+    assert is_tiff_stack_folder(str(tmp_path))
+
+    img_io = TiffStackReader(str(tmp_path))
+    assert img_io.pos_list == ['A1', 'B2']
+    assert (img_io.n_time, img_io.n_z, img_io.height, img_io.width) == (2, 4, 12, 10)
+    assert img_io.input_chans == chan_names
+    assert (img_io.bg, img_io.swing, img_io.blackLevel) == ('BG', 0.1, 100)
+    # the reader state is initialized by mManagerReader._init_state
+    acq_path = str(tmp_path / 'tiffs' / 'SM_2019_0916_1000_1')
+    write_mm_acquisition(acq_path, n_pos=1, n_time=1, n_z=1)
+    assert set(vars(PolAcquReader(acq_path))) - set(vars(img_io)) == {'meta_parser'}
+
+    img_io.pos_list = ['B2']
+    img_io.img_in_pos_path = os.path.join(img_io.img_sm_path, 'B2')
+    img_io.pos_idx, img_io.t_idx, img_io.z_idx, img_io.chan_idx = 0, 1, 3, 2
+    img = img_io.read_img()
+    assert img.dtype == np.float32
+    assert_array_equal(img, planes[(2, 1, 1, 3)])
+    stack = img_io.read_img_stack(chan_names=['State1'], black_level=100, dtype=None)
+    assert_array_equal(stack[0, 2], np.clip(planes[(1, 1, 1, 2)].astype(int) - 100, 0, None))
+    img_io.close()
+
+
+def test_ome_tiff_reader(tmp_path):
+    """
+    OME-TIFFs without index map are indexed from the OME-XML dimension order, one position per file
+    """
+    tifffile = pytest.importorskip('tifffile')
+    rng = np.random.RandomState(1)
+    stacks = [rng.randint(0, 4000, (2, 3, 4, 12, 10)).astype(np.uint16) for _ in range(2)]
+    for pos_idx, stack in enumerate(stacks):
+        tifffile.imwrite(str(tmp_path / 'pos{}.ome.tif'.format(pos_idx)), stack, ome=True,
+                         metadata={'axes': 'TCZYX', 'Channel': {'Name': ['IExt', 'I0', 'I45']}})
+
+    img_io = TiffStackReader(str(tmp_path), backend='memmap')
+    assert img_io.pos_list == ['Pos0', 'Pos1']
+    assert img_io.input_chans == ['IExt', 'I0', 'I45']
+    assert (img_io.n_time, img_io.n_z) == (2, 4)
+    img_io.img_in_pos_path = os.path.join(img_io.img_sm_path, 'Pos1')
+    img_io.t_idx, img_io.z_idx, img_io.chan_idx = 1, 2, 1
+    assert_array_equal(img_io.read_img(), stacks[1][1, 1, 2])
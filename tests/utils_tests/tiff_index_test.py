@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import tifffile
+from numpy.testing import assert_array_equal
+
+from ReconstructOrder.utils.tiff_index import tiff_plane_layout, memmap_plane
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.datastructures import IntensityDataCreator
+
+
+def test_plane_layout(tmp_path):
+    """
+    layout of uncompressed classic and big tiffs, compressed tiffs can't be mapped
+    """
+    img = np.arange(30 * 40).reshape(30, 40).astype(np.uint16)
+    path = os.path.join(str(tmp_path), 'strips.tif')
+    tifffile.imwrite(path, img, rowsperstrip=7)
+    layout = tiff_plane_layout(path)
+    assert layout[1:] == ((30, 40), np.dtype('<u2'))
+    assert_array_equal(memmap_plane(path, layout), img)
+
+    path = os.path.join(str(tmp_path), 'big_endian.tif')
+    tifffile.imwrite(path, img.astype(np.float32), bigtiff=True, byteorder='>')
+    layout = tiff_plane_layout(path)
+    assert layout[2] == np.dtype('>f4')
+    assert_array_equal(memmap_plane(path, layout), img)
+
+    path = os.path.join(str(tmp_path), 'compressed.tif')
+    tifffile.imwrite(path, img, compression='zlib')
+    assert tiff_plane_layout(path) is None
+
+
+def test_memmap_backend(setup_mm_acquisition):
+    """
+    memmap backend gives the same intensity data as cv2 for uncompressed tiffs
+    """
+    acq_path, imgs = setup_mm_acquisition
+    for (chan_name, t_idx, pos_idx, z_idx), img in imgs.items():
+        img_file = os.path.join(acq_path, 'Pos%d' % pos_idx, 'img_000000%03d_%s_%03d.tif' % (t_idx, chan_name, z_idx))
+        tifffile.imwrite(img_file, img)  # uncompressed
+
+    img_io_cv2 = PolAcquReader(acq_path)
+    img_io_mmap = PolAcquReader(acq_path, backend='memmap')
+    img_io_cv2.z_idx = img_io_mmap.z_idx = 2
+
+    img = img_io_mmap.read_img()
+    assert isinstance(img, np.memmap)
+    assert not img.flags.writeable
+
+    creator = IntensityDataCreator(ROI=[2, 4, 16, 20])
+    int_cv2 = creator.get_data_object(img_io_cv2)
+    int_mmap = creator.get_data_object(img_io_mmap)
+    for chan_name in ['IExt', 'I0', 'I45', 'I90', 'I135']:
+        assert_array_equal(int_mmap.get_image(chan_name), int_cv2.get_image(chan_name))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from ReconstructOrder.compute.reconstruct import ImgReconstructor, memmap_physical_data
+
+from .conftest import intensity_data
+
+
+def _smooth_intensities(rng, shape, dir_path=None, name=''):
+    """intensities with a smooth background, in memory maps of .npy files if dir_path is not None"""
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    imgs = [(1000 + 300 * np.sin(xx / 7 + chan_idx) * np.cos(yy / 5) + 3000 * rng.random(shape)).astype(np.uint16)
+            for chan_idx in range(5)]
+    return intensity_data(imgs, dir_path, name)
+
+
+@pytest.mark.parametrize('precision', ['float32', 'float64'])
+@pytest.mark.parametrize('bg_method', ['Global', 'Local_filter'])
+def test_tiled_birefringence(tmp_path, capsys, bg_method, precision):
+    """
+    the tiles written to memory maps give the same birefringence as the whole image
+    """
+    rng = np.random.default_rng(0)
+    shape = (37, 29)
+    int_bg = _smooth_intensities(rng, shape)
+    reconstructor = ImgReconstructor(int_bg, bg_method=bg_method, n_slice_local_bg=3, kernel_size=9,
+                                     swing=0.03, azimuth_offset=5, precision=precision)
+    stokes_bg = reconstructor.stokes_normalization(reconstructor.compute_stokes(int_bg))
+    slices = [_smooth_intensities(rng, shape, str(tmp_path), z_idx) for z_idx in range(3)]
+
+    img_raw = np.stack([reconstructor.raw_intensities(int_obj) for int_obj in slices], axis=-1)
+    norm_sample = reconstructor.stokes_normalization(reconstructor.compute_stokes_batch(img_raw))
+    expected = reconstructor.reconstruct_birefringence(reconstructor.correct_background(norm_sample, stokes_bg))
+
+    # tiles smaller than the halos, and tiles not dividing the image
+    for tile_size in [3, 10, 64]:
+        out = memmap_physical_data(str(tmp_path / 'out'), shape + (3,), reconstructor.dtype)
+        capsys.readouterr()
+        result = reconstructor.reconstruct_birefringence_tiled(slices, stokes_bg, out=out, tile_size=tile_size)
+        # the local background of the tiles is estimated without a message for each tile
+        assert capsys.readouterr().out.count('Estimating local background') == (bg_method == 'Local_filter')
+        assert isinstance(result.retard, np.memmap)
+        for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+            if bg_method == 'Local_filter':
+                # the vectorized Gaussian filter of cv2 rounds some pixels differently on images of another width
+                np.testing.assert_allclose(getattr(result, name), getattr(expected, name), rtol=1e-5, atol=1e-4)
+            else:
+                np.testing.assert_array_equal(getattr(result, name), getattr(expected, name))
+    out.retard.flush()
+    np.testing.assert_array_equal(np.load(str(tmp_path / 'out' / 'retard.npy')), result.retard)
+
+    # 2D image
+    expected = reconstructor.reconstruct_birefringence(
+        reconstructor.stokes_normalization(reconstructor.compute_stokes(slices[0])))
+    result = reconstructor.reconstruct_birefringence_tiled(slices[0], tile_size=8)
+    for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+        np.testing.assert_array_equal(getattr(result, name), getattr(expected, name))
+
+
+def test_tiled_local_fit():
+    rng = np.random.default_rng(1)
+    int_obj = _smooth_intensities(rng, (8, 8))
+    reconstructor = ImgReconstructor(int_obj, bg_method='Local_fit', swing=0.03)
+    stokes_bg = reconstructor.stokes_normalization(reconstructor.compute_stokes(int_obj))
+    with pytest.raises(ValueError):
+        reconstructor.reconstruct_birefringence_tiled(int_obj, stokes_bg)
@@ -0,0 +1,52 @@
+import os
+
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.utils.manifest import CompletionManifest
+from ReconstructOrder.workflow.watch import AcquisitionWatcher
+
+
+def test_ready_units(setup_mm_acquisition, tmp_path):
+    """
+    a z-block is ready when the images of all its channels and their metadata are written
+    """
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    # the last image of Pos1 isn't written yet, the metadata of Pos0 is written up to t=1, z=1
+    os.remove(os.path.join(acq_path, 'Pos1', 'img_000000001_State3_002.tif'))
+    meta_path = os.path.join(acq_path, 'Pos0', 'metadata.txt')
+    with open(meta_path, 'rb') as f:
+        data = f.read()
+    with open(meta_path, 'wb') as f:
+        f.write(data[:data.index(b'"FrameKey-1-4-1"') + 20])
+
+    manifest = CompletionManifest(str(tmp_path / 'manifest.jsonl'), 'hash')
+    manifest.record('Pos0', 0, 0, [0])
+    watcher = AcquisitionWatcher(img_io, manifest, 1)
+    assert len(watcher.pending_units()) == 11
+    assert watcher.ready_units() == {(0, 0): [1, 2], (0, 1): [0], (1, 0): [0, 1, 2], (1, 1): [0, 1]}
+
+    watcher = AcquisitionWatcher(img_io, manifest, 'all')
+    assert watcher.ready_units() == {(0, 0): [0, 1, 2], (1, 0): [0, 1, 2]}
+
+
+def test_ready_units_stats(setup_mm_acquisition, tmp_path, monkeypatch):
+    """
+    only the images of the frames in the metadata are looked up, up to the first unit of a position that isn't ready
+    """
+    acq_path, imgs = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    # Pos0 is written up to t=0, z=1, Pos1 misses an image at t=0, z=1 but has the later ones
+    meta_path = os.path.join(acq_path, 'Pos0', 'metadata.txt')
+    with open(meta_path, 'rb') as f:
+        data = f.read()
+    with open(meta_path, 'wb') as f:
+        f.write(data[:data.index(b'"FrameKey-0-4-1"') + 20])
+    os.remove(os.path.join(acq_path, 'Pos1', 'img_000000000_State2_001.tif'))
+
+    watcher = AcquisitionWatcher(img_io, CompletionManifest(str(tmp_path / 'manifest.jsonl'), 'hash'), 1)
+    stat_paths = []
+    exists = os.path.exists
+    monkeypatch.setattr(os.path, 'exists', lambda path: stat_paths.append(path) or exists(path))
+    assert watcher.ready_units() == {(0, 0): [0], (1, 0): [0]}
+    # 5 channels of Pos0 z=0, Pos1 z=0 and the first 3 channels of Pos1 z=1
+    assert len(stat_paths) == 13
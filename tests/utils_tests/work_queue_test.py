@@ -0,0 +1,96 @@
+import threading
+import time
+
+from ReconstructOrder.utils.work_queue import WorkQueue
+
+
+def _tasks():
+    return [(sample_idx, sample, pos_idx, t_idx) for sample_idx, sample in enumerate(['SM1', 'SM2'])
+            for pos_idx in range(2) for t_idx in range(3)]
+
+
+def test_work_queue_claim_complete(tmp_path):
+    """
+    tasks are claimed once in order, adding them again doesn't reset their state
+    """
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add_tasks(_tasks())
+    task = queue.claim('w1')
+    assert (task.sample_idx, task.sample, task.pos_idx, task.t_idx) == (0, 'SM1', 0, 0)
+    queue.complete(task, 'w1')
+    assert queue.claim('w2').task_id != task.task_id
+
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add_tasks(_tasks())
+    assert queue.counts() == {'pending': 10, 'running': 1, 'done': 1, 'failed': 0}
+
+
+def test_work_queue_repeated_sample(tmp_path):
+    """
+    a sample listed twice in the config, with different backgrounds, has the tasks of both entries
+    """
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add_tasks([(0, 'SM1', 0, 0), (1, 'SM1', 0, 0)])
+    queue.add_tasks([(0, 'SM1', 0, 0), (1, 'SM1', 0, 0)])
+    assert queue.counts()['pending'] == 2
+    assert [queue.claim('w1').sample_idx for _ in range(2)] == [0, 1]
+
+
+def test_work_queue_concurrent_claims(tmp_path):
+    """
+    concurrent workers never claim the same task
+    """
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    queue.add_tasks(_tasks())
+    claimed = []
+    lock = threading.Lock()
+
+    def work(worker):
+        worker_queue = WorkQueue(queue.db_path)
+        while True:
+            task = worker_queue.claim(worker)
+            if task is None:
+                return
+            with lock:
+                claimed.append(task.task_id)
+            worker_queue.complete(task, worker)
+
+    workers = [threading.Thread(target=work, args=('w{}'.format(idx),)) for idx in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted(claimed) == sorted(set(claimed))
+    assert len(claimed) == 12
+    assert queue.counts()['done'] == 12
+
+
+def test_work_queue_expired_lease(tmp_path):
+    """
+    the task of a crashed worker is claimed again after its lease expires, and fails after max_attempts
+    """
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_time=0.1, max_attempts=2)
+    queue.add_tasks(_tasks()[:1])
+    task = queue.claim('crashed')
+    assert queue.claim('w2') is None
+    time.sleep(0.2)
+    assert not queue.renew(task, 'w2')
+    task_again = queue.claim('w2')
+    assert task_again == task
+    assert not queue.renew(task, 'crashed')
+    assert queue.renew(task, 'w2')
+
+    queue.fail(task, 'w2', ValueError('bad image'))
+    assert queue.claim('w3') is None
+    failed = queue.failed_tasks()
+    assert len(failed) == 1
+    assert failed[0] == (task, 'bad image')
+
+
+def test_work_queue_retry_after_error(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), max_attempts=3)
+    queue.add_tasks(_tasks()[:1])
+    task = queue.claim('w1')
+    queue.fail(task, 'w1', 'out of memory')
+    assert queue.counts()['pending'] == 1
+    assert queue.claim('w2') == task
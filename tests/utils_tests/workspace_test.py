@@ -0,0 +1,38 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from ReconstructOrder.compute.reconstruct import ImgReconstructor, ReconstructionWorkspace
+
+from .conftest import random_intensity_data
+
+
+@pytest.mark.parametrize('precision', ['float32', 'float64'])
+@pytest.mark.parametrize('circularity', ['rcp', 'lcp'])
+def test_workspace_outputs(precision, circularity):
+    """
+    the reconstruction in the arrays of a workspace is the same as with new arrays, and reuses them
+    """
+    rng = np.random.default_rng(0)
+    int_bg = random_intensity_data(rng, (20, 30))
+    reconstructor = ImgReconstructor(int_bg, bg_method='Local_filter', n_slice_local_bg=3, kernel_size=5,
+                                     swing=0.03, azimuth_offset=7, circularity=circularity, precision=precision)
+    stokes_bg = reconstructor.stokes_normalization(reconstructor.compute_stokes(int_bg))
+    workspace = ReconstructionWorkspace(reconstructor.dtype)
+
+    for _ in range(2):
+        img_raw = np.stack([reconstructor.raw_intensities(random_intensity_data(rng, (20, 30))) for _ in range(3)], axis=-1)
+        norm_sample = reconstructor.stokes_normalization(reconstructor.compute_stokes_batch(img_raw))
+        expected = reconstructor.reconstruct_birefringence(reconstructor.correct_background(norm_sample, stokes_bg))
+
+        stokes = reconstructor.compute_stokes_batch(img_raw, out=workspace.stokes((20, 30, 3)))
+        norm_sample = reconstructor.stokes_normalization(stokes, out=workspace.normalized_stokes((20, 30, 3)))
+        norm_sample = reconstructor.correct_background(norm_sample, stokes_bg, out=norm_sample)
+        result = reconstructor.reconstruct_birefringence(norm_sample, out=workspace.physical_data((20, 30, 3)))
+        for name in ['I_trans', 'retard', 'azimuth', 'polarization']:
+            np.testing.assert_array_equal(getattr(result, name), getattr(expected, name))
+        assert np.shares_memory(result.retard, workspace.array('retard', (20, 30, 3)))
+
+    # a copy of the workspace allocates its own arrays
+    assert pickle.loads(pickle.dumps(workspace))._arrays == {}
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from ReconstructOrder.utils.mManagerIO import PolAcquReader
+from ReconstructOrder.utils.imgIO import export_img
+
+zarr = pytest.importorskip('zarr')
+from ReconstructOrder.utils.zarrIO import ZarrWriter, ZarrReader, is_zarr_store, _require_array
+
+
+def test_export_img_zarr(setup_mm_acquisition, tmp_path):
+    """
+    export_img writes into the (T, C, Z, Y, X) arrays of the Zarr store instead of tiff files
+    """
+    acq_path, _ = setup_mm_acquisition
+    img_io = PolAcquReader(acq_path)
+    img_io.output_chans = ['Retardance', 'Stokes_1', 'Retardance+Orientation']
+    store_path = str(tmp_path / 'out.zarr')
+    img_io.img_writer = ZarrWriter(store_path, img_io, chunks=[1, 1, 2, -1, -1])
+    img_io.img_writer.write_metadata({'Summary': img_io.input_meta_file['Summary']},
+                                     list(enumerate(img_io.pos_list)))
+
+    rng = np.random.RandomState(1)
+    written = {}
+    for t_idx in range(img_io.n_time):
+        for pos_idx in range(img_io.n_pos):
+            for z_idx in range(img_io.n_z):
+                img_io.t_idx, img_io.pos_idx, img_io.z_idx = t_idx, pos_idx, z_idx
+                img_dict = {'Retardance': rng.randint(0, 65535, (32, 40)).astype(np.uint16),
+                            'Stokes_1': rng.randn(32, 40).astype(np.float32),
+                            'Retardance+Orientation': rng.randint(0, 255, (32, 40, 3)).astype(np.uint8),
+                            'Orientation': np.zeros((32, 40), np.uint16)}
+                export_img(img_io, img_dict)
+                written[(t_idx, pos_idx, z_idx)] = img_dict
+
+    root = zarr.open_group(store_path, mode='r')
+    assert root.attrs['channel_names'] == ['Retardance', 'Stokes_1']
+    assert root.attrs['rgb_channel_names'] == ['Retardance+Orientation']
+    assert root.attrs['pos_table'] == [[0, 'Pos0'], [1, 'Pos1']]
+    assert root.attrs['metadata']['Summary']['Prefix'] == img_io.name
+    arr = root['Pos1']['0']
+    assert arr.shape == (2, 2, 3, 32, 40)
+    assert arr.dtype == np.float32
+    assert root['Pos0']['rgb'].shape == (2, 1, 3, 32, 40, 3)
+    for (t_idx, pos_idx, z_idx), img_dict in written.items():
+        pos = root['Pos%d' % pos_idx]
+        assert_array_equal(pos['0'][t_idx, 0, z_idx], img_dict['Retardance'])
+        assert_array_equal(pos['0'][t_idx, 1, z_idx], img_dict['Stokes_1'])
+        assert_array_equal(pos['rgb'][t_idx, 0, z_idx], img_dict['Retardance+Orientation'])
+
+
+def write_zarr_acquisition(store_path, img_io, z_chunk):
+    """copy a tiff acquisition into a Zarr store with one group per position"""
+    root = zarr.open_group(store_path, mode='w')
+    root.attrs.update({'channel_names': img_io.channels,
+                       'metadata': {'Summary': img_io.input_meta_file['Summary']}})
+    for pos_idx, pos_name in enumerate(img_io.pos_list):
+        img_io.img_in_pos_path = img_io.img_sm_path + '/' + pos_name
+        img_io.pos_idx = pos_idx
+        shape = (img_io.n_time, len(img_io.channels), img_io.n_z, img_io.height, img_io.width)
+        array = _require_array(root.require_group(pos_name), '0', shape=shape, dtype=np.uint16,
+                               chunks=(1, 1, z_chunk) + shape[3:])
+        for t_idx in range(img_io.n_time):
+            img_io.t_idx = t_idx
+            array[t_idx] = img_io.read_img_stack(dtype=None)
+
+
+def test_zarr_reader(setup_mm_acquisition, tmp_path):
+    """
+    ZarrReader has the reader interface of PolAcquReader and decodes each chunk once
+    """
+    acq_path, imgs = setup_mm_acquisition
+    store_path = str(tmp_path / 'acq.zarr')
+    write_zarr_acquisition(store_path, PolAcquReader(acq_path), z_chunk=3)
+    assert is_zarr_store(store_path)
+    assert not is_zarr_store(acq_path)
+
+    img_io = ZarrReader(store_path, cache_size=2)
+    assert img_io.pos_list == ['Pos0', 'Pos1']
+    assert (img_io.n_time, img_io.n_z, img_io.height, img_io.width) == (2, 3, 32, 40)
+    assert img_io.input_chans == ['State0', 'State1', 'State2', 'State3', 'State4']
+    assert (img_io.swing, img_io.wavelength, img_io.blackLevel) == (0.03, 532, 100)
+    # the reader state is initialized by mManagerReader._init_state
+    assert set(vars(PolAcquReader(acq_path))) - set(vars(img_io)) == {'meta_parser'}
+
+    loads = []
+    block_loader = img_io._chunk_cache.get
+    img_io._chunk_cache.get = lambda key, load: block_loader(key, lambda: loads.append(key) or load())
+    img_io.img_in_pos_path = store_path + '/Pos1'
+    img_io.pos_idx, img_io.t_idx, img_io.chan_idx = 1, 1, 2
+    for z_idx in range(3):
+        img_io.z_idx = z_idx
+        img = img_io.read_img()
+        assert img.dtype == np.float32
+        assert_array_equal(img, imgs[('State2', 1, 1, z_idx)])
+    assert loads == [('Pos1', 1, 2, 0)]
+
+    stack = img_io.read_img_stack(chan_names=['State4', 'State0'], roi=[2, 4, 16, 20], black_level=100)
+    assert_array_equal(stack[0, 2], imgs[('State4', 1, 1, 2)][2:18, 4:24].astype(np.float32) - 100)
+    assert_array_equal(stack[1, 0], imgs[('State0', 1, 1, 0)][2:18, 4:24].astype(np.float32) - 100)